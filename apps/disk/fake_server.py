@@ -0,0 +1,491 @@
+"""
+Fake Yandex.Disk public API.
+Serves a generated folder tree over HTTP for offline testing and
+benchmarking; point settings.YANDEX_DISK_API_URL at FakeDiskServer.api_url.
+"""
+
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+from urllib.parse import parse_qs, urlencode, urlparse
+import json
+import logging
+import mimetypes
+import multiprocessing
+import random
+import threading
+import time
+import zipfile
+
+logger = logging.getLogger(__name__)
+
+API_PREFIX = "/v1/disk/public"
+DOWNLOAD_PATH = "/download"
+CHUNK_SIZE = 64 * 1024
+DEFAULT_LIMIT = 20
+
+# File content is generated in blocks of this size
+CONTENT_BLOCK_SIZE = 64 * 1024
+
+# API sort keys -> FakeResource attributes; files are created and modified
+# at the same time
+SORT_FIELDS = {
+    "name": "name",
+    "size": "size",
+    "created": "modified",
+    "modified": "modified",
+}
+
+# Timestamps of generated resources are spread over a year from this date
+EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+
+
+@dataclass
+class FakeDiskConfig:
+    """
+    Shape and behaviour of the fake API.
+
+    Attributes:
+        depth: Levels of nested folders below the root
+        folders: Subfolders in each folder above the deepest level
+        files: Files in each folder
+        min_file_size: Smallest generated file in bytes
+        max_file_size: Largest generated file in bytes
+        latency: Seconds added before every response
+        jitter: Upper bound of random seconds added to the latency
+        bandwidth: Download speed cap in bytes per second per response,
+            0 for no cap
+        error_rate: Share of requests answered with error_status
+        error_status: Status of injected errors; 429 and 503 carry
+            ``Retry-After: 1``
+        seed: Seed of the generated tree and of injected latency and errors
+        extensions: File name extensions, assigned to files in turn
+    """
+
+    depth: int = 2
+    folders: int = 3
+    files: int = 10
+    min_file_size: int = 1024
+    max_file_size: int = 1024 * 1024
+    latency: float = 0.0
+    jitter: float = 0.0
+    bandwidth: int = 0
+    error_rate: float = 0.0
+    error_status: int = 503
+    seed: int = 0
+    extensions: Tuple[str, ...] = (".bin",)
+
+
+@dataclass
+class FakeResource:
+    """A generated file or folder."""
+
+    name: str
+    path: str
+    type: str
+    size: int = 0
+    modified: str = ""
+    seed: int = 0
+    children: List["FakeResource"] = field(default_factory=list)
+
+    def to_item(self) -> Dict[str, Any]:
+        """Return the resource as the API lists it."""
+        item = {
+            "name": self.name,
+            "path": self.path,
+            "type": self.type,
+            "created": self.modified,
+            "modified": self.modified,
+        }
+        if self.type == "file":
+            item["size"] = self.size
+            item["mime_type"] = (
+                mimetypes.guess_type(self.name)[0] or "application/octet-stream"
+            )
+        return item
+
+    def read(self, start: int, end: int) -> bytes:
+        """
+        Return bytes ``start`` to ``end`` (exclusive) of the file content.
+
+        The content is a pseudo-random stream seeded by the tree seed, the
+        path and the block number, so it is stable across runs without being
+        stored, does not compress, and any range can be generated directly.
+        """
+        parts = []
+        index, offset = divmod(start, CONTENT_BLOCK_SIZE)
+        while start < end:
+            block = random.Random(f"{self.seed}:{self.path}:{index}").randbytes(
+                CONTENT_BLOCK_SIZE
+            )
+            part = block[offset : offset + end - start]
+            parts.append(part)
+            start += len(part)
+            index, offset = index + 1, 0
+        return b"".join(parts)
+
+
+class FakeDiskTree:
+    """Deterministic folder tree indexed by path."""
+
+    def __init__(self, config: FakeDiskConfig):
+        self.config = config
+        self.revision = 1_000_000 + config.seed
+        self._random = random.Random(config.seed)
+        self.resources: Dict[str, FakeResource] = {}
+        self.root = self._add_folder("", "/", 0)
+
+    def get(self, path: Optional[str]) -> Optional[FakeResource]:
+        """Look up a resource by path; the root if ``path`` is empty."""
+        return self.resources.get("/" + (path or "").strip("/"))
+
+    def _add_folder(self, name: str, path: str, level: int) -> FakeResource:
+        folder = FakeResource(name=name, path=path, type="dir")
+        folder.modified = self._timestamp()
+        self.resources[path] = folder
+        prefix = path.rstrip("/")
+        if level < self.config.depth:
+            for i in range(self.config.folders):
+                folder.children.append(
+                    self._add_folder(f"folder_{i}", f"{prefix}/folder_{i}", level + 1)
+                )
+        for i in range(self.config.files):
+            extension = self.config.extensions[i % len(self.config.extensions)]
+            file = FakeResource(
+                name=f"file_{i}{extension}",
+                path=f"{prefix}/file_{i}{extension}",
+                type="file",
+                size=self._random.randint(
+                    self.config.min_file_size, self.config.max_file_size
+                ),
+                modified=self._timestamp(),
+                seed=self.config.seed,
+            )
+            self.resources[file.path] = file
+            folder.children.append(file)
+        return folder
+
+    def _timestamp(self) -> str:
+        offset = timedelta(seconds=self._random.randrange(365 * 24 * 60 * 60))
+        return (EPOCH + offset).isoformat()
+
+
+class FakeDiskHandler(BaseHTTPRequestHandler):
+    """Request handler of FakeDiskServer."""
+
+    protocol_version = "HTTP/1.1"
+    # Headers and body are separate writes; keep-alive clients would wait
+    # for delayed ACKs on the second one
+    disable_nagle_algorithm = True
+    server: "FakeDiskServer"
+
+    def do_GET(self) -> None:
+        parsed = urlparse(self.path)
+        params = {name: values[0] for name, values in parse_qs(parsed.query).items()}
+
+        self.server.delay()
+        if self.server.should_fail():
+            self._send_error(self.server.config.error_status, "InjectedError")
+            return
+
+        if parsed.path == f"{API_PREFIX}/resources":
+            self._get_resource(params)
+        elif parsed.path == f"{API_PREFIX}/resources/download":
+            self._get_download_link(params)
+        elif parsed.path == DOWNLOAD_PATH:
+            self._download(params)
+        else:
+            self._send_error(404, "NotFoundError")
+
+    def _get_resource(self, params: Dict[str, str]) -> None:
+        resource = self._find(params)
+        if resource is None:
+            return
+        data = resource.to_item()
+        data["public_key"] = params["public_key"]
+        if resource.type == "file":
+            self._send_json(data)
+            return
+
+        try:
+            offset = max(0, int(params.get("offset", 0)))
+            limit = max(0, int(params.get("limit", DEFAULT_LIMIT)))
+        except ValueError:
+            self._send_error(400, "FieldValidationError")
+            return
+        sort = params.get("sort", "name")
+        items = resource.children
+        sort_field = SORT_FIELDS.get(sort.lstrip("-"))
+        if sort_field:
+            items = sorted(
+                items,
+                key=lambda child: getattr(child, sort_field),
+                reverse=sort.startswith("-"),
+            )
+
+        data["revision"] = self.server.tree.revision
+        data["_embedded"] = {
+            "items": [child.to_item() for child in items[offset : offset + limit]],
+            "offset": offset,
+            "limit": limit,
+            "total": len(items),
+            "sort": sort,
+            "path": resource.path,
+            "public_key": params["public_key"],
+        }
+        self._send_json(data)
+
+    def _get_download_link(self, params: Dict[str, str]) -> None:
+        resource = self._find(params)
+        if resource is None:
+            return
+        host, port = self.server.server_address[:2]
+        query = urlencode({"public_key": params["public_key"], "path": resource.path})
+        self._send_json(
+            {
+                "href": f"http://{host}:{port}{DOWNLOAD_PATH}?{query}",
+                "method": "GET",
+                "templated": False,
+            }
+        )
+
+    def _download(self, params: Dict[str, str]) -> None:
+        resource = self._find(params)
+        if resource is None:
+            return
+        if resource.type == "dir":
+            self._download_folder(resource)
+            return
+
+        try:
+            start, end = _parse_range(self.headers.get("Range"), resource.size)
+        except ValueError:
+            self.send_response(416)
+            self.send_header("Content-Range", f"bytes */{resource.size}")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+            return
+
+        partial = end - start < resource.size
+        self.send_response(206 if partial else 200)
+        self.send_header("Content-Type", "application/octet-stream")
+        self.send_header("Content-Length", str(end - start))
+        self.send_header("Accept-Ranges", "bytes")
+        if partial:
+            self.send_header(
+                "Content-Range", f"bytes {start}-{end - 1}/{resource.size}"
+            )
+        self.end_headers()
+
+        writer = _ThrottledWriter(self.wfile, self.server.config.bandwidth)
+        for offset in range(start, end, CHUNK_SIZE):
+            writer.write(resource.read(offset, min(end, offset + CHUNK_SIZE)))
+
+    def _download_folder(self, folder: FakeResource) -> None:
+        """Stream a folder as a zip archive, like the real API does."""
+        self.send_response(200)
+        self.send_header("Content-Type", "application/zip")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        writer = _ThrottledWriter(self.wfile, self.server.config.bandwidth)
+        prefix = folder.path.rstrip("/")
+        with zipfile.ZipFile(writer, "w") as archive:
+            for resource in self.server.tree.resources.values():
+                if resource.type != "file" or not resource.path.startswith(
+                    prefix + "/"
+                ):
+                    continue
+                name = resource.path[len(prefix) + 1 :]
+                with archive.open(name, "w", force_zip64=True) as entry:
+                    for offset in range(0, resource.size, CHUNK_SIZE):
+                        entry.write(
+                            resource.read(
+                                offset, min(resource.size, offset + CHUNK_SIZE)
+                            )
+                        )
+
+    def _find(self, params: Dict[str, str]) -> Optional[FakeResource]:
+        """Resolve the requested resource, answering with an error if missing."""
+        if not params.get("public_key"):
+            self._send_error(400, "FieldValidationError")
+            return None
+        resource = self.server.tree.get(params.get("path"))
+        if resource is None:
+            self._send_error(404, "DiskNotFoundError")
+        return resource
+
+    def _send_json(self, data: Dict[str, Any], status: int = 200) -> None:
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(body)))
+        if status in (429, 503):
+            self.send_header("Retry-After", "1")
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_error(self, status: int, error: str) -> None:
+        self._send_json(
+            {"error": error, "message": self.responses.get(status, ("",))[0]},
+            status=status,
+        )
+
+    def log_message(self, format: str, *args) -> None:
+        logger.debug(f"{self.address_string()} {format % args}")
+
+
+class FakeDiskServer(ThreadingHTTPServer):
+    """Threaded HTTP server of the fake API."""
+
+    daemon_threads = True
+
+    def __init__(
+        self,
+        config: Optional[FakeDiskConfig] = None,
+        host: str = "127.0.0.1",
+        port: int = 0,
+    ):
+        """
+        Generate the tree and bind the server.
+
+        Args:
+            config: Tree shape and behaviour, defaults to FakeDiskConfig()
+            host: Interface to listen on
+            port: Port to listen on, 0 for any free port
+        """
+        self.config = config or FakeDiskConfig()
+        self.tree = FakeDiskTree(self.config)
+        self._random = random.Random(self.config.seed)
+        self._random_lock = threading.Lock()
+        self._thread: Optional[threading.Thread] = None
+        super().__init__((host, port), FakeDiskHandler)
+
+    @property
+    def api_url(self) -> str:
+        """Base URL to use as settings.YANDEX_DISK_API_URL."""
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}{API_PREFIX}"
+
+    def start(self) -> "FakeDiskServer":
+        """Serve requests on a background thread."""
+        self._thread = threading.Thread(
+            target=self.serve_forever, name="fake-yandex-disk", daemon=True
+        )
+        self._thread.start()
+        return self
+
+    def stop(self) -> None:
+        """Stop serving and release the socket."""
+        self.shutdown()
+        self.server_close()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+
+    def delay(self) -> None:
+        """Sleep for the configured latency."""
+        latency = self.config.latency
+        if self.config.jitter:
+            with self._random_lock:
+                latency += self._random.uniform(0, self.config.jitter)
+        if latency > 0:
+            time.sleep(latency)
+
+    def should_fail(self) -> bool:
+        """Decide whether to inject an error into the current response."""
+        if self.config.error_rate <= 0:
+            return False
+        with self._random_lock:
+            return self._random.random() < self.config.error_rate
+
+
+@contextmanager
+def run_fake_server(
+    config: Optional[FakeDiskConfig] = None, host: str = "127.0.0.1"
+) -> Iterator[str]:
+    """
+    Run a FakeDiskServer in a child process.
+
+    Keeps the server's CPU time and memory out of measurements taken in the
+    calling process.
+
+    Args:
+        config: Tree shape and behaviour, defaults to FakeDiskConfig()
+        host: Interface to listen on
+
+    Yields:
+        API URL of the server
+    """
+    context = multiprocessing.get_context("spawn")
+    receiver, sender = context.Pipe(duplex=False)
+    process = context.Process(
+        target=_serve, args=(config, host, sender), name="fake-yandex-disk"
+    )
+    process.daemon = True
+    process.start()
+    try:
+        if not receiver.poll(30):
+            raise RuntimeError("Fake Yandex.Disk server did not start")
+        yield receiver.recv()
+    finally:
+        process.terminate()
+        process.join()
+
+
+def _serve(config: Optional[FakeDiskConfig], host: str, sender) -> None:
+    server = FakeDiskServer(config, host)
+    sender.send(server.api_url)
+    server.serve_forever()
+
+
+class _ThrottledWriter:
+    """Write-only stream capping the rate of the stream it wraps."""
+
+    def __init__(self, stream, bandwidth: int):
+        self.stream = stream
+        self.bandwidth = bandwidth
+        self.written = 0
+        self.started = time.monotonic()
+
+    def write(self, data: bytes) -> int:
+        self.stream.write(data)
+        self.written += len(data)
+        if self.bandwidth > 0:
+            ahead = self.written / self.bandwidth - (time.monotonic() - self.started)
+            if ahead > 0:
+                time.sleep(ahead)
+        return len(data)
+
+    def flush(self) -> None:
+        self.stream.flush()
+
+
+def _parse_range(header: Optional[str], size: int) -> Tuple[int, int]:
+    """
+    Parse a single ``bytes=`` range.
+
+    Returns:
+        Start and exclusive end of the requested bytes; the whole file if
+        the header is missing or malformed
+
+    Raises:
+        ValueError: If the range cannot be satisfied
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return 0, size
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    if not (first or last).isdigit() or (first and last and not last.isdigit()):
+        return 0, size
+    if not first:
+        if int(last) == 0:
+            raise ValueError("Range not satisfiable")
+        return max(0, size - int(last)), size
+    start = int(first)
+    end = min(size, int(last) + 1) if last else size
+    if start >= size or end <= start:
+        raise ValueError("Range not satisfiable")
+    return start, end
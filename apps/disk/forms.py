@@ -25,3 +25,9 @@ class PublicLinkForm(forms.Form):
         ],
         widget=forms.Select(attrs={"class": "form-control"}),
     )
+
+    recursive = forms.BooleanField(
+        label=_("Include subfolders"),
+        required=False,
+        widget=forms.CheckboxInput(attrs={"class": "form-check-input"}),
+    )
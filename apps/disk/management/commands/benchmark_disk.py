@@ -0,0 +1,577 @@
+"""
+Benchmark the disk service hot paths against the fake Yandex.Disk API.
+"""
+
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+import json
+import mimetypes
+import os
+import pickle
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.core.paginator import Paginator
+from django.test import RequestFactory, override_settings
+
+from apps.disk import views
+from apps.disk.fake_server import FakeDiskConfig, run_fake_server
+from apps.disk.services.cache_service import CacheService
+from apps.disk.services.disk_service import YandexDiskFile, YandexDiskService
+from apps.disk.services.file_types import FILE_TYPE_FILTERS, get_file_category
+from apps.disk.services.listing_codec import decode_listing, encode_listing
+from apps.disk.services.listing_columns import ListingColumns
+from apps.disk.services.listing_index import ListingIndex
+from apps.disk.services.rate_limiter import api_limiter
+
+# Version of the result document layout
+RESULTS_VERSION = 1
+
+# Seconds between resident memory samples
+RSS_SAMPLE_INTERVAL = 0.01
+
+MB = 1024 * 1024
+GB = 1024 * MB
+
+# Extensions cycled through by synthetic listings, covering every file type
+SYNTHETIC_EXTENSIONS = (".jpg", ".txt", ".mp4", ".pdf", ".mp3", ".zip", ".bin")
+
+
+class Command(BaseCommand):
+    help = (
+        "Measure listing, link resolution, single-file proxy and archive "
+        "performance against a local fake Yandex.Disk API, the memory and "
+        "filter time of large cached listings and the size and speed of "
+        "their cache encoding, and write the results as JSON."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--listing-sizes",
+            default="100,1000,10000",
+            help="Comma-separated folder sizes for the listing benchmark",
+        )
+        parser.add_argument(
+            "--index-size",
+            type=int,
+            default=100_000,
+            help="Entries of the synthetic listing for the index and codec benchmarks",
+        )
+        parser.add_argument(
+            "--links", type=int, default=500, help="Download links to resolve"
+        )
+        parser.add_argument(
+            "--file-size",
+            type=int,
+            default=256 * MB,
+            help="Size in bytes of the file proxied by the single-file benchmark",
+        )
+        parser.add_argument(
+            "--archive-files", type=int, default=50, help="Files per archive"
+        )
+        parser.add_argument(
+            "--archive-file-size",
+            type=int,
+            default=4 * MB,
+            help="Size in bytes of each archived file",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Milliseconds of latency added by the fake API",
+        )
+        parser.add_argument(
+            "--repeat", type=int, default=3, help="Runs per measurement"
+        )
+        parser.add_argument(
+            "--api-rate",
+            type=float,
+            default=0,
+            help="API rate limit in calls per second, 0 to lift it",
+        )
+        parser.add_argument(
+            "--only",
+            default="",
+            help=(
+                "Comma-separated benchmarks to run: listing, index, codec, "
+                "links, proxy, archive"
+            ),
+        )
+        parser.add_argument("--output", help="Write results to this file")
+        parser.add_argument(
+            "--compare", help="Results file of a baseline run to compare against"
+        )
+
+    def handle(self, *args, **options):
+        benchmarks = {
+            "listing": self.bench_listing,
+            "index": self.bench_index,
+            "codec": self.bench_codec,
+            "links": self.bench_links,
+            "proxy": self.bench_proxy,
+            "archive": self.bench_archive,
+        }
+        selected = [name for name in options["only"].split(",") if name] or list(
+            benchmarks
+        )
+        unknown = set(selected) - set(benchmarks)
+        if unknown:
+            raise CommandError(f"Unknown benchmarks: {', '.join(sorted(unknown))}")
+
+        self.options = options
+        self.results: List[Dict[str, Any]] = []
+        # Files are proxied from upstream every time, not from the blob cache
+        with override_settings(YANDEX_DISK_BLOB_CACHE_MAX_BYTES=0), _api_rate(
+            options["api_rate"]
+        ):
+            for name in selected:
+                benchmarks[name]()
+
+        document = {
+            "version": RESULTS_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "options": {
+                name: options[name]
+                for name in (
+                    "listing_sizes",
+                    "index_size",
+                    "links",
+                    "file_size",
+                    "archive_files",
+                    "archive_file_size",
+                    "latency",
+                    "repeat",
+                    "api_rate",
+                )
+            },
+            "results": self.results,
+        }
+        output = json.dumps(document, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+        if options["compare"]:
+            self.compare(options["compare"])
+
+    def bench_listing(self) -> None:
+        """Folder listing from the API and from the cache, by folder size."""
+        for size in _parse_sizes(self.options["listing_sizes"]):
+            config = self._config(depth=0, files=size, max_file_size=1024)
+            with self._upstream(config):
+                service = YandexDiskService()
+
+                def fetch() -> None:
+                    public_key = f"bench-{uuid.uuid4().hex}"
+                    CacheService.fetch_listing(
+                        public_key,
+                        "",
+                        False,
+                        lambda: (service.get_public_resources(public_key), {}),
+                    )
+
+                self._record("listing_fetch", {"files": size}, self._time(fetch), size)
+
+                public_key = f"bench-{uuid.uuid4().hex}"
+                CacheService.fetch_listing(
+                    public_key,
+                    "",
+                    False,
+                    lambda: (service.get_public_resources(public_key), {}),
+                )
+                self._record(
+                    "listing_cached",
+                    {"files": size},
+                    self._time(
+                        lambda: CacheService.get_cached_listing(public_key, ""),
+                        repeat=self.options["repeat"] * 10,
+                    ),
+                    size,
+                )
+
+    def bench_index(self) -> None:
+        """Memory and filter time of a large listing, as objects and as columns."""
+        count = self.options["index_size"]
+        params = {"files": count}
+        files, object_bytes = _traced(lambda: _synthetic_listing(count))
+        columns, column_bytes = _traced(lambda: ListingColumns(files))
+        index, index_bytes = _traced(lambda: ListingIndex(columns))
+        self.results.append(
+            {
+                "benchmark": "listing_memory",
+                "params": params,
+                "objects_mb": round(object_bytes / MB, 2),
+                "columns_mb": round(column_bytes / MB, 2),
+                "index_mb": round(index_bytes / MB, 2),
+            }
+        )
+        self.stderr.write(
+            f"listing_memory {params}: {object_bytes / MB:.1f} MB as objects, "
+            f"{column_bytes / MB:.1f} MB as columns, {index_bytes / MB:.1f} MB index"
+        )
+
+        self._record(
+            "listing_index_build",
+            params,
+            self._time(lambda: ListingIndex(columns)),
+            count,
+        )
+        page_size = settings.YANDEX_DISK_BROWSER_PAGE_SIZE
+        repeat = self.options["repeat"] * 10
+        for file_type in FILE_TYPE_FILTERS:
+            type_params = {**params, "file_type": file_type}
+
+            def indexed() -> None:
+                selection = index.select(columns, file_type, "-size")
+                Paginator(selection, page_size).get_page(2).object_list
+
+            def scanned() -> None:
+                selection = sorted(
+                    (f for f in files if get_file_category(f.mime_type) == file_type),
+                    key=lambda f: f.size,
+                    reverse=True,
+                )
+                Paginator(selection, page_size).get_page(2).object_list
+
+            self._record(
+                "listing_filter_indexed", type_params, self._time(indexed, repeat)
+            )
+            self._record("listing_filter_scan", type_params, self._time(scanned))
+
+    def bench_codec(self) -> None:
+        """Size and speed of the listing cache format against pickle."""
+        count = self.options["index_size"]
+        files = _synthetic_listing(count)
+        columns = ListingColumns(files)
+        index = ListingIndex(columns)
+        validators = {"revision": 1, "total": count}
+
+        def encode_pickle() -> bytes:
+            return pickle.dumps(files, pickle.HIGHEST_PROTOCOL)
+
+        def encode_codec() -> bytes:
+            return encode_listing(columns, index, validators, 0.0)
+
+        # Listings were cached as pickled lists before the codec
+        cases = [
+            ("pickle", False, encode_pickle, pickle.loads),
+            ("codec", False, encode_codec, decode_listing),
+            ("codec", True, encode_codec, decode_listing),
+        ]
+        for name, compress, encode, decode in cases:
+            params = {"files": count, "format": name, "compressed": compress}
+            with override_settings(
+                YANDEX_DISK_LISTING_COMPRESS_THRESHOLD=1 if compress else 0
+            ):
+                data = encode()
+                result = self._record(
+                    "listing_encode", params, self._time(encode), count
+                )
+                result["bytes"] = len(data)
+                self._record(
+                    "listing_decode", params, self._time(lambda: decode(data)), count
+                )
+
+    def bench_links(self) -> None:
+        """Download link resolution throughput."""
+        count = self.options["links"]
+        config = self._config(depth=0, files=count, max_file_size=1024)
+        paths = [f"/file_{i}.bin" for i in range(count)]
+        with self._upstream(config):
+            service = YandexDiskService()
+            timings = self._time(lambda: service.resolve_download_links("bench", paths))
+        self._record("link_resolution", {"links": count}, timings, count)
+
+    def bench_proxy(self) -> None:
+        """Single-file proxy throughput and CPU time."""
+        size = self.options["file_size"]
+        config = self._config(depth=0, files=1, min_file_size=size, max_file_size=size)
+        factory = RequestFactory()
+        with self._upstream(config):
+            cpu_times = []
+
+            def proxy() -> None:
+                request = factory.get(
+                    "/download/",
+                    {"public_key": f"bench-{uuid.uuid4().hex}", "path": "file_0.bin"},
+                )
+                # Downloads require a login; the user is never saved
+                request.user = User(username="bench")
+                started = time.process_time()
+                response = views.download_resource(request)
+                received = _consume(response.streaming_content)
+                cpu_times.append(time.process_time() - started)
+                if received != size:
+                    raise CommandError(f"Proxied {received} of {size} bytes")
+
+            timings = self._time(proxy)
+        result = self._record("file_proxy", {"bytes": size}, timings)
+        result["mb_per_second"] = round(size / MB / result["median_seconds"], 2)
+        result["cpu_seconds_per_gb"] = round(
+            statistics.median(cpu_times) * GB / size, 3
+        )
+
+    def bench_archive(self) -> None:
+        """Archive build time and peak memory of both archive paths."""
+        count = self.options["archive_files"]
+        size = self.options["archive_file_size"]
+        config = self._config(
+            depth=0, files=count, min_file_size=size, max_file_size=size
+        )
+        params = {"files": count, "file_bytes": size}
+        factory = RequestFactory()
+        with self._upstream(config):
+            service = YandexDiskService()
+            paths = [f"/file_{i}.bin" for i in range(count)]
+            links = service.resolve_download_links("bench", paths)
+            zip_files = [
+                {"name": path.lstrip("/"), "download_url": link}
+                for path, link in zip(paths, links)
+            ]
+            self._record_archive(
+                "create_zip", params, lambda: service.create_zip(zip_files)
+            )
+
+            def handle_multiple_files() -> Iterable[bytes]:
+                # A new public key per run, so links are resolved every time
+                public_key = f"bench-{uuid.uuid4().hex}"
+                selection = [
+                    {
+                        "public_key": public_key,
+                        "path": path,
+                        "name": path.lstrip("/"),
+                        "type": "file",
+                    }
+                    for path in paths
+                ]
+                request = factory.post(
+                    "/download_files/",
+                    json.dumps({"files": selection, "format": "zip"}),
+                    content_type="application/json",
+                )
+                return views._handle_multiple_files(request).streaming_content
+
+            self._record_archive("handle_multiple_files", params, handle_multiple_files)
+
+    def compare(self, path: str) -> None:
+        """Print the change of each median against a baseline run."""
+        try:
+            with open(path) as f:
+                baseline = json.load(f)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read baseline {path}: {e}")
+
+        def identity(result: Dict[str, Any]) -> str:
+            return json.dumps([result["benchmark"], result["params"]], sort_keys=True)
+
+        previous = {identity(result): result for result in baseline["results"]}
+        self.stderr.write(f"Compared to {baseline.get('commit') or path}:")
+        for result in self.results:
+            old = previous.get(identity(result))
+            if old is None:
+                continue
+            for metric in (
+                "median_seconds",
+                "peak_rss_mb",
+                "cpu_seconds_per_gb",
+                "columns_mb",
+                "index_mb",
+                "bytes",
+            ):
+                if metric in result and old.get(metric):
+                    change = (result[metric] - old[metric]) / old[metric] * 100
+                    self.stderr.write(
+                        f"  {result['benchmark']} {result['params']} {metric}: "
+                        f"{old[metric]} -> {result[metric]} ({change:+.1f}%)"
+                    )
+
+    def _record_archive(
+        self, name: str, params: Dict[str, Any], build: Callable[[], Iterable[bytes]]
+    ) -> None:
+        sizes = []
+        peaks = []
+
+        def run() -> None:
+            with _PeakRss() as rss:
+                sizes.append(_consume(build()))
+            peaks.append(rss.peak_delta)
+
+        result = self._record(f"archive_{name}", params, self._time(run))
+        result["archive_bytes"] = sizes[-1]
+        result["peak_rss_mb"] = round(max(peaks) / MB, 1)
+
+    def _record(
+        self,
+        name: str,
+        params: Dict[str, Any],
+        timings: List[float],
+        items: Optional[int] = None,
+    ) -> Dict[str, Any]:
+        median = statistics.median(timings)
+        result = {
+            "benchmark": name,
+            "params": params,
+            "runs": len(timings),
+            "median_seconds": round(median, 6),
+            "min_seconds": round(min(timings), 6),
+            "max_seconds": round(max(timings), 6),
+        }
+        if items:
+            result["items_per_second"] = round(items / median, 1)
+        self.results.append(result)
+        self.stderr.write(f"{name} {params}: {median:.4f}s median")
+        return result
+
+    def _time(
+        self, run: Callable[[], Any], repeat: Optional[int] = None
+    ) -> List[float]:
+        timings = []
+        for _ in range(repeat or self.options["repeat"]):
+            started = time.perf_counter()
+            run()
+            timings.append(time.perf_counter() - started)
+        return timings
+
+    def _config(self, **fields) -> FakeDiskConfig:
+        return FakeDiskConfig(latency=self.options["latency"] / 1000, **fields)
+
+    @contextmanager
+    def _upstream(self, config: FakeDiskConfig) -> Iterator[None]:
+        """Run the fake API and point the services at it."""
+        with run_fake_server(config) as api_url:
+            with override_settings(YANDEX_DISK_API_URL=api_url):
+                yield
+
+
+class _PeakRss:
+    """Highest resident memory above the starting level while active."""
+
+    def __init__(self):
+        self.peak_delta = 0
+        self._stop = threading.Event()
+
+    def __enter__(self) -> "_PeakRss":
+        self._baseline = _rss()
+        self._thread = threading.Thread(target=self._sample, daemon=True)
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._stop.set()
+        self._thread.join()
+        self._update()
+
+    def _sample(self) -> None:
+        while not self._stop.wait(RSS_SAMPLE_INTERVAL):
+            self._update()
+
+    def _update(self) -> None:
+        self.peak_delta = max(self.peak_delta, _rss() - self._baseline)
+
+
+def _rss() -> int:
+    """Resident memory of the process in bytes."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        # Peak instead of current usage where /proc is not available
+        maxrss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        return maxrss if sys.platform == "darwin" else maxrss * 1024
+
+
+@contextmanager
+def _api_rate(rate: float) -> Iterator[None]:
+    """Set the API rate limit of this process, lifting it for a rate of 0."""
+    saved = api_limiter.max_rate
+    api_limiter.max_rate = rate or 1_000_000
+    try:
+        yield
+    finally:
+        api_limiter.max_rate = saved
+
+
+def _synthetic_listing(count: int) -> List[YandexDiskFile]:
+    """Build a folder listing of ``count`` files of every type."""
+    started = datetime(2024, 1, 1, tzinfo=timezone.utc)
+    files = []
+    for i in range(count):
+        extension = SYNTHETIC_EXTENSIONS[i % len(SYNTHETIC_EXTENSIONS)]
+        name = f"file_{i}{extension}"
+        timestamp = (started + timedelta(seconds=i * 37)).isoformat()
+        files.append(
+            YandexDiskFile(
+                name=name,
+                path=f"folder/{name}",
+                type="file",
+                size=(i * 7919) % (64 * MB),
+                created=timestamp,
+                modified=timestamp,
+                mime_type=mimetypes.guess_type(name)[0] or "application/octet-stream",
+                public_key="bench",
+            )
+        )
+    return files
+
+
+def _traced(build: Callable[[], Any]) -> Tuple[Any, int]:
+    """Return the result of ``build`` and the bytes it keeps allocated."""
+    tracemalloc.start()
+    try:
+        result = build()
+        allocated, _ = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    return result, allocated
+
+
+def _consume(chunks: Iterable[bytes]) -> int:
+    """Read a response body, returning its size."""
+    size = 0
+    try:
+        for chunk in chunks:
+            size += len(chunk)
+    finally:
+        close = getattr(chunks, "close", None)
+        if close is not None:
+            close()
+    return size
+
+
+def _parse_sizes(value: str) -> List[int]:
+    try:
+        return [int(size) for size in value.split(",") if size]
+    except ValueError:
+        raise CommandError(f"Invalid folder sizes: {value}")
+
+
+def _git_commit() -> Optional[str]:
+    try:
+        result = subprocess.run(
+            ["git", "rev-parse", "HEAD"],
+            cwd=settings.BASE_DIR,
+            capture_output=True,
+            text=True,
+            timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return result.stdout.strip() or None
@@ -0,0 +1,102 @@
+"""
+Run the fake Yandex.Disk public API.
+"""
+
+from django.core.management.base import BaseCommand
+
+from apps.disk.fake_server import FakeDiskConfig, FakeDiskServer
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a generated folder tree through a local stand-in for the "
+        "Yandex.Disk public API. Point YANDEX_DISK_API_URL at the printed URL."
+    )
+
+    def add_arguments(self, parser):
+        defaults = FakeDiskConfig()
+        parser.add_argument("--host", default="127.0.0.1")
+        parser.add_argument("--port", type=int, default=8765)
+        parser.add_argument(
+            "--depth",
+            type=int,
+            default=defaults.depth,
+            help="Levels of nested folders below the root",
+        )
+        parser.add_argument(
+            "--folders",
+            type=int,
+            default=defaults.folders,
+            help="Subfolders per folder",
+        )
+        parser.add_argument(
+            "--files", type=int, default=defaults.files, help="Files per folder"
+        )
+        parser.add_argument(
+            "--min-size",
+            type=int,
+            default=defaults.min_file_size,
+            help="Smallest file size in bytes",
+        )
+        parser.add_argument(
+            "--max-size",
+            type=int,
+            default=defaults.max_file_size,
+            help="Largest file size in bytes",
+        )
+        parser.add_argument(
+            "--latency",
+            type=float,
+            default=0.0,
+            help="Milliseconds added before every response",
+        )
+        parser.add_argument(
+            "--jitter",
+            type=float,
+            default=0.0,
+            help="Upper bound of random milliseconds added to the latency",
+        )
+        parser.add_argument(
+            "--bandwidth",
+            type=int,
+            default=defaults.bandwidth,
+            help="Download speed cap in bytes per second, 0 for none",
+        )
+        parser.add_argument(
+            "--error-rate",
+            type=float,
+            default=defaults.error_rate,
+            help="Share of requests answered with --error-status",
+        )
+        parser.add_argument("--error-status", type=int, default=defaults.error_status)
+        parser.add_argument("--seed", type=int, default=defaults.seed)
+
+    def handle(self, *args, **options):
+        config = FakeDiskConfig(
+            depth=options["depth"],
+            folders=options["folders"],
+            files=options["files"],
+            min_file_size=options["min_size"],
+            max_file_size=max(options["min_size"], options["max_size"]),
+            latency=options["latency"] / 1000,
+            jitter=options["jitter"] / 1000,
+            bandwidth=options["bandwidth"],
+            error_rate=options["error_rate"],
+            error_status=options["error_status"],
+            seed=options["seed"],
+        )
+        server = FakeDiskServer(config, options["host"], options["port"])
+        files = sum(
+            1 for resource in server.tree.resources.values() if resource.type == "file"
+        )
+        self.stdout.write(
+            f"Serving {files} files in {len(server.tree.resources) - files} folders "
+            f"at {server.api_url}\n"
+            f"Use YANDEX_DISK_API_URL={server.api_url} and any public key."
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
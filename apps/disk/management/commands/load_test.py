@@ -0,0 +1,688 @@
+"""
+Load test whole deployments with simulated users against the fake
+Yandex.Disk API.
+"""
+
+from contextlib import ExitStack, contextmanager
+from datetime import datetime, timezone
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+import asyncio
+import importlib.util
+import json
+import math
+import os
+import random
+import secrets
+import socket
+import subprocess
+import sys
+import time
+
+import httpx
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.urls import reverse
+
+from apps.disk.fake_server import (
+    FakeDiskConfig,
+    FakeDiskTree,
+    FakeResource,
+    run_fake_server,
+)
+
+from .benchmark_disk import _git_commit
+
+# Version of the result document layout
+RESULTS_VERSION = 1
+
+# Seconds to wait for a spawned server to answer
+STARTUP_TIMEOUT = 30
+
+# Public link of the fake folder; the fake API accepts any key
+PUBLIC_URL = "https://disk.yandex.ru/d/loadtest"
+
+# Extensions of the generated files, so that every browser filter matches
+FILE_EXTENSIONS = (".pdf", ".jpg", ".mp4", ".mp3", ".bin")
+
+# Seconds between archive job status polls, and before a job counts as stuck
+JOB_POLL_INTERVAL = 0.5
+JOB_TIMEOUT = 120
+
+# Endpoints reporting a flow of several requests, left out of the totals
+FLOW_ENDPOINTS = ("job",)
+
+BROWSE_FILTERS = ("", "document", "image", "video", "audio")
+BROWSE_SORTS = ("", "name", "-name", "size", "-size", "-modified")
+
+
+class Command(BaseCommand):
+    help = (
+        "Simulate users logging in, browsing and downloading against WSGI "
+        "and ASGI deployments backed by a fake Yandex.Disk API, and report "
+        "throughput, latency percentiles and error rates per endpoint."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            "--server",
+            action="append",
+            choices=("wsgi", "asgi"),
+            help=(
+                "Start and test a deployment of this kind; WSGI uses gunicorn "
+                "if installed, otherwise runserver, ASGI needs uvicorn"
+            ),
+        )
+        parser.add_argument(
+            "--url",
+            action="append",
+            default=[],
+            metavar="NAME=URL",
+            help=(
+                "Test a running deployment; its YANDEX_DISK_API_URL must point "
+                "at a fake API started with the same tree options"
+            ),
+        )
+        parser.add_argument(
+            "--workers",
+            type=int,
+            default=2,
+            help="Worker processes per server; runserver always uses one",
+        )
+        parser.add_argument("--users", type=int, default=100)
+        parser.add_argument(
+            "--duration", type=float, default=60, help="Seconds of load per target"
+        )
+        parser.add_argument(
+            "--ramp-up",
+            type=float,
+            default=10,
+            help="Seconds over which users start",
+        )
+        parser.add_argument(
+            "--think",
+            type=float,
+            default=500,
+            help="Mean milliseconds a user waits between actions",
+        )
+        parser.add_argument(
+            "--mix",
+            default="browse=6,download=3,bulk=1,job=1",
+            help=(
+                "Relative weights of the user actions: browse, download, bulk "
+                "(streamed archive) and job (archive built by a background job)"
+            ),
+        )
+        parser.add_argument(
+            "--bulk-files", type=int, default=5, help="Files per bulk download"
+        )
+        parser.add_argument(
+            "--username",
+            help=(
+                "Existing account to log in as, with --password; by default a "
+                "temporary account with a random password is created in this "
+                "project's database and deleted after the run"
+            ),
+        )
+        parser.add_argument("--password", help="Password of --username")
+        parser.add_argument(
+            "--upstream-latency",
+            type=float,
+            default=50,
+            help="Milliseconds of latency added by the fake API",
+        )
+        parser.add_argument("--upstream-jitter", type=float, default=50)
+        parser.add_argument(
+            "--upstream-bandwidth",
+            type=int,
+            default=0,
+            help="Fake API download cap in bytes per second",
+        )
+        parser.add_argument("--upstream-error-rate", type=float, default=0.0)
+        parser.add_argument("--depth", type=int, default=1)
+        parser.add_argument("--folders", type=int, default=5)
+        parser.add_argument("--files", type=int, default=40)
+        parser.add_argument("--min-size", type=int, default=16 * 1024)
+        parser.add_argument("--max-size", type=int, default=1024 * 1024)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--output", help="Write results to this file")
+
+    def handle(self, *args, **options):
+        targets = [_parse_target(value) for value in options["url"]]
+        servers = options["server"] or ([] if targets else ["wsgi"])
+        if "asgi" in servers and importlib.util.find_spec("uvicorn") is None:
+            raise CommandError("Testing ASGI needs uvicorn installed")
+        mix = _parse_mix(options["mix"])
+        if bool(options["username"]) != bool(options["password"]):
+            raise CommandError("--username and --password must be given together")
+
+        config = FakeDiskConfig(
+            depth=options["depth"],
+            folders=options["folders"],
+            files=options["files"],
+            min_file_size=options["min_size"],
+            max_file_size=max(options["min_size"], options["max_size"]),
+            latency=options["upstream_latency"] / 1000,
+            jitter=options["upstream_jitter"] / 1000,
+            bandwidth=options["upstream_bandwidth"],
+            error_rate=options["upstream_error_rate"],
+            seed=options["seed"],
+            extensions=FILE_EXTENSIONS,
+        )
+        files = [
+            resource
+            for resource in FakeDiskTree(config).resources.values()
+            if resource.type == "file"
+        ]
+
+        results = {}
+        with ExitStack() as stack:
+            options["username"], options["password"] = stack.enter_context(
+                _load_test_account(options["username"], options["password"])
+            )
+            if servers:
+                api_url = stack.enter_context(run_fake_server(config))
+                for kind in servers:
+                    targets.append(
+                        (
+                            kind,
+                            stack.enter_context(
+                                _spawn_server(kind, api_url, options["workers"])
+                            ),
+                        )
+                    )
+            for name, base_url in targets:
+                self.stderr.write(
+                    f"Running {options['users']} users against {name} "
+                    f"at {base_url} for {options['duration']}s"
+                )
+                run = LoadRun(base_url, files, mix, options)
+                results[name] = asyncio.run(run.run())
+                self._print_report(name, results[name])
+
+        document = {
+            "version": RESULTS_VERSION,
+            "created_at": datetime.now(timezone.utc).isoformat(),
+            "commit": _git_commit(),
+            "options": {
+                name: options[name]
+                for name in (
+                    "users",
+                    "duration",
+                    "ramp_up",
+                    "think",
+                    "mix",
+                    "bulk_files",
+                    "workers",
+                    "upstream_latency",
+                    "upstream_jitter",
+                    "upstream_bandwidth",
+                    "upstream_error_rate",
+                    "depth",
+                    "folders",
+                    "files",
+                    "min_size",
+                    "max_size",
+                    "seed",
+                )
+            },
+            "targets": results,
+        }
+        output = json.dumps(document, indent=2)
+        if options["output"]:
+            with open(options["output"], "w") as f:
+                f.write(output + "\n")
+            self.stderr.write(f"Results written to {options['output']}")
+        else:
+            self.stdout.write(output)
+
+    def _print_report(self, name: str, result: Dict[str, Any]) -> None:
+        self.stderr.write(
+            f"{name}: {result['requests']} requests in {result['seconds']}s, "
+            f"{result['requests_per_second']} req/s"
+        )
+        self.stderr.write(
+            f"  {'endpoint':<12} {'count':>7} {'req/s':>8} {'errors':>7} "
+            f"{'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}"
+        )
+        for endpoint, stats in result["endpoints"].items():
+            self.stderr.write(
+                f"  {endpoint:<12} {stats['count']:>7} "
+                f"{stats['requests_per_second']:>8} "
+                f"{stats['error_rate']:>7.1%} {stats['p50_ms']:>8} "
+                f"{stats['p95_ms']:>8} {stats['p99_ms']:>8}"
+            )
+
+
+class EndpointStats:
+    """Latencies, errors and bytes received of one endpoint."""
+
+    def __init__(self):
+        self.latencies: List[float] = []
+        self.errors = 0
+        self.bytes = 0
+        self.statuses: Dict[str, int] = {}
+
+    def add(self, latency: float, status: str, error: bool, size: int = 0) -> None:
+        self.latencies.append(latency)
+        self.errors += error
+        self.bytes += size
+        self.statuses[status] = self.statuses.get(status, 0) + 1
+
+    def summary(self, seconds: float) -> Dict[str, Any]:
+        ordered = sorted(self.latencies)
+        count = len(ordered)
+        return {
+            "count": count,
+            "errors": self.errors,
+            "error_rate": round(self.errors / count, 4) if count else 0.0,
+            "requests_per_second": round(count / seconds, 2),
+            "mb_per_second": round(self.bytes / (1024 * 1024) / seconds, 2),
+            "p50_ms": _percentile(ordered, 50),
+            "p95_ms": _percentile(ordered, 95),
+            "p99_ms": _percentile(ordered, 99),
+            "max_ms": round(ordered[-1] * 1000, 1) if ordered else None,
+            "statuses": self.statuses,
+        }
+
+
+class LoadRun:
+    """Simulated users against one deployment."""
+
+    def __init__(
+        self,
+        base_url: str,
+        files: List[FakeResource],
+        mix: Dict[str, float],
+        options: Dict[str, Any],
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.files = files
+        self.options = options
+        self.actions = {
+            "browse": self.browse,
+            "download": self.download,
+            "bulk": self.bulk_download,
+            "job": self.archive_job,
+        }
+        self.weights = [mix.get(name, 0) for name in self.actions]
+        self.stats: Dict[str, EndpointStats] = {}
+
+    async def run(self) -> Dict[str, Any]:
+        """
+        Run all users until the duration has passed.
+
+        Returns:
+            Overall and per-endpoint results
+        """
+        users = self.options["users"]
+        started = time.monotonic()
+        deadline = started + self.options["ramp_up"] + self.options["duration"]
+        delays = [self.options["ramp_up"] * i / max(1, users) for i in range(users)]
+        await asyncio.gather(
+            *(
+                self.user(random.Random(self.options["seed"] + i), delay, deadline)
+                for i, delay in enumerate(delays)
+            )
+        )
+        seconds = time.monotonic() - started
+        endpoints = {
+            name: stats.summary(seconds) for name, stats in sorted(self.stats.items())
+        }
+        requests = [
+            stats for name, stats in endpoints.items() if name not in FLOW_ENDPOINTS
+        ]
+        count = sum(stats["count"] for stats in requests)
+        return {
+            "seconds": round(seconds, 2),
+            "requests": count,
+            "requests_per_second": round(count / seconds, 2),
+            "errors": sum(stats["errors"] for stats in requests),
+            "endpoints": endpoints,
+        }
+
+    async def user(self, rng: random.Random, delay: float, deadline: float) -> None:
+        """Log in, then act until the deadline."""
+        await asyncio.sleep(delay)
+        timeout = httpx.Timeout(60, connect=10)
+        async with httpx.AsyncClient(base_url=self.base_url, timeout=timeout) as client:
+            if not await self.login(client):
+                return
+            think = self.options["think"] / 1000
+            while time.monotonic() < deadline:
+                action = rng.choices(list(self.actions.values()), self.weights)[0]
+                await action(client, rng)
+                await asyncio.sleep(rng.expovariate(1 / think) if think > 0 else 0)
+
+    async def login(self, client: httpx.AsyncClient) -> bool:
+        """Log in through the login form."""
+        url = reverse("core:login")
+        response = await self.request(client, "login_page", "GET", url)
+        if response is None or response.status_code != 200:
+            return False
+        response = await self.request(
+            client,
+            "login",
+            "POST",
+            url,
+            data={
+                "username": self.options["username"],
+                "password": self.options["password"],
+                "remember_me": "on",
+                "csrfmiddlewaretoken": client.cookies.get("csrftoken", ""),
+            },
+            expect=302,
+        )
+        return response is not None and response.status_code == 302
+
+    async def browse(self, client: httpx.AsyncClient, rng: random.Random) -> None:
+        """Open the file list with a random filter, sort and page."""
+        params = {"public_url": PUBLIC_URL}
+        if rng.random() < 0.2:
+            params["recursive"] = "on"
+        for name, choices in (("filter", BROWSE_FILTERS), ("sort", BROWSE_SORTS)):
+            value = rng.choice(choices)
+            if value:
+                params[name] = value
+        if rng.random() < 0.3:
+            params["page"] = str(rng.randint(2, 3))
+        await self.request(
+            client,
+            "browse",
+            "GET",
+            reverse("disk:file_list"),
+            params=params,
+            error_text=b"Error fetching files",
+        )
+
+    async def download(self, client: httpx.AsyncClient, rng: random.Random) -> None:
+        """Download a single file."""
+        file = rng.choice(self.files)
+        await self.request(
+            client,
+            "download",
+            "GET",
+            reverse("disk:download_resource"),
+            params={
+                "public_key": PUBLIC_URL,
+                "path": file.path.lstrip("/"),
+            },
+        )
+
+    async def bulk_download(
+        self, client: httpx.AsyncClient, rng: random.Random
+    ) -> None:
+        """Download a zip archive of a few files."""
+        await self.request(
+            client,
+            "bulk",
+            "POST",
+            reverse("disk:download_files"),
+            json=self.archive_body(rng),
+            headers={"X-CSRFToken": client.cookies.get("csrftoken", "")},
+        )
+
+    async def archive_job(self, client: httpx.AsyncClient, rng: random.Random) -> None:
+        """
+        Queue an archive of a few files, poll it until done and download it.
+
+        Each request is reported on its own; ``job`` reports the whole flow,
+        from queueing to the end of the download.
+        """
+        started = time.perf_counter()
+        outcome, size = await self._run_archive_job(client, rng)
+        self.stats.setdefault("job", EndpointStats()).add(
+            time.perf_counter() - started, outcome, outcome != "done", size
+        )
+
+    async def _run_archive_job(
+        self, client: httpx.AsyncClient, rng: random.Random
+    ) -> Tuple[str, int]:
+        """Return the final job status, or the failed step, and archive size."""
+        response = await self.request(
+            client,
+            "job_create",
+            "POST",
+            reverse("disk:archive_job_create"),
+            expect=202,
+            read_body=True,
+            json=self.archive_body(rng),
+            headers={"X-CSRFToken": client.cookies.get("csrftoken", "")},
+        )
+        if response is None or response.status_code != 202:
+            return "create_failed", 0
+        status = response.json()
+
+        deadline = time.monotonic() + JOB_TIMEOUT
+        while status["status"] in ("pending", "running"):
+            if time.monotonic() > deadline:
+                return "timeout", 0
+            await asyncio.sleep(JOB_POLL_INTERVAL)
+            response = await self.request(
+                client, "job_status", "GET", status["status_url"], read_body=True
+            )
+            if response is None or response.status_code != 200:
+                return "status_failed", 0
+            status = response.json()
+        if status["status"] != "done":
+            return status["status"], 0
+
+        response = await self.request(
+            client, "job_download", "GET", status["download_url"]
+        )
+        if response is None or response.status_code != 200:
+            return "download_failed", 0
+        return "done", int(response.headers.get("Content-Length", 0))
+
+    def archive_body(self, rng: random.Random) -> Dict[str, Any]:
+        """Build the request body of a zip archive of a few random files."""
+        selected = rng.sample(
+            self.files, min(self.options["bulk_files"], len(self.files))
+        )
+        return {
+            "files": [
+                {
+                    "public_key": PUBLIC_URL,
+                    "path": file.path.lstrip("/"),
+                    "name": file.name,
+                    "type": "file",
+                }
+                for file in selected
+            ],
+            "format": "zip",
+        }
+
+    async def request(
+        self,
+        client: httpx.AsyncClient,
+        endpoint: str,
+        method: str,
+        url: str,
+        expect: int = 200,
+        error_text: Optional[bytes] = None,
+        read_body: bool = False,
+        **kwargs,
+    ) -> Optional[httpx.Response]:
+        """
+        Send a request, read the whole body and record the outcome.
+
+        Args:
+            endpoint: Name the request is reported under
+            expect: Status of a successful response
+            error_text: Marker of an error page served with ``expect``
+            read_body: Keep the body, e.g. to decode JSON, instead of
+                discarding it chunk by chunk
+
+        Returns:
+            The response, or None if the request failed without one
+        """
+        stats = self.stats.setdefault(endpoint, EndpointStats())
+        started = time.perf_counter()
+        try:
+            async with client.stream(method, url, **kwargs) as response:
+                if read_body:
+                    # Later iteration replays the kept body
+                    await response.aread()
+                size = 0
+                found_error = False
+                async for chunk in response.aiter_bytes():
+                    size += len(chunk)
+                    if error_text and error_text in chunk:
+                        found_error = True
+        except httpx.HTTPError as e:
+            stats.add(time.perf_counter() - started, type(e).__name__, True)
+            return None
+        stats.add(
+            time.perf_counter() - started,
+            str(response.status_code),
+            response.status_code != expect or found_error,
+            size,
+        )
+        return response
+
+
+@contextmanager
+def _spawn_server(kind: str, api_url: str, workers: int) -> Iterator[str]:
+    """
+    Start a deployment of the project in a child process.
+
+    Yields:
+        Base URL of the server
+    """
+    port = _free_port()
+    env = dict(os.environ, YANDEX_DISK_API_URL=api_url)
+    if kind == "asgi":
+        env["YANDEX_DISK_ASYNC_VIEWS"] = "True"
+        command = [
+            sys.executable,
+            "-m",
+            "uvicorn",
+            settings.ASGI_APPLICATION.replace(".application", ":application"),
+            "--port",
+            str(port),
+            "--workers",
+            str(workers),
+            "--no-access-log",
+        ]
+    elif importlib.util.find_spec("gunicorn") is not None:
+        command = [
+            sys.executable,
+            "-m",
+            "gunicorn",
+            settings.WSGI_APPLICATION.replace(".application", ":application"),
+            "--bind",
+            f"127.0.0.1:{port}",
+            "--workers",
+            str(workers),
+            "--worker-class",
+            "gthread",
+            "--threads",
+            "16",
+        ]
+    else:
+        # Development server: one process, a thread per request
+        command = [
+            sys.executable,
+            "manage.py",
+            "runserver",
+            "--noreload",
+            "--skip-checks",
+            f"127.0.0.1:{port}",
+        ]
+
+    process = subprocess.Popen(
+        command,
+        cwd=settings.BASE_DIR,
+        env=env,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL,
+    )
+    base_url = f"http://127.0.0.1:{port}"
+    try:
+        _wait_until_ready(process, base_url + reverse("core:login"))
+        yield base_url
+    finally:
+        process.terminate()
+        try:
+            process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            process.kill()
+            process.wait()
+
+
+def _wait_until_ready(process: subprocess.Popen, url: str) -> None:
+    deadline = time.monotonic() + STARTUP_TIMEOUT
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise CommandError(f"Server exited with status {process.returncode}")
+        try:
+            if httpx.get(url, timeout=1).status_code == 200:
+                return
+        except httpx.HTTPError:
+            pass
+        time.sleep(0.2)
+    raise CommandError(f"Server did not answer within {STARTUP_TIMEOUT}s")
+
+
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+@contextmanager
+def _load_test_account(
+    username: Optional[str], password: Optional[str]
+) -> Iterator[Tuple[str, str]]:
+    """
+    Provide the account simulated users log in with.
+
+    A given account is used as is. Otherwise a temporary account with a
+    random password is created for the run and deleted afterwards, so no
+    known credentials are left behind.
+
+    Yields:
+        Username and password
+    """
+    if username and password:
+        yield username, password
+        return
+
+    password = secrets.token_urlsafe(24)
+    user = User.objects.create_user(
+        f"loadtest-{secrets.token_hex(4)}", password=password
+    )
+    try:
+        yield user.username, password
+    finally:
+        user.delete()
+
+
+def _parse_target(value: str) -> Tuple[str, str]:
+    name, separator, url = value.partition("=")
+    if not separator or not url.startswith("http"):
+        raise CommandError(f"Expected NAME=URL, got {value}")
+    return name, url
+
+
+def _parse_mix(value: str) -> Dict[str, float]:
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        if name not in ("browse", "download", "bulk", "job"):
+            raise CommandError(f"Unknown action in --mix: {name}")
+        try:
+            mix[name] = float(weight)
+        except ValueError:
+            raise CommandError(f"Invalid weight in --mix: {part}")
+    if not any(weight > 0 for weight in mix.values()):
+        raise CommandError("--mix needs at least one positive weight")
+    return mix
+
+
+def _percentile(ordered: List[float], percentile: float) -> Optional[float]:
+    """Nearest-rank percentile in milliseconds."""
+    if not ordered:
+        return None
+    rank = max(0, math.ceil(len(ordered) * percentile / 100) - 1)
+    return round(ordered[rank] * 1000, 1)
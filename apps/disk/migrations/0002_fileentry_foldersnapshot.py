@@ -0,0 +1,163 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("disk", "0001_initial"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="FileEntry",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "public_key",
+                    models.CharField(
+                        help_text="Canonical public key",
+                        max_length=255,
+                        verbose_name="Public Key",
+                    ),
+                ),
+                ("path", models.CharField(max_length=1024, verbose_name="Path")),
+                (
+                    "parent_path",
+                    models.CharField(
+                        blank=True, max_length=1024, verbose_name="Parent path"
+                    ),
+                ),
+                ("name", models.CharField(max_length=255, verbose_name="Name")),
+                ("type", models.CharField(max_length=16, verbose_name="Type")),
+                ("size", models.BigIntegerField(default=0, verbose_name="Size")),
+                ("created", models.DateTimeField(verbose_name="Created")),
+                ("modified", models.DateTimeField(verbose_name="Modified")),
+                (
+                    "mime_type",
+                    models.CharField(max_length=255, verbose_name="MIME type"),
+                ),
+                (
+                    "category",
+                    models.CharField(
+                        blank=True,
+                        help_text="File type category used by the type filter",
+                        max_length=32,
+                        verbose_name="Category",
+                    ),
+                ),
+                (
+                    "synced_at",
+                    models.DateTimeField(
+                        help_text="Last time the entry was seen upstream",
+                        verbose_name="Synced at",
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "File Entry",
+                "verbose_name_plural": "File Entries",
+                "indexes": [
+                    models.Index(
+                        fields=["public_key", "parent_path", "name"],
+                        name="file_entry_parent_idx",
+                    ),
+                    models.Index(
+                        fields=["public_key", "category"],
+                        name="file_entry_category_idx",
+                    ),
+                    models.Index(
+                        fields=["public_key", "size"], name="file_entry_size_idx"
+                    ),
+                    models.Index(
+                        fields=["public_key", "modified"],
+                        name="file_entry_modified_idx",
+                    ),
+                ],
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("public_key", "path"), name="unique_file_entry"
+                    )
+                ],
+            },
+        ),
+        migrations.CreateModel(
+            name="FolderSnapshot",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                (
+                    "public_key",
+                    models.CharField(
+                        help_text="Canonical public key",
+                        max_length=255,
+                        verbose_name="Public Key",
+                    ),
+                ),
+                (
+                    "path",
+                    models.CharField(
+                        blank=True,
+                        help_text="Folder path, root if empty",
+                        max_length=1024,
+                        verbose_name="Path",
+                    ),
+                ),
+                (
+                    "recursive",
+                    models.BooleanField(
+                        default=False,
+                        help_text="Listing includes subfolders",
+                        verbose_name="Recursive",
+                    ),
+                ),
+                (
+                    "public_url",
+                    models.CharField(
+                        help_text="URL the folder was listed with",
+                        max_length=1024,
+                        verbose_name="Public URL",
+                    ),
+                ),
+                (
+                    "validators",
+                    models.JSONField(
+                        default=dict,
+                        help_text="Folder metadata at fetch time",
+                        verbose_name="Validators",
+                    ),
+                ),
+                (
+                    "item_count",
+                    models.PositiveIntegerField(default=0, verbose_name="Item count"),
+                ),
+                ("fetched_at", models.DateTimeField(verbose_name="Fetched at")),
+            ],
+            options={
+                "verbose_name": "Folder Snapshot",
+                "verbose_name_plural": "Folder Snapshots",
+                "constraints": [
+                    models.UniqueConstraint(
+                        fields=("public_key", "path", "recursive"),
+                        name="unique_folder_snapshot",
+                    )
+                ],
+            },
+        ),
+    ]
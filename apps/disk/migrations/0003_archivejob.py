@@ -0,0 +1,112 @@
+# Generated by Django 5.1.2 on 2026-10-17 02:48
+
+import django.utils.timezone
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("disk", "0002_fileentry_foldersnapshot"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ArchiveJob",
+            fields=[
+                (
+                    "id",
+                    models.UUIDField(
+                        default=uuid.uuid4,
+                        editable=False,
+                        primary_key=True,
+                        serialize=False,
+                    ),
+                ),
+                (
+                    "selection_hash",
+                    models.CharField(
+                        help_text="Digest of the selected files and format",
+                        max_length=64,
+                        verbose_name="Selection hash",
+                    ),
+                ),
+                (
+                    "archive_format",
+                    models.CharField(max_length=16, verbose_name="Archive format"),
+                ),
+                (
+                    "files",
+                    models.JSONField(
+                        default=list,
+                        help_text="Selected files from the request",
+                        verbose_name="Files",
+                    ),
+                ),
+                (
+                    "status",
+                    models.CharField(
+                        choices=[
+                            ("pending", "Pending"),
+                            ("running", "Running"),
+                            ("done", "Done"),
+                            ("failed", "Failed"),
+                        ],
+                        default="pending",
+                        max_length=16,
+                        verbose_name="Status",
+                    ),
+                ),
+                (
+                    "files_total",
+                    models.PositiveIntegerField(
+                        blank=True, null=True, verbose_name="Files total"
+                    ),
+                ),
+                (
+                    "files_done",
+                    models.PositiveIntegerField(default=0, verbose_name="Files done"),
+                ),
+                (
+                    "bytes_done",
+                    models.BigIntegerField(default=0, verbose_name="Bytes done"),
+                ),
+                (
+                    "result_path",
+                    models.CharField(
+                        blank=True, max_length=1024, verbose_name="Result path"
+                    ),
+                ),
+                ("error", models.TextField(blank=True, verbose_name="Error")),
+                ("created_at", models.DateTimeField(auto_now_add=True)),
+                (
+                    "updated_at",
+                    models.DateTimeField(
+                        default=django.utils.timezone.now,
+                        help_text="Last progress report, used to detect interrupted jobs",
+                        verbose_name="Updated at",
+                    ),
+                ),
+                (
+                    "expires_at",
+                    models.DateTimeField(
+                        blank=True, null=True, verbose_name="Expires at"
+                    ),
+                ),
+            ],
+            options={
+                "verbose_name": "Archive Job",
+                "verbose_name_plural": "Archive Jobs",
+                "indexes": [
+                    models.Index(
+                        fields=["selection_hash", "status"],
+                        name="archive_job_selection_idx",
+                    ),
+                    models.Index(
+                        fields=["status", "updated_at"], name="archive_job_queue_idx"
+                    ),
+                ],
+            },
+        ),
+    ]
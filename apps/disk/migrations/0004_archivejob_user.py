@@ -0,0 +1,28 @@
+# Generated by Django 5.1.2 on 2026-10-17 03:32
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("disk", "0003_archivejob"),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="archivejob",
+            name="user",
+            field=models.ForeignKey(
+                blank=True,
+                help_text="User who created the job",
+                null=True,
+                on_delete=django.db.models.deletion.CASCADE,
+                related_name="archive_jobs",
+                to=settings.AUTH_USER_MODEL,
+            ),
+        ),
+    ]
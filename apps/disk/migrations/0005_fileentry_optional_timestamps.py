@@ -0,0 +1,23 @@
+# Generated by Django 5.1.2 on 2026-10-17 03:39
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("disk", "0004_archivejob_user"),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name="fileentry",
+            name="created",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Created"),
+        ),
+        migrations.AlterField(
+            model_name="fileentry",
+            name="modified",
+            field=models.DateTimeField(blank=True, null=True, verbose_name="Modified"),
+        ),
+    ]
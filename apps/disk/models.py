@@ -1,5 +1,8 @@
+import uuid
+
 from django.db import models
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from django.utils.translation import gettext_lazy as _
 
 User = get_user_model()
@@ -27,3 +30,148 @@ class PublicLink(models.Model):
 
     def __str__(self):
         return f"{self.public_key} ({self.user.username})"
+
+
+class FolderSnapshot(models.Model):
+    """Last known listing of a public folder, stored as FileEntry rows."""
+
+    public_key = models.CharField(
+        _("Public Key"), max_length=255, help_text=_("Canonical public key")
+    )
+    path = models.CharField(
+        _("Path"),
+        max_length=1024,
+        blank=True,
+        help_text=_("Folder path, root if empty"),
+    )
+    recursive = models.BooleanField(
+        _("Recursive"), default=False, help_text=_("Listing includes subfolders")
+    )
+    public_url = models.CharField(
+        _("Public URL"), max_length=1024, help_text=_("URL the folder was listed with")
+    )
+    validators = models.JSONField(
+        _("Validators"), default=dict, help_text=_("Folder metadata at fetch time")
+    )
+    item_count = models.PositiveIntegerField(_("Item count"), default=0)
+    fetched_at = models.DateTimeField(_("Fetched at"))
+
+    class Meta:
+        verbose_name = _("Folder Snapshot")
+        verbose_name_plural = _("Folder Snapshots")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["public_key", "path", "recursive"],
+                name="unique_folder_snapshot",
+            )
+        ]
+
+    def __str__(self):
+        return f"{self.public_key}:/{self.path}"
+
+
+class FileEntry(models.Model):
+    """Metadata of a file or folder inside a public resource."""
+
+    public_key = models.CharField(
+        _("Public Key"), max_length=255, help_text=_("Canonical public key")
+    )
+    path = models.CharField(_("Path"), max_length=1024)
+    parent_path = models.CharField(_("Parent path"), max_length=1024, blank=True)
+    name = models.CharField(_("Name"), max_length=255)
+    type = models.CharField(_("Type"), max_length=16)
+    size = models.BigIntegerField(_("Size"), default=0)
+    created = models.DateTimeField(_("Created"), null=True, blank=True)
+    modified = models.DateTimeField(_("Modified"), null=True, blank=True)
+    mime_type = models.CharField(_("MIME type"), max_length=255)
+    category = models.CharField(
+        _("Category"),
+        max_length=32,
+        blank=True,
+        help_text=_("File type category used by the type filter"),
+    )
+    synced_at = models.DateTimeField(
+        _("Synced at"), help_text=_("Last time the entry was seen upstream")
+    )
+
+    class Meta:
+        verbose_name = _("File Entry")
+        verbose_name_plural = _("File Entries")
+        constraints = [
+            models.UniqueConstraint(
+                fields=["public_key", "path"], name="unique_file_entry"
+            )
+        ]
+        indexes = [
+            models.Index(
+                fields=["public_key", "parent_path", "name"],
+                name="file_entry_parent_idx",
+            ),
+            models.Index(
+                fields=["public_key", "category"], name="file_entry_category_idx"
+            ),
+            models.Index(fields=["public_key", "size"], name="file_entry_size_idx"),
+            models.Index(
+                fields=["public_key", "modified"], name="file_entry_modified_idx"
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.public_key}:/{self.path}"
+
+
+class ArchiveJob(models.Model):
+    """Bulk download archive built in the background."""
+
+    class Status(models.TextChoices):
+        PENDING = "pending", _("Pending")
+        RUNNING = "running", _("Running")
+        DONE = "done", _("Done")
+        FAILED = "failed", _("Failed")
+
+    id = models.UUIDField(primary_key=True, default=uuid.uuid4, editable=False)
+    selection_hash = models.CharField(
+        _("Selection hash"),
+        max_length=64,
+        help_text=_("Digest of the selected files and format"),
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name="archive_jobs",
+        help_text=_("User who created the job"),
+    )
+    archive_format = models.CharField(_("Archive format"), max_length=16)
+    files = models.JSONField(
+        _("Files"), default=list, help_text=_("Selected files from the request")
+    )
+    status = models.CharField(
+        _("Status"), max_length=16, choices=Status.choices, default=Status.PENDING
+    )
+    files_total = models.PositiveIntegerField(_("Files total"), null=True, blank=True)
+    files_done = models.PositiveIntegerField(_("Files done"), default=0)
+    bytes_done = models.BigIntegerField(_("Bytes done"), default=0)
+    result_path = models.CharField(_("Result path"), max_length=1024, blank=True)
+    error = models.TextField(_("Error"), blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(
+        _("Updated at"),
+        default=timezone.now,
+        help_text=_("Last progress report, used to detect interrupted jobs"),
+    )
+    expires_at = models.DateTimeField(_("Expires at"), null=True, blank=True)
+
+    class Meta:
+        verbose_name = _("Archive Job")
+        verbose_name_plural = _("Archive Jobs")
+        indexes = [
+            models.Index(
+                fields=["selection_hash", "status"], name="archive_job_selection_idx"
+            ),
+            models.Index(fields=["status", "updated_at"], name="archive_job_queue_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.pk} ({self.status})"
@@ -0,0 +1,393 @@
+"""
+Background archive jobs.
+Builds bulk download archives on a local worker pool and keeps the results
+on disk, so large selections do not hold a request open.
+"""
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from ..models import ArchiveJob
+from .archive_service import ARCHIVE_FORMATS, stream_archive
+from .blob_cache import get_blob_cache
+from .prefetch import ArchiveEntry, PrefetchPipeline, SpooledDownload
+
+logger = logging.getLogger(__name__)
+
+# Seconds between progress writes of a running job
+PROGRESS_INTERVAL = 1.0
+
+# Request fields identifying a selected file
+SELECTION_FIELDS = ("public_key", "path", "revision", "type", "name", "url")
+
+# Queues of this process, whose threads are not inherited by forked workers
+_queues: "weakref.WeakSet[ArchiveJobQueue]" = weakref.WeakSet()
+
+
+class ArchiveJobQueue:
+    """
+    Archive jobs queued in the database and run by a bounded thread pool.
+
+    The ArchiveJob table is the queue: workers claim pending jobs with a
+    conditional update, so every process sharing the database can run any
+    job. Running jobs report progress regularly; a job without a report for
+    settings.YANDEX_DISK_ARCHIVE_JOB_STALE_AFTER seconds is considered
+    interrupted and claimed again.
+
+    Once the queue is used, a monitor thread checks every
+    settings.YANDEX_DISK_ARCHIVE_JOB_CHECK_INTERVAL seconds for expired jobs
+    to delete and for waiting jobs without a worker, so jobs recover without
+    waiting for a request.
+    """
+
+    def __init__(
+        self,
+        entries: Callable[[List[Dict[str, Any]]], Iterable[ArchiveEntry]],
+        download: Callable[[str], Iterable[bytes]],
+        workers: Optional[int] = None,
+    ):
+        """
+        Initialize the queue.
+
+        Args:
+            entries: Callable expanding selected files into archive entries
+            download: Callable returning the content chunks of a download URL
+            workers: Number of jobs run at once, defaults to
+                settings.YANDEX_DISK_ARCHIVE_JOB_WORKERS
+        """
+        self.entries = entries
+        self.download = download
+        self.workers = workers or settings.YANDEX_DISK_ARCHIVE_JOB_WORKERS
+        self._reset()
+        _queues.add(self)
+
+    def _reset(self) -> None:
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._monitor: Optional[threading.Thread] = None
+        self._active = 0
+
+    def submit(
+        self, files: List[Dict[str, Any]], archive_format: str, user=None
+    ) -> ArchiveJob:
+        """
+        Queue an archive of the selected files.
+
+        An unexpired job of the same user for the same selection and format
+        is returned instead of starting a new one. A new job is started once
+        the current transaction commits.
+
+        Args:
+            files: Selected files from the request body
+            archive_format: One of ARCHIVE_FORMATS
+            user: User the job belongs to
+
+        Returns:
+            The new or reused job
+        """
+        self._start_monitor()
+        digest = ArchiveJobQueue.selection_hash(files, archive_format)
+        existing = (
+            ArchiveJob.objects.filter(selection_hash=digest, user=user)
+            .exclude(status=ArchiveJob.Status.FAILED)
+            .filter(Q(expires_at__isnull=True) | Q(expires_at__gt=timezone.now()))
+            .order_by("-created_at")
+            .first()
+        )
+        if existing is not None and (
+            existing.status != ArchiveJob.Status.DONE
+            or os.path.exists(existing.result_path)
+        ):
+            logger.debug(f"Reusing archive job {existing.pk}")
+            self._schedule_if_waiting(existing)
+            return existing
+
+        job = ArchiveJob.objects.create(
+            selection_hash=digest,
+            archive_format=archive_format,
+            files=files,
+            user=user,
+        )
+        logger.info(f"Queued archive job {job.pk} with {len(files)} selected items")
+        # A worker would not see the job before the request's transaction ends
+        transaction.on_commit(self._schedule)
+        return job
+
+    def get(self, job_id, user=None) -> Optional[ArchiveJob]:
+        """
+        Look up a job of a user, restarting it if it waits without a worker.
+
+        Returns:
+            The job, or None if it does not exist, belongs to another user
+            or has expired
+        """
+        self._start_monitor()
+        job = ArchiveJob.objects.filter(pk=job_id, user=user).first()
+        if job is None or (job.expires_at and job.expires_at <= timezone.now()):
+            return None
+        self._schedule_if_waiting(job)
+        return job
+
+    def check(self) -> int:
+        """
+        Delete expired jobs and start a worker if jobs wait without one.
+
+        Run periodically by the monitor thread.
+
+        Returns:
+            Number of jobs deleted
+        """
+        deleted = ArchiveJobQueue.cleanup_expired()
+        if ArchiveJob.objects.filter(self._waiting()).exists():
+            self._schedule()
+        return deleted
+
+    @staticmethod
+    def selection_hash(files: List[Dict[str, Any]], archive_format: str) -> str:
+        """Return the digest identifying a selection and archive format."""
+        selection = [
+            [file_info.get(field) for field in SELECTION_FIELDS] for file_info in files
+        ]
+        payload = json.dumps([archive_format, selection], separators=(",", ":"))
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def cleanup_expired() -> int:
+        """
+        Delete expired jobs and their archives.
+
+        Partial archives not written to for
+        settings.YANDEX_DISK_ARCHIVE_JOB_STALE_AFTER seconds are left over
+        from interrupted runs and deleted as well.
+
+        Returns:
+            Number of jobs deleted
+        """
+        expired = list(ArchiveJob.objects.filter(expires_at__lte=timezone.now()))
+        for job in expired:
+            if job.result_path:
+                try:
+                    os.unlink(job.result_path)
+                except FileNotFoundError:
+                    pass
+        if expired:
+            ArchiveJob.objects.filter(pk__in=[job.pk for job in expired]).delete()
+        ArchiveJobQueue._remove_stale_parts()
+        return len(expired)
+
+    @staticmethod
+    def _remove_stale_parts() -> None:
+        """Delete partial archives of runs that stopped writing."""
+        job_dir = settings.YANDEX_DISK_ARCHIVE_JOB_DIR
+        cutoff = time.time() - settings.YANDEX_DISK_ARCHIVE_JOB_STALE_AFTER
+        try:
+            names = os.listdir(job_dir)
+        except FileNotFoundError:
+            return
+        for name in names:
+            if not name.endswith(".part"):
+                continue
+            path = os.path.join(job_dir, name)
+            try:
+                if os.path.getmtime(path) < cutoff:
+                    os.unlink(path)
+                    logger.info(f"Removed stale partial archive {name}")
+            except FileNotFoundError:
+                pass
+
+    def _start_monitor(self) -> None:
+        """Start the monitor thread of this process if it is not running."""
+        with self._lock:
+            if self._monitor is not None:
+                return
+            self._monitor = threading.Thread(
+                target=self._watch, name="yadisk-archive-monitor", daemon=True
+            )
+            self._monitor.start()
+
+    def _watch(self) -> None:
+        """Check the queue at a fixed interval for as long as the process runs."""
+        while True:
+            time.sleep(settings.YANDEX_DISK_ARCHIVE_JOB_CHECK_INTERVAL)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"Archive job check failed: {e}")
+            finally:
+                close_old_connections()
+
+    def _schedule_if_waiting(self, job: ArchiveJob) -> None:
+        """Start a worker for a pending or interrupted job."""
+        if job.status == ArchiveJob.Status.PENDING or (
+            job.status == ArchiveJob.Status.RUNNING
+            and job.updated_at < self._stale_before()
+        ):
+            self._schedule()
+
+    def _schedule(self) -> None:
+        """Start a worker unless all workers are busy."""
+        with self._lock:
+            if self._active >= self.workers:
+                return
+            self._active += 1
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=self.workers, thread_name_prefix="yadisk-archive"
+                )
+            self._executor.submit(self._drain)
+
+    def _drain(self) -> None:
+        """Run queued jobs until none are left."""
+        try:
+            while True:
+                job = self._claim()
+                if job is None:
+                    return
+                self._run(job)
+        except Exception as e:
+            logger.error(f"Archive worker failed: {e}")
+        finally:
+            with self._lock:
+                self._active -= 1
+            close_old_connections()
+
+    def _claim(self) -> Optional[ArchiveJob]:
+        """Atomically take the oldest pending or interrupted job."""
+        waiting = self._waiting()
+        candidates = (
+            ArchiveJob.objects.filter(waiting)
+            .order_by("created_at")
+            .values_list("pk", flat=True)[: self.workers + 1]
+        )
+        for job_id in candidates:
+            claimed = ArchiveJob.objects.filter(waiting, pk=job_id).update(
+                status=ArchiveJob.Status.RUNNING,
+                files_total=None,
+                files_done=0,
+                bytes_done=0,
+                updated_at=timezone.now(),
+            )
+            if claimed:
+                return ArchiveJob.objects.get(pk=job_id)
+        return None
+
+    def _run(self, job: ArchiveJob) -> None:
+        """Build a job's archive into its result file."""
+        extension, _ = ARCHIVE_FORMATS[job.archive_format]
+        os.makedirs(settings.YANDEX_DISK_ARCHIVE_JOB_DIR, exist_ok=True)
+        result_path = os.path.join(
+            settings.YANDEX_DISK_ARCHIVE_JOB_DIR, f"{job.pk}{extension}"
+        )
+        # Unique per run, in case an interrupted job is still writing
+        temp_path = f"{result_path}.{os.getpid()}.{threading.get_ident()}.part"
+        progress = _JobProgress(job)
+        logger.info(f"Building archive for job {job.pk}")
+
+        try:
+            # Folders are listed and links resolved as the archive reaches
+            # them, so links are fresh and the job reports progress meanwhile
+            entries = progress.count_listed(self.entries(job.files))
+            pipeline = PrefetchPipeline(self.download, blob_cache=get_blob_cache())
+            with open(temp_path, "wb") as output:
+                for data in stream_archive(
+                    progress.count_files(pipeline.run(entries)), job.archive_format
+                ):
+                    output.write(data)
+                    progress.add_bytes(len(data))
+            os.replace(temp_path, result_path)
+        except Exception as e:
+            logger.error(f"Archive job {job.pk} failed: {e}")
+            try:
+                os.unlink(temp_path)
+            except FileNotFoundError:
+                pass
+            progress.finish(ArchiveJob.Status.FAILED, error=str(e))
+            return
+
+        progress.finish(ArchiveJob.Status.DONE, result_path=result_path)
+        logger.info(f"Archive job {job.pk} done, {progress.bytes_done} bytes")
+
+    @staticmethod
+    def _waiting() -> Q:
+        """Filter selecting pending jobs and running jobs that stopped reporting."""
+        return Q(status=ArchiveJob.Status.PENDING) | Q(
+            status=ArchiveJob.Status.RUNNING,
+            updated_at__lt=ArchiveJobQueue._stale_before(),
+        )
+
+    @staticmethod
+    def _stale_before():
+        return timezone.now() - timedelta(
+            seconds=settings.YANDEX_DISK_ARCHIVE_JOB_STALE_AFTER
+        )
+
+
+class _JobProgress:
+    """Throttled progress reporting of a running job."""
+
+    def __init__(self, job: ArchiveJob):
+        self.job_id = job.pk
+        self.files_done = 0
+        self.bytes_done = 0
+        self._reported_at = 0.0
+
+    def count_listed(self, entries: Iterable[ArchiveEntry]) -> Iterator[ArchiveEntry]:
+        """Relay archive entries as they are listed, saving the total at the end."""
+        listed = 0
+        for entry in entries:
+            listed += 1
+            self._report()
+            yield entry
+        self._save(files_total=listed)
+
+    def count_files(
+        self, downloads: Iterator[SpooledDownload]
+    ) -> Iterator[SpooledDownload]:
+        """Relay downloads, counting each once the archive writer is done with it."""
+        for item in downloads:
+            yield item
+            self.files_done += 1
+            self._report()
+
+    def add_bytes(self, size: int) -> None:
+        self.bytes_done += size
+        self._report()
+
+    def finish(self, status: str, **fields) -> None:
+        ttl = timedelta(seconds=settings.YANDEX_DISK_ARCHIVE_JOB_TTL)
+        self._save(status=status, expires_at=timezone.now() + ttl, **fields)
+
+    def _report(self) -> None:
+        if time.monotonic() - self._reported_at >= PROGRESS_INTERVAL:
+            self._save()
+
+    def _save(self, **fields) -> None:
+        self._reported_at = time.monotonic()
+        ArchiveJob.objects.filter(pk=self.job_id).update(
+            files_done=self.files_done,
+            bytes_done=self.bytes_done,
+            updated_at=timezone.now(),
+            **fields,
+        )
+
+
+def _reset_queues() -> None:
+    for queue in list(_queues):
+        queue._reset()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_queues)
@@ -0,0 +1,235 @@
+"""
+Archive building for bulk downloads.
+Writes prefetched downloads into a streamed ZIP, tar or tar.gz archive.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import AsyncIterator, Deque, Iterable, Iterator, Optional, Tuple, Union
+import asyncio
+import logging
+import zipfile
+
+from django.conf import settings
+
+from .compression import (
+    DEFLATE_WINDOW,
+    CompressionPolicy,
+    deflate_block,
+    get_compress_executor,
+)
+from .prefetch import SpooledDownload
+from .tar_stream import TarStreamWriter
+from .zip_stream import ZipStreamWriter
+
+logger = logging.getLogger(__name__)
+
+# Archive format -> (file extension, content type)
+ARCHIVE_FORMATS = {
+    "zip": (".zip", "application/zip"),
+    "tar": (".tar", "application/x-tar"),
+    "tar.gz": (".tar.gz", "application/gzip"),
+}
+
+
+def stream_archive(
+    downloads: Iterable[SpooledDownload],
+    archive_format: str = "zip",
+    policy: Optional[CompressionPolicy] = None,
+) -> Iterator[bytes]:
+    """
+    Write downloaded files into a streamed archive.
+
+    Failed downloads are logged and skipped. ZIP entries are stored or
+    deflated according to the compression policy; when parallel compression
+    is enabled, DEFLATE blocks are compressed on the shared pool.
+
+    Args:
+        downloads: Spooled downloads in archive order
+        archive_format: One of ARCHIVE_FORMATS
+        policy: Compression policy for ZIP entries
+
+    Yields:
+        Archive bytes
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unsupported archive format: {archive_format}")
+
+    policy = policy or CompressionPolicy()
+    if archive_format == "zip":
+        executor = get_compress_executor()
+        if executor:
+            yield from _stream_zip_parallel(downloads, policy, executor)
+            return
+
+    writer = _create_writer(archive_format)
+    for item in downloads:
+        if item.error:
+            logger.error(f"Error processing file {item.name}: {item.error}")
+            # Continue with other files if one fails
+            continue
+
+        yield _start_entry(writer, item, policy)
+        for chunk in item.iter_chunks():
+            data = writer.write(chunk)
+            if data:
+                yield data
+
+        tail = writer.end_entry()
+        if tail:
+            yield tail
+        logger.debug(f"Added {item.name} to archive")
+
+    yield writer.close()
+
+
+async def astream_archive(
+    downloads: AsyncIterator[SpooledDownload],
+    archive_format: str = "zip",
+    policy: Optional[CompressionPolicy] = None,
+) -> AsyncIterator[bytes]:
+    """
+    Write downloaded files into a streamed archive from an async view.
+
+    Same output as stream_archive; compression and spool reads run in
+    worker threads so the event loop is never blocked.
+
+    Args:
+        downloads: Async iterator of spooled downloads in archive order
+        archive_format: One of ARCHIVE_FORMATS
+        policy: Compression policy for ZIP entries
+
+    Yields:
+        Archive bytes
+    """
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValueError(f"Unsupported archive format: {archive_format}")
+
+    policy = policy or CompressionPolicy()
+    writer = _create_writer(archive_format)
+    async for item in downloads:
+        if item.error:
+            logger.error(f"Error processing file {item.name}: {item.error}")
+            # Continue with other files if one fails
+            continue
+
+        yield await asyncio.to_thread(_start_entry, writer, item, policy)
+        chunks = item.iter_chunks()
+        while True:
+            data = await asyncio.to_thread(_write_next_chunk, writer, chunks)
+            if data is None:
+                break
+            if data:
+                yield data
+
+        tail = await asyncio.to_thread(writer.end_entry)
+        if tail:
+            yield tail
+        logger.debug(f"Added {item.name} to archive")
+
+    yield writer.close()
+
+
+def _create_writer(archive_format: str) -> Union[ZipStreamWriter, TarStreamWriter]:
+    """Create the streaming writer for an archive format."""
+    if archive_format == "zip":
+        return ZipStreamWriter()
+    return TarStreamWriter(gzip=archive_format == "tar.gz")
+
+
+def _start_entry(
+    writer: Union[ZipStreamWriter, TarStreamWriter],
+    item: SpooledDownload,
+    policy: CompressionPolicy,
+) -> bytes:
+    """Start an archive entry for a download, choosing its compression."""
+    if isinstance(writer, ZipStreamWriter):
+        compress_type = policy.choose(item.name, sample=item.read_sample())
+        return writer.start_entry(item.name, compress_type, size=item.size)
+    return writer.start_entry(item.name, item.size)
+
+
+def _write_next_chunk(
+    writer: Union[ZipStreamWriter, TarStreamWriter], chunks: Iterator[bytes]
+) -> Optional[bytes]:
+    """Write the next spooled chunk, returning None once the entry is done."""
+    chunk = next(chunks, None)
+    if chunk is None:
+        return None
+    return writer.write(chunk)
+
+
+def _stream_zip_parallel(
+    downloads: Iterable[SpooledDownload],
+    policy: CompressionPolicy,
+    executor: ThreadPoolExecutor,
+) -> Iterator[bytes]:
+    """
+    Write a ZIP archive compressing DEFLATE blocks in parallel.
+
+    Entries are cut into blocks of settings.YANDEX_DISK_ARCHIVE_COMPRESS_BLOCK
+    bytes. Blocks are submitted ahead of the writer, across entry boundaries,
+    and stitched into the output in order. At most two blocks per pool
+    worker are held in memory.
+
+    Yields:
+        Archive bytes
+    """
+    writer = ZipStreamWriter()
+    block_size = settings.YANDEX_DISK_ARCHIVE_COMPRESS_BLOCK
+    max_pending = 2 * settings.YANDEX_DISK_ARCHIVE_COMPRESS_WORKERS
+    # Ordered writer operations: ("start", name, method, size),
+    # ("block", data, future or None) and ("end",)
+    queue: Deque[Tuple] = deque()
+    pending = 0
+
+    def drain(limit: int) -> Iterator[bytes]:
+        nonlocal pending
+        while queue and (pending > limit or queue[0][0] != "block"):
+            operation = queue.popleft()
+            if operation[0] == "start":
+                _, name, compress_type, size = operation
+                yield writer.start_entry(name, compress_type, size=size)
+            elif operation[0] == "block":
+                _, data, future = operation
+                pending -= 1
+                if future is None:
+                    output = writer.write(data)
+                else:
+                    output = writer.write_deflated(data, future.result())
+                if output:
+                    yield output
+            else:
+                yield writer.end_entry()
+                logger.debug("Added entry to archive")
+
+    try:
+        for item in downloads:
+            if item.error:
+                logger.error(f"Error processing file {item.name}: {item.error}")
+                # Continue with other files if one fails
+                continue
+
+            compress_type = policy.choose(item.name, sample=item.read_sample())
+            queue.append(("start", item.name, compress_type, item.size))
+
+            previous = b""
+            for block in item.iter_chunks(block_size):
+                future: Optional[Future] = None
+                if compress_type == zipfile.ZIP_DEFLATED:
+                    future = executor.submit(
+                        deflate_block, block, previous[-DEFLATE_WINDOW:]
+                    )
+                    previous = block
+                queue.append(("block", block, future))
+                pending += 1
+                yield from drain(max_pending)
+
+            queue.append(("end",))
+
+        yield from drain(0)
+        yield writer.close()
+    finally:
+        for operation in queue:
+            if operation[0] == "block" and operation[2] is not None:
+                operation[2].cancel()
@@ -0,0 +1,251 @@
+"""
+Async Yandex.Disk API Service Module
+Non-blocking counterpart of YandexDiskService for async views under ASGI.
+"""
+
+from typing import Any, AsyncIterator, Dict, List, Optional, Tuple
+import asyncio
+import logging
+import os
+
+import httpx
+from asgiref.sync import sync_to_async
+from django.conf import settings
+
+from .disk_service import REVISION_FIELDS, YandexDiskFile, YandexDiskService
+from .hedging import api_hedging
+from .http_client import (
+    API_RETRY_STATUSES,
+    THROTTLE_STATUSES,
+    get_async_http_client,
+    parse_retry_after,
+    send_with_retries,
+)
+from .rate_limiter import api_limiter
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncYandexDiskService:
+    """Async service for interacting with Yandex.Disk API."""
+
+    def __init__(self):
+        """
+        Initialize service with the API URL and the optional OAuth token.
+
+        Public resources can be read anonymously; the token, if set, is sent
+        with API calls.
+        """
+        self.base_url = settings.YANDEX_DISK_API_URL.rstrip("/")
+        self.token = os.getenv("YANDEX_OAUTH_TOKEN")
+
+        self.headers = {"Accept": "application/json"}
+        if self.token:
+            self.headers["Authorization"] = f"OAuth {self.token}"
+
+    async def get_public_resources(
+        self, public_url: str, path: str = ""
+    ) -> List[YandexDiskFile]:
+        """
+        Fetch files from public folder.
+
+        Args:
+            public_url: Yandex.Disk public URL or direct key
+            path: Folder path inside the public resource, root by default
+
+        Returns:
+            List of YandexDiskFile objects
+
+        Raises:
+            RuntimeError: If API request fails
+        """
+        return [item async for item in self.iter_public_resources(public_url, path)]
+
+    async def iter_public_resources(
+        self,
+        public_url: str,
+        path: str = "",
+        page_size: Optional[int] = None,
+        prefetch: bool = True,
+    ) -> AsyncIterator[YandexDiskFile]:
+        """
+        Enumerate a public folder page by page.
+
+        Args:
+            public_url: Yandex.Disk public URL or direct key
+            path: Folder path inside the public resource, root by default
+            page_size: Items per API request, defaults to
+                settings.YANDEX_DISK_PAGE_SIZE
+            prefetch: Fetch the next page while the current one is consumed
+
+        Yields:
+            YandexDiskFile objects in API order
+
+        Raises:
+            RuntimeError: If API request fails
+        """
+        limit = page_size or settings.YANDEX_DISK_PAGE_SIZE
+        next_page: Optional[asyncio.Task] = None
+
+        try:
+            offset = 0
+            items, total = await self._fetch_page(public_url, path, offset, limit)
+            while True:
+                offset += len(items)
+                has_next = len(items) == limit and (total is None or offset < total)
+
+                if has_next and prefetch:
+                    next_page = asyncio.create_task(
+                        self._fetch_page(public_url, path, offset, limit)
+                    )
+
+                for item in items:
+                    yield YandexDiskService._to_file(item, public_url)
+
+                if not has_next:
+                    break
+                if next_page:
+                    items, total = await next_page
+                    next_page = None
+                else:
+                    items, total = await self._fetch_page(
+                        public_url, path, offset, limit
+                    )
+        finally:
+            if next_page:
+                next_page.cancel()
+
+    async def _fetch_page(
+        self, public_url: str, path: str, offset: int, limit: int
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Fetch one page of folder items.
+
+        Returns:
+            Tuple of raw items and the total number of items in the folder
+        """
+        params = {
+            "public_key": public_url,
+            "offset": offset,
+            "limit": limit,
+            "sort": "name",
+            "fields": (
+                "name,path,type,size,created,modified,mime_type,"
+                "_embedded.items,_embedded.total"
+            ),
+        }
+        if path:
+            params["path"] = path
+
+        try:
+            data = await self._get_json(f"{self.base_url}/resources", params)
+        except httpx.HTTPError as e:
+            logger.error(f"API request failed: {e}")
+            raise RuntimeError(f"Failed to fetch resources: {str(e)}")
+
+        if "_embedded" not in data or "items" not in data["_embedded"]:
+            raise ValueError("Invalid API response format")
+
+        return data["_embedded"]["items"], data["_embedded"].get("total")
+
+    async def get_download_link(self, public_key: str, path: str) -> Optional[str]:
+        """Get direct download link for a file."""
+        try:
+            params = {"public_key": public_key, "path": path}
+            data = await self._get_json(f"{self.base_url}/resources/download", params)
+            return data.get("href")
+
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to get download link: {e}")
+            return None
+
+    async def get_file_revision(
+        self, public_key: str, path: str
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the fields identifying the current version of a file.
+
+        Returns:
+            Dict of REVISION_FIELDS, or None if the resource is not a file
+            or could not be fetched
+        """
+        try:
+            params = {
+                "public_key": public_key,
+                "path": path,
+                "fields": "type," + ",".join(REVISION_FIELDS),
+            }
+            data = await self._get_json(f"{self.base_url}/resources", params)
+
+        except (httpx.HTTPError, ValueError) as e:
+            logger.error(f"Failed to get file revision: {e}")
+            return None
+
+        if data.get("type") != "file":
+            return None
+        return {name: data.get(name) for name in REVISION_FIELDS}
+
+    async def resolve_download_links(
+        self, public_key: str, paths: List[str], max_workers: Optional[int] = None
+    ) -> List[Optional[str]]:
+        """
+        Resolve download links for several files concurrently.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            paths: File paths inside the public folder
+            max_workers: Number of parallel requests, defaults to
+                settings.YANDEX_DISK_LINK_WORKERS
+
+        Returns:
+            Links in the same order as ``paths``; ``None`` for items that
+            could not be resolved
+        """
+        semaphore = asyncio.Semaphore(max_workers or settings.YANDEX_DISK_LINK_WORKERS)
+
+        async def resolve(path: str) -> Optional[str]:
+            async with semaphore:
+                try:
+                    return await self.get_download_link(public_key, path)
+                except Exception as e:
+                    logger.error(f"Error resolving download link for {path}: {e}")
+                    return None
+
+        links = await asyncio.gather(*(resolve(path) for path in paths))
+
+        failed = sum(1 for link in links if link is None)
+        if failed:
+            logger.warning(f"Could not resolve {failed} of {len(paths)} download links")
+
+        return list(links)
+
+    async def _get_json(self, url: str, params: Dict[str, Any]) -> Dict[str, Any]:
+        """
+        Send an API GET request through the shared rate limiter and decode
+        its JSON body, hedging slow attempts if enabled.
+        """
+        client = get_async_http_client()
+        request = client.build_request("GET", url, params=params, headers=self.headers)
+        record_response = sync_to_async(
+            api_limiter.record_response, thread_sensitive=False
+        )
+
+        async def send() -> httpx.Response:
+            return await send_with_retries(
+                client, request, retry_statuses=API_RETRY_STATUSES
+            )
+
+        async def record(response: httpx.Response) -> None:
+            await record_response(
+                response.status_code,
+                parse_retry_after(response.headers.get("Retry-After")),
+            )
+
+        endpoint = url[len(self.base_url) :]
+        retries = settings.YANDEX_DISK_HTTP_RETRIES
+        for attempt in range(retries + 1):
+            response = await api_hedging.acall(endpoint, send, record)
+            if response.status_code not in THROTTLE_STATUSES:
+                break
+        response.raise_for_status()
+        return response.json()
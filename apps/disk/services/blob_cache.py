@@ -0,0 +1,345 @@
+"""
+On-disk blob cache for downloaded files.
+Keeps popular files on local disk, so repeated downloads and archives that
+include them are served without proxying them from Yandex.Disk again.
+"""
+
+from typing import AsyncIterable, AsyncIterator, BinaryIO, Iterable, Iterator
+from typing import Optional
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# Eviction frees space down to this fraction of the byte budget
+EVICTION_LOW_WATERMARK = 0.9
+
+# Temporary files older than this are left over from crashed workers
+STALE_TEMP_AGE = 60 * 60
+
+_blob_cache: Optional["BlobCache"] = None
+_blob_cache_lock = threading.Lock()
+
+
+class BlobWriter:
+    """
+    Blob being written to the cache.
+
+    Content goes to a temporary file in the cache directory and is moved
+    into place atomically on commit, so readers never see a partial blob.
+    """
+
+    def __init__(self, cache: "BlobCache", key: str, expected_size: Optional[int]):
+        self.cache = cache
+        self.key = key
+        self.expected_size = expected_size
+        self.size = 0
+        fd, self.temp_path = tempfile.mkstemp(dir=cache.temp_dir, suffix=".part")
+        self.file: BinaryIO = os.fdopen(fd, "w+b")
+
+    def write(self, chunk: bytes) -> None:
+        """Append a chunk of the content."""
+        self.file.write(chunk)
+        self.size += len(chunk)
+
+    def commit(self) -> bool:
+        """
+        Publish the blob.
+
+        The file stays open, so the caller can keep reading it even if the
+        blob is evicted right away.
+
+        Returns:
+            True if the blob was stored, False if it was discarded because
+            it is incomplete or too large
+        """
+        if (
+            self.expected_size is not None and self.size != self.expected_size
+        ) or self.size > self.cache.max_file_size:
+            self.abort()
+            return False
+
+        self.file.flush()
+        try:
+            os.replace(self.temp_path, self.cache.path_for(self.key))
+        except OSError as e:
+            logger.error(f"Error storing blob {self.key}: {e}")
+            self.abort()
+            return False
+        self.cache.add_usage(self.size)
+        return True
+
+    def abort(self) -> None:
+        """Discard the blob."""
+        try:
+            os.unlink(self.temp_path)
+        except FileNotFoundError:
+            pass
+
+    def close(self) -> None:
+        """Close the underlying file."""
+        self.file.close()
+
+
+class BlobRange:
+    """Read-only view of a byte range of an open blob, starting at its offset."""
+
+    def __init__(self, file: BinaryIO, start: int, length: int):
+        file.seek(start)
+        self.file = file
+        self.remaining = length
+
+    def read(self, size: int = -1) -> bytes:
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class BlobCache:
+    """
+    Content-addressed file store with a byte budget and LRU eviction.
+
+    Blobs are plain files named by key below the cache directory, so every
+    worker process on the host shares them. A blob's modification time is
+    bumped on each hit and the least recently used blobs are evicted when
+    the budget is exceeded.
+    """
+
+    def __init__(self, root: str, max_bytes: int, max_file_size: int):
+        """
+        Initialize the cache directory.
+
+        Args:
+            root: Cache directory, created if missing
+            max_bytes: Total size budget of all blobs
+            max_file_size: Largest blob kept in the cache
+        """
+        self.root = root
+        self.max_bytes = max_bytes
+        self.max_file_size = min(max_file_size, max_bytes)
+        self.temp_dir = os.path.join(root, "tmp")
+        os.makedirs(self.temp_dir, exist_ok=True)
+        self._usage: Optional[int] = None
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def make_key(
+        md5: Optional[str] = None,
+        sha256: Optional[str] = None,
+        public_key: Optional[str] = None,
+        path: Optional[str] = None,
+        revision: Optional[str] = None,
+    ) -> Optional[str]:
+        """
+        Build the blob key of a file.
+
+        Files are identified by content hash when known, otherwise by
+        public key, path and revision.
+
+        Args:
+            md5: MD5 of the content
+            sha256: SHA-256 of the content
+            public_key: Canonical public key
+            path: File path inside the public resource
+            revision: Modification timestamp of the file
+
+        Returns:
+            Hex key, or None if the file cannot be identified
+        """
+        if sha256:
+            identity = f"sha256:{sha256.lower()}"
+        elif md5:
+            identity = f"md5:{md5.lower()}"
+        elif public_key and path and revision:
+            identity = "\0".join(
+                [
+                    "resource",
+                    public_key,
+                    path.strip("/"),
+                    revision,
+                ]
+            )
+        else:
+            return None
+        return hashlib.sha256(identity.encode("utf-8")).hexdigest()
+
+    def path_for(self, key: str) -> str:
+        """Return the file path of a blob."""
+        return os.path.join(self.root, key[:2], key)
+
+    def open(self, key: str) -> Optional[BinaryIO]:
+        """
+        Open a cached blob and mark it as recently used.
+
+        Returns:
+            File opened for binary reading, or None on a miss
+        """
+        path = self.path_for(key)
+        try:
+            blob = open(path, "rb")
+        except FileNotFoundError:
+            return None
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        return blob
+
+    def create(
+        self, key: str, expected_size: Optional[int] = None
+    ) -> Optional[BlobWriter]:
+        """
+        Start writing a blob.
+
+        Args:
+            key: Blob key
+            expected_size: Content length, if known; blobs of another size
+                are discarded on commit
+
+        Returns:
+            BlobWriter, or None if the file is too large to cache
+        """
+        if expected_size is not None and expected_size > self.max_file_size:
+            return None
+        try:
+            os.makedirs(os.path.dirname(self.path_for(key)), exist_ok=True)
+            return BlobWriter(self, key, expected_size)
+        except OSError as e:
+            logger.error(f"Error creating blob {key}: {e}")
+            return None
+
+    def add_usage(self, size: int) -> None:
+        """Account for a stored blob, evicting old blobs when over budget."""
+        with self._lock:
+            if self._usage is not None:
+                self._usage += size
+            over_budget = self._usage is None or self._usage > self.max_bytes
+        if over_budget:
+            self.evict()
+
+    def evict(self) -> int:
+        """
+        Evict least recently used blobs until the cache fits its budget.
+
+        Other processes store blobs too, so usage is measured on disk.
+
+        Returns:
+            Number of bytes freed
+        """
+        blobs = []
+        now = time.time()
+        for entry in self._scan():
+            try:
+                stat = entry.stat()
+            except FileNotFoundError:
+                continue
+            if os.path.dirname(entry.path) == self.temp_dir:
+                if now - stat.st_mtime > STALE_TEMP_AGE:
+                    self._unlink(entry.path)
+                continue
+            blobs.append((stat.st_mtime, stat.st_size, entry.path))
+
+        usage = sum(size for _, size, _ in blobs)
+        freed = 0
+        if usage > self.max_bytes:
+            target = self.max_bytes * EVICTION_LOW_WATERMARK
+            for _, size, path in sorted(blobs):
+                if usage - freed <= target:
+                    break
+                if self._unlink(path):
+                    freed += size
+            logger.info(f"Evicted {freed} bytes from the blob cache")
+
+        with self._lock:
+            self._usage = usage - freed
+        return freed
+
+    def _scan(self) -> Iterator[os.DirEntry]:
+        """Yield the files below the cache directory."""
+        with os.scandir(self.root) as folders:
+            for folder in folders:
+                if not folder.is_dir():
+                    continue
+                with os.scandir(folder.path) as files:
+                    yield from (entry for entry in files if entry.is_file())
+
+    @staticmethod
+    def _unlink(path: str) -> bool:
+        try:
+            os.unlink(path)
+            return True
+        except FileNotFoundError:
+            return False
+
+
+def get_blob_cache() -> Optional[BlobCache]:
+    """
+    Return the process-wide blob cache.
+
+    Returns:
+        BlobCache, or None if settings.YANDEX_DISK_BLOB_CACHE_DIR or
+        settings.YANDEX_DISK_BLOB_CACHE_MAX_BYTES is not set
+    """
+    global _blob_cache
+    if (
+        not settings.YANDEX_DISK_BLOB_CACHE_DIR
+        or settings.YANDEX_DISK_BLOB_CACHE_MAX_BYTES <= 0
+    ):
+        return None
+    with _blob_cache_lock:
+        if _blob_cache is None:
+            _blob_cache = BlobCache(
+                settings.YANDEX_DISK_BLOB_CACHE_DIR,
+                settings.YANDEX_DISK_BLOB_CACHE_MAX_BYTES,
+                settings.YANDEX_DISK_BLOB_CACHE_MAX_FILE_SIZE,
+            )
+        return _blob_cache
+
+
+def tee_to_blob(chunks: Iterable[bytes], writer: BlobWriter) -> Iterator[bytes]:
+    """
+    Relay content chunks while writing them to a blob.
+
+    The blob is committed only if the content was consumed in full.
+    """
+    completed = False
+    try:
+        for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            writer.commit()
+        else:
+            writer.abort()
+        writer.close()
+
+
+async def atee_to_blob(
+    chunks: AsyncIterable[bytes], writer: BlobWriter
+) -> AsyncIterator[bytes]:
+    """Async variant of tee_to_blob."""
+    completed = False
+    try:
+        async for chunk in chunks:
+            writer.write(chunk)
+            yield chunk
+        completed = True
+    finally:
+        if completed:
+            writer.commit()
+        else:
+            writer.abort()
+        writer.close()
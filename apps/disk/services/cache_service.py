@@ -1,26 +1,740 @@
+from collections import Counter, OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass, field
+from urllib.parse import urlparse
+import hashlib
+import logging
+import threading
+import time
+from asgiref.sync import sync_to_async
+from django.conf import settings
 from django.core.cache import cache
-from typing import List
+from django.db import DatabaseError
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Sequence, Tuple
 from .disk_service import YandexDiskFile
+from .listing_codec import decode_listing, encode_listing
+from .listing_columns import ListingColumns
+from .listing_index import ListingIndex
+from .metadata_store import PARTIAL_LISTING, MetadataStore
+from .single_flight import SingleFlight
+
+logger = logging.getLogger(__name__)
+
+# Concurrent fetches of the same listing or download link share one call
+_listing_flights = SingleFlight("listing")
+_link_flights = SingleFlight("href")
+_revision_flights = SingleFlight("revision")
+
+# Listings being refreshed in the background by this process
+_refreshing = set()
+_refresh_lock = threading.Lock()
+_refresh_executor: Optional[ThreadPoolExecutor] = None
+
+# Listing cache counters for this process
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+# A listing fetched from the API and its validators
+FetchedListing = Tuple[Sequence[YandexDiskFile], Dict[str, Any]]
+
+# Refreshes a cached listing from its resources and validators
+ListingRefresh = Callable[[Sequence[YandexDiskFile], Dict[str, Any]], FetchedListing]
+
+
+@dataclass
+class CachedListing:
+    """
+    Cache entry for a folder listing.
+
+    Attributes:
+        resources: Files in the folder, stored as ListingColumns
+        validators: Folder metadata used to revalidate the listing
+        fetched_at: Time the listing was fetched or last revalidated
+        index: Sort orders and file type buckets, built on creation
+    """
+
+    resources: Sequence[YandexDiskFile]
+    validators: Dict[str, Any] = field(default_factory=dict)
+    fetched_at: float = field(default_factory=time.time)
+    index: Optional[ListingIndex] = None
+
+    def __post_init__(self):
+        if not isinstance(self.resources, ListingColumns):
+            self.resources = ListingColumns(self.resources)
+        if self.index is None:
+            self.index = ListingIndex(self.resources)
+
+    def to_bytes(self) -> bytes:
+        """Encode the listing in the binary cache format of listing_codec."""
+        return encode_listing(
+            self.resources, self.index, self.validators, self.fetched_at
+        )
+
+    @classmethod
+    def from_bytes(cls, data: Any) -> Optional["CachedListing"]:
+        """
+        Decode a listing read from the shared cache.
+
+        Returns:
+            The listing, or None if ``data`` is not an entry of the current
+            format version
+        """
+        decoded = decode_listing(data)
+        if decoded is None:
+            return None
+        resources, index, validators, fetched_at = decoded
+        return cls(resources, validators, fetched_at, index)
+
+
+class LocalLRUCache:
+    """
+    Small thread-safe LRU cache with per-entry expiry.
+
+    Sits in front of the shared cache backend to save a round trip and
+    unpickling on hot listings. Entries expire quickly, so the tiers stay
+    coherent when another process refreshes a listing.
+    """
+
+    def __init__(self, max_size: int, ttl: float):
+        """
+        Initialize cache limits.
+
+        Args:
+            max_size: Maximum number of entries; 0 disables the cache
+            ttl: Seconds an entry stays valid
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        """Return a valid entry and mark it as recently used."""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at <= time.monotonic():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any) -> None:
+        """Store an entry, evicting the least recently used ones."""
+        if self.max_size <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic() + self.ttl, value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def delete(self, key: str) -> None:
+        """Remove an entry if present."""
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def clear(self) -> None:
+        """Remove all entries."""
+        with self._lock:
+            self._entries.clear()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+
+_local_listings = LocalLRUCache(
+    settings.YANDEX_DISK_LISTING_LOCAL_SIZE, settings.YANDEX_DISK_LISTING_LOCAL_TTL
+)
+
+
+def _count(name: str) -> None:
+    with _stats_lock:
+        _stats[name] += 1
+
+
+def _get_refresh_executor() -> ThreadPoolExecutor:
+    """Return the pool running background listing refreshes."""
+    global _refresh_executor
+    with _refresh_lock:
+        if _refresh_executor is None:
+            _refresh_executor = ThreadPoolExecutor(
+                max_workers=settings.YANDEX_DISK_LISTING_REFRESH_WORKERS,
+                thread_name_prefix="yadisk-refresh",
+            )
+        return _refresh_executor
 
 
 class CacheService:
     """Service responsible for caching Yandex Disk resources."""
 
     @staticmethod
-    def get_cache_key(public_key: str, path: str = "") -> str:
-        """Generate a unique cache key for a specific public_key and path."""
-        return f"yandex_disk_resources:{public_key}:{path}"
+    def normalize_public_key(public_key: str) -> str:
+        """
+        Return the canonical form of a public key or public URL.
+
+        URLs differing only in scheme, host alias, query string or trailing
+        slash refer to the same resource and share one form.
+        """
+        public_key = public_key.strip()
+        parsed = urlparse(public_key)
+        if not parsed.netloc:
+            return public_key
+
+        host = parsed.netloc.lower()
+        if host.startswith("www."):
+            host = host[4:]
+        if host.startswith("disk.yandex."):
+            host = "disk.yandex"
+        return f"{host}{parsed.path.rstrip('/')}"
+
+    @staticmethod
+    def get_cache_key(public_key: str, path: str = "", recursive: bool = False) -> str:
+        """
+        Generate the cache key for a folder listing.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: Folder path inside the public resource
+            recursive: Whether the listing includes subfolders
+
+        Returns:
+            Fixed-length key safe for every cache backend
+        """
+        identity = "\0".join(
+            [
+                CacheService.normalize_public_key(public_key),
+                "/" + path.strip("/"),
+                "recursive" if recursive else "",
+            ]
+        )
+        digest = hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+        return f"yandex_disk_resources:{digest}"
 
     @staticmethod
     def cache_resources(
-        public_key: str, path: str, resources: List[YandexDiskFile]
+        public_key: str,
+        path: str,
+        resources: Sequence[YandexDiskFile],
+        recursive: bool = False,
+        validators: Optional[Dict[str, Any]] = None,
+    ) -> CachedListing:
+        """
+        Cache a folder listing in all tiers.
+
+        The listing is fresh for settings.YANDEX_DISK_LISTING_TTL seconds and
+        can then be served stale for settings.YANDEX_DISK_LISTING_STALE_TTL
+        more seconds while it is refreshed. ``validators`` let the refresh
+        skip the fetch when the folder has not changed. A listing marked
+        with the PARTIAL_LISTING validator is cached as already stale, so the
+        next read refreshes it.
+
+        Returns:
+            The cached listing with its index
+        """
+        cache_key = CacheService.get_cache_key(public_key, path, recursive)
+        validators = validators or {}
+        entry = CachedListing(resources, validators)
+        if validators.get(PARTIAL_LISTING):
+            entry.fetched_at = 0.0
+        if settings.YANDEX_DISK_METADATA_STORE:
+            try:
+                MetadataStore.save_listing(
+                    CacheService.normalize_public_key(public_key),
+                    public_key,
+                    path,
+                    recursive,
+                    resources,
+                    validators,
+                )
+            except (DatabaseError, TypeError, ValueError) as e:
+                logger.error(f"Error storing listing for {public_key}: {e}")
+        CacheService._set_listing(cache_key, entry)
+        return entry
+
+    @staticmethod
+    def _set_listing(cache_key: str, entry: CachedListing) -> None:
+        """Write a listing to the shared and local cache tiers."""
+        cache.set(
+            cache_key,
+            entry.to_bytes(),
+            timeout=(
+                settings.YANDEX_DISK_LISTING_TTL
+                + settings.YANDEX_DISK_LISTING_STALE_TTL
+            ),
+        )
+        _local_listings.set(cache_key, entry)
+
+    @staticmethod
+    def _load_stored_listing(
+        public_key: str, path: str, recursive: bool
+    ) -> Optional[CachedListing]:
+        """Load a listing from the metadata store, if enabled and present."""
+        if not settings.YANDEX_DISK_METADATA_STORE:
+            return None
+        try:
+            stored = MetadataStore.load_listing(
+                CacheService.normalize_public_key(public_key), path, recursive
+            )
+        except DatabaseError as e:
+            logger.error(f"Error loading stored listing for {public_key}: {e}")
+            return None
+        if stored is None:
+            return None
+        resources, validators, fetched_at = stored
+        return CachedListing(resources, validators, fetched_at)
+
+    @staticmethod
+    def fetch_listing(
+        public_key: str,
+        path: str,
+        recursive: bool,
+        fetch: Callable[[], FetchedListing],
+    ) -> CachedListing:
+        """
+        Fetch and cache a listing after a miss.
+
+        Concurrent misses for the same listing share one fetch, including
+        misses in other processes using the same cache backend.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: Folder path inside the public resource
+            recursive: Whether the listing includes subfolders
+            fetch: Callable returning the listing from the API and its
+                validators
+
+        Returns:
+            The cached listing with its index
+        """
+        cache_key = CacheService.get_cache_key(public_key, path, recursive)
+
+        def fetch_and_cache() -> CachedListing:
+            resources, validators = fetch()
+            return CacheService.cache_resources(
+                public_key, path, resources, recursive, validators
+            )
+
+        return _listing_flights.do(
+            cache_key,
+            fetch_and_cache,
+            check=lambda: CachedListing.from_bytes(cache.get(cache_key)),
+        )
+
+    @staticmethod
+    async def afetch_listing(
+        public_key: str,
+        path: str,
+        recursive: bool,
+        fetch: Callable[[], Awaitable[FetchedListing]],
+    ) -> CachedListing:
+        """
+        Async variant of fetch_listing for async views.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: Folder path inside the public resource
+            recursive: Whether the listing includes subfolders
+            fetch: Coroutine function returning the listing from the API and
+                its validators
+
+        Returns:
+            The cached listing with its index
+        """
+        cache_key = CacheService.get_cache_key(public_key, path, recursive)
+
+        async def fetch_and_cache() -> CachedListing:
+            files, validators = await fetch()
+            return await sync_to_async(CacheService.cache_resources)(
+                public_key, path, files, recursive, validators
+            )
+
+        async def check() -> Optional[CachedListing]:
+            return CachedListing.from_bytes(await cache.aget(cache_key))
+
+        return await _listing_flights.ado(cache_key, fetch_and_cache, check)
+
+    @staticmethod
+    def get_cached_resources(
+        public_key: str,
+        path: str = "",
+        recursive: bool = False,
+        refresh: Optional[ListingRefresh] = None,
+    ) -> Optional[Sequence[YandexDiskFile]]:
+        """
+        Retrieve cached folder resources if available.
+
+        See get_cached_listing.
+
+        Returns:
+            Sequence of YandexDiskFile objects, or None on a miss
+        """
+        entry = CacheService.get_cached_listing(public_key, path, recursive, refresh)
+        return entry.resources if entry else None
+
+    @staticmethod
+    def get_cached_listing(
+        public_key: str,
+        path: str = "",
+        recursive: bool = False,
+        refresh: Optional[ListingRefresh] = None,
+    ) -> Optional[CachedListing]:
+        """
+        Retrieve a cached folder listing if available.
+
+        Looks in the local tier, the shared cache and then the metadata
+        store. Expired listings are still returned; when ``refresh`` is
+        given it is run in the background with the cached resources and
+        validators to bring them up to date.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: Folder path inside the public resource
+            recursive: Whether the listing includes subfolders
+            refresh: Callable returning the current resources and validators
+
+        Returns:
+            CachedListing with the resources and their index, or None on a
+            miss
+        """
+        cache_key = CacheService.get_cache_key(public_key, path, recursive)
+        entry = _local_listings.get(cache_key)
+        if entry is not None:
+            tier = "local"
+        else:
+            entry = CachedListing.from_bytes(cache.get(cache_key))
+            if entry is not None:
+                tier = "shared"
+                _local_listings.set(cache_key, entry)
+            else:
+                entry = CacheService._load_stored_listing(public_key, path, recursive)
+                if entry is None:
+                    _count("misses")
+                    return None
+                tier = "store"
+                CacheService._set_listing(cache_key, entry)
+
+        if time.time() - entry.fetched_at < settings.YANDEX_DISK_LISTING_TTL:
+            _count(f"{tier}_hits")
+        else:
+            _count("stale_hits")
+            if refresh is not None:
+                CacheService._schedule_refresh(
+                    cache_key, public_key, path, recursive, entry, refresh
+                )
+        return entry
+
+    @staticmethod
+    def _schedule_refresh(
+        cache_key: str,
+        public_key: str,
+        path: str,
+        recursive: bool,
+        entry: CachedListing,
+        refresh: ListingRefresh,
     ) -> None:
-        """Cache the resources for 5 minutes."""
-        cache_key = CacheService.get_cache_key(public_key, path)
-        cache.set(cache_key, resources, timeout=300)
+        """Refresh a stale listing in the background, once across processes."""
+        with _refresh_lock:
+            if cache_key in _refreshing:
+                return
+            _refreshing.add(cache_key)
+
+        # Other processes sharing the backend skip listings being refreshed
+        lock_key = f"{cache_key}:refresh"
+        if not cache.add(lock_key, True, timeout=settings.YANDEX_DISK_LISTING_TTL):
+            with _refresh_lock:
+                _refreshing.discard(cache_key)
+            return
+
+        def run() -> None:
+            try:
+                resources, validators = refresh(entry.resources, entry.validators)
+                if resources is entry.resources:
+                    if settings.YANDEX_DISK_METADATA_STORE:
+                        MetadataStore.touch_listing(
+                            CacheService.normalize_public_key(public_key),
+                            path,
+                            recursive,
+                            validators,
+                        )
+                    CacheService._set_listing(
+                        cache_key,
+                        CachedListing(resources, validators, index=entry.index),
+                    )
+                    _count("not_modified")
+                else:
+                    CacheService.cache_resources(
+                        public_key, path, resources, recursive, validators
+                    )
+                    _count("refreshes")
+            except Exception as e:
+                logger.error(f"Error refreshing cached listing for {public_key}: {e}")
+                _count("refresh_errors")
+            finally:
+                cache.delete(lock_key)
+                with _refresh_lock:
+                    _refreshing.discard(cache_key)
+
+        _get_refresh_executor().submit(run)
+
+    @staticmethod
+    def get_stats() -> Dict[str, Any]:
+        """
+        Return listing cache counters for this process.
+
+        Returns:
+            Dict with hit, miss and refresh counts (``not_modified`` counts
+            refreshes that found the folder unchanged), the hit ratio, the
+            number of listings held in the local tier and the number of
+            listing and link fetches that waited for a concurrent one
+        """
+        with _stats_lock:
+            stats = {
+                name: _stats[name]
+                for name in (
+                    "local_hits",
+                    "shared_hits",
+                    "store_hits",
+                    "stale_hits",
+                    "misses",
+                    "not_modified",
+                    "refreshes",
+                    "refresh_errors",
+                )
+            }
+        lookups = (
+            stats["local_hits"]
+            + stats["shared_hits"]
+            + stats["store_hits"]
+            + stats["stale_hits"]
+            + stats["misses"]
+        )
+        stats["hit_ratio"] = (lookups - stats["misses"]) / lookups if lookups else 0.0
+        stats["local_size"] = len(_local_listings)
+        stats["listing_coalesced"] = _listing_flights.coalesced
+        stats["link_coalesced"] = _link_flights.coalesced
+        return stats
+
+    @staticmethod
+    def get_link_cache_key(public_key: str, path: str) -> str:
+        """
+        Generate the cache key for a resolved download link.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: File path inside the public resource
+
+        Returns:
+            Fixed-length key safe for every cache backend
+        """
+        return CacheService._file_cache_key("yandex_disk_href", public_key, path)
+
+    @staticmethod
+    def _file_cache_key(prefix: str, public_key: str, path: str) -> str:
+        """Build a hashed cache key from the canonical public key and path."""
+        identity = "\0".join(
+            [CacheService.normalize_public_key(public_key), "/" + path.strip("/")]
+        )
+        digest = hashlib.sha256(identity.encode("utf-8")).hexdigest()[:32]
+        return f"{prefix}:{digest}"
+
+    @staticmethod
+    def get_revision_cache_key(public_key: str, path: str) -> str:
+        """Generate the cache key for the revision of a file."""
+        return CacheService._file_cache_key("yandex_disk_revision", public_key, path)
+
+    @staticmethod
+    def get_download_link(
+        public_key: str,
+        path: str,
+        resolver: Callable[[str, str], Optional[str]],
+    ) -> Optional[str]:
+        """
+        Return a download link, resolving and caching it on a miss.
+
+        Concurrent misses for the same file share a single upstream call,
+        also across processes using the same cache backend.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: File path inside the public folder
+            resolver: Callable fetching the link from the API
+
+        Returns:
+            Download link or None if it could not be resolved
+        """
+        return CacheService._get_file_value(
+            CacheService.get_link_cache_key(public_key, path),
+            _link_flights,
+            lambda: resolver(public_key, path),
+        )
 
     @staticmethod
-    def get_cached_resources(public_key: str, path: str = "") -> List[YandexDiskFile]:
-        """Retrieve cached resources if available."""
-        cache_key = CacheService.get_cache_key(public_key, path)
-        return cache.get(cache_key)
+    async def aget_download_link(
+        public_key: str,
+        path: str,
+        resolver: Callable[[str, str], Awaitable[Optional[str]]],
+    ) -> Optional[str]:
+        """
+        Async variant of get_download_link for async views.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: File path inside the public folder
+            resolver: Coroutine function fetching the link from the API
+
+        Returns:
+            Download link or None if it could not be resolved
+        """
+        return await CacheService._aget_file_value(
+            CacheService.get_link_cache_key(public_key, path),
+            _link_flights,
+            lambda: resolver(public_key, path),
+        )
+
+    @staticmethod
+    def get_download_links(
+        public_key: str,
+        paths: List[str],
+        resolver: Callable[[str, List[str]], List[Optional[str]]],
+    ) -> List[Optional[str]]:
+        """
+        Return download links for several files, resolving misses in one batch.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            paths: File paths inside the public folder
+            resolver: Callable resolving a list of paths in order
+
+        Returns:
+            Links in the same order as ``paths``
+        """
+        return CacheService._get_file_values(
+            CacheService.get_link_cache_key, public_key, paths, resolver
+        )
+
+    @staticmethod
+    def get_file_revision(
+        public_key: str,
+        path: str,
+        resolver: Callable[[str, str], Optional[Dict[str, Any]]],
+    ) -> Optional[Dict[str, Any]]:
+        """
+        Return the fields identifying the current version of a file.
+
+        Revisions are cached as long as download links, so a link and the
+        revision it is stored under in the blob cache age together.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: File path inside the public folder
+            resolver: Callable fetching the revision from the API
+
+        Returns:
+            Dict with the file's ``md5``, ``sha256`` and ``modified``, or
+            None if it could not be fetched
+        """
+        return CacheService._get_file_value(
+            CacheService.get_revision_cache_key(public_key, path),
+            _revision_flights,
+            lambda: resolver(public_key, path),
+        )
+
+    @staticmethod
+    async def aget_file_revision(
+        public_key: str,
+        path: str,
+        resolver: Callable[[str, str], Awaitable[Optional[Dict[str, Any]]]],
+    ) -> Optional[Dict[str, Any]]:
+        """Async variant of get_file_revision for async views."""
+        return await CacheService._aget_file_value(
+            CacheService.get_revision_cache_key(public_key, path),
+            _revision_flights,
+            lambda: resolver(public_key, path),
+        )
+
+    @staticmethod
+    def get_file_revisions(
+        public_key: str,
+        paths: List[str],
+        resolver: Callable[[str, List[str]], List[Optional[Dict[str, Any]]]],
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Return the revisions of several files, fetching misses in one batch.
+
+        Returns:
+            Revisions in the same order as ``paths``
+        """
+        return CacheService._get_file_values(
+            CacheService.get_revision_cache_key, public_key, paths, resolver
+        )
+
+    @staticmethod
+    def _get_file_value(
+        cache_key: str, flights: SingleFlight, resolve: Callable[[], Any]
+    ) -> Any:
+        """Return a cached per-file value, resolving it once on a miss."""
+        value = cache.get(cache_key)
+        if value:
+            return value
+
+        def resolve_and_cache() -> Any:
+            value = resolve()
+            if value:
+                cache.set(cache_key, value, timeout=settings.YANDEX_DISK_HREF_TTL)
+            return value
+
+        return flights.do(
+            cache_key, resolve_and_cache, check=lambda: cache.get(cache_key)
+        )
+
+    @staticmethod
+    async def _aget_file_value(
+        cache_key: str, flights: SingleFlight, resolve: Callable[[], Awaitable[Any]]
+    ) -> Any:
+        """Async variant of _get_file_value."""
+        value = await cache.aget(cache_key)
+        if value:
+            return value
+
+        async def resolve_and_cache() -> Any:
+            value = await resolve()
+            if value:
+                await cache.aset(
+                    cache_key, value, timeout=settings.YANDEX_DISK_HREF_TTL
+                )
+            return value
+
+        async def check() -> Any:
+            return await cache.aget(cache_key)
+
+        return await flights.ado(cache_key, resolve_and_cache, check)
+
+    @staticmethod
+    def _get_file_values(
+        make_key: Callable[[str, str], str],
+        public_key: str,
+        paths: List[str],
+        resolver: Callable[[str, List[str]], List[Any]],
+    ) -> List[Any]:
+        """Return cached per-file values, resolving all misses in one call."""
+        keys = [make_key(public_key, path) for path in paths]
+        cached = cache.get_many(keys)
+
+        missing = [path for path, key in zip(paths, keys) if key not in cached]
+        if missing:
+            resolved = dict(zip(missing, resolver(public_key, missing)))
+            cache.set_many(
+                {
+                    make_key(public_key, path): value
+                    for path, value in resolved.items()
+                    if value
+                },
+                timeout=settings.YANDEX_DISK_HREF_TTL,
+            )
+        else:
+            resolved = {}
+
+        return [cached.get(key) or resolved.get(path) for path, key in zip(paths, keys)]
@@ -0,0 +1,168 @@
+"""
+Compression for archives.
+Chooses STORE or DEFLATE per entry and compresses DEFLATE entries in
+independent blocks that can run on several cores.
+"""
+
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Optional
+import math
+import threading
+import zipfile
+import zlib
+
+from django.conf import settings
+
+from .file_types import get_file_category, guess_mime_type
+
+# Deflate window size, the most history a block can refer back to
+DEFLATE_WINDOW = 32 * 1024
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+# Categories whose formats are compressed already
+STORED_CATEGORIES = {"image", "video", "audio", "archive"}
+
+# Compressed formats outside those categories, or exceptions within them
+STORED_MIME_PREFIXES = [
+    "application/vnd.openxmlformats-officedocument",
+    "application/vnd.oasis.opendocument",
+    "application/epub+zip",
+    "application/java-archive",
+    "application/gzip",
+    "application/x-bzip2",
+    "application/x-xz",
+]
+DEFLATED_MIME_PREFIXES = [
+    "image/bmp",
+    "image/svg+xml",
+    "image/tiff",
+    "image/x-ms-bmp",
+    "audio/wav",
+    "audio/x-wav",
+]
+
+
+def get_compress_executor() -> Optional[ThreadPoolExecutor]:
+    """
+    Return the compression pool shared by all archives in this process.
+
+    zlib releases the GIL while compressing, so threads use several cores.
+
+    Returns:
+        The pool, or None when settings.YANDEX_DISK_ARCHIVE_COMPRESS_WORKERS
+        disables parallel compression
+    """
+    global _executor
+    workers = settings.YANDEX_DISK_ARCHIVE_COMPRESS_WORKERS
+    if workers <= 1:
+        return None
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=workers, thread_name_prefix="yadisk-deflate"
+            )
+        return _executor
+
+
+def deflate_block(data: bytes, zdict: bytes = b"", level: int = 6) -> bytes:
+    """
+    Compress one block of an entry independently of the others.
+
+    The block ends on a sync flush, so compressed blocks can be concatenated
+    into a single deflate stream; priming with the tail of the previous
+    block as ``zdict`` keeps the ratio close to serial compression.
+
+    Args:
+        data: Uncompressed block
+        zdict: Up to DEFLATE_WINDOW bytes preceding the block in the entry
+        level: zlib compression level
+
+    Returns:
+        Raw deflate fragment
+    """
+    if zdict:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15, zdict=zdict)
+    else:
+        compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH)
+
+
+def byte_entropy(data: bytes) -> float:
+    """Shannon entropy of a byte string in bits per byte."""
+    if not data:
+        return 0.0
+    total = len(data)
+    return -sum(
+        count / total * math.log2(count / total) for count in Counter(data).values()
+    )
+
+
+class CompressionPolicy:
+    """Choose STORE or DEFLATE for each archive entry."""
+
+    def __init__(
+        self,
+        sample_size: Optional[int] = None,
+        entropy_threshold: Optional[float] = None,
+    ):
+        """
+        Initialize policy thresholds.
+
+        Args:
+            sample_size: Bytes of content inspected when the type is unknown,
+                defaults to settings.YANDEX_DISK_ARCHIVE_ENTROPY_SAMPLE; 0
+                disables sampling
+            entropy_threshold: Entropy in bits per byte above which a sample
+                is treated as incompressible, defaults to
+                settings.YANDEX_DISK_ARCHIVE_ENTROPY_THRESHOLD
+        """
+        self.sample_size = (
+            settings.YANDEX_DISK_ARCHIVE_ENTROPY_SAMPLE
+            if sample_size is None
+            else sample_size
+        )
+        self.entropy_threshold = (
+            settings.YANDEX_DISK_ARCHIVE_ENTROPY_THRESHOLD
+            if entropy_threshold is None
+            else entropy_threshold
+        )
+
+    def choose(
+        self,
+        name: str,
+        mime_type: Optional[str] = None,
+        sample: Optional[bytes] = None,
+    ) -> int:
+        """
+        Pick the compression method for an entry.
+
+        Args:
+            name: Entry name, used to guess the MIME type if none is given
+            mime_type: Known MIME type of the entry
+            sample: Leading bytes of the content for entries of unknown type
+
+        Returns:
+            zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+        """
+        mime_type = (mime_type or guess_mime_type(name) or "").lower()
+
+        if any(mime_type.startswith(p) for p in DEFLATED_MIME_PREFIXES):
+            return zipfile.ZIP_DEFLATED
+        if any(mime_type.startswith(p) for p in STORED_MIME_PREFIXES):
+            return zipfile.ZIP_STORED
+
+        category = get_file_category(mime_type)
+        if category in STORED_CATEGORIES:
+            return zipfile.ZIP_STORED
+        if category is not None:
+            return zipfile.ZIP_DEFLATED
+
+        if sample and self.sample_size:
+            entropy = byte_entropy(sample[: self.sample_size])
+            if entropy >= self.entropy_threshold:
+                return zipfile.ZIP_STORED
+
+        return zipfile.ZIP_DEFLATED
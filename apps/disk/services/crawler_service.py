@@ -0,0 +1,145 @@
+"""
+Folder crawler for Yandex.Disk public links.
+Walks public folder trees breadth-first using a shared worker pool.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from typing import Deque, Iterator, List, Optional, Tuple
+import logging
+import threading
+
+from django.conf import settings
+
+from .disk_service import YandexDiskFile, YandexDiskService
+
+logger = logging.getLogger(__name__)
+
+_executor: Optional[ThreadPoolExecutor] = None
+_executor_lock = threading.Lock()
+
+
+def get_crawl_executor() -> ThreadPoolExecutor:
+    """Return the worker pool shared by all crawls in this process."""
+    global _executor
+    with _executor_lock:
+        if _executor is None:
+            _executor = ThreadPoolExecutor(
+                max_workers=settings.YANDEX_DISK_CRAWL_WORKERS,
+                thread_name_prefix="yadisk-crawl",
+            )
+        return _executor
+
+
+@dataclass
+class CrawlNode:
+    """
+    A resource found while crawling.
+
+    Attributes:
+        file: The resource itself
+        depth: Nesting level below the crawl root, starting at 1
+    """
+
+    file: YandexDiskFile
+    depth: int
+
+
+class FolderCrawler:
+    """Breadth-first crawler for public folder trees."""
+
+    def __init__(
+        self,
+        disk_service: YandexDiskService,
+        max_depth: Optional[int] = None,
+        max_nodes: Optional[int] = None,
+        max_workers: Optional[int] = None,
+    ):
+        """
+        Initialize crawler limits.
+
+        Args:
+            disk_service: Service used to list folders
+            max_depth: Deepest level to descend into, defaults to
+                settings.YANDEX_DISK_CRAWL_MAX_DEPTH
+            max_nodes: Maximum number of resources to emit, defaults to
+                settings.YANDEX_DISK_CRAWL_MAX_NODES
+            max_workers: Folders listed in parallel by this crawl, defaults to
+                settings.YANDEX_DISK_CRAWL_WORKERS
+        """
+        self.disk_service = disk_service
+        self.max_depth = max_depth or settings.YANDEX_DISK_CRAWL_MAX_DEPTH
+        self.max_nodes = max_nodes or settings.YANDEX_DISK_CRAWL_MAX_NODES
+        self.max_workers = max_workers or settings.YANDEX_DISK_CRAWL_WORKERS
+        self.failed_folders: List[str] = []
+        self.truncated = False
+
+    @property
+    def complete(self) -> bool:
+        """Whether the last crawl listed every folder below its root."""
+        return not self.failed_folders and not self.truncated
+
+    def crawl(self, public_key: str, path: str = "") -> Iterator[CrawlNode]:
+        """
+        Walk a public folder tree breadth-first.
+
+        Nodes are yielded as soon as their folder has been listed, so callers
+        can use a partial tree before the crawl finishes. Folders that fail to
+        list are logged and recorded in ``failed_folders``; ``truncated`` is
+        set when the depth or node limit left part of the tree unlisted.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: Folder to start from, root by default
+
+        Yields:
+            CrawlNode objects in breadth-first order
+
+        Raises:
+            RuntimeError: If the starting folder cannot be listed
+        """
+        root = "/" + path.strip("/")
+        executor = get_crawl_executor()
+        waiting: Deque[Tuple[str, int]] = deque([(root, 1)])
+        in_flight: Deque[Tuple[str, int, Future]] = deque()
+        emitted = 0
+
+        try:
+            while waiting or in_flight:
+                while waiting and len(in_flight) < self.max_workers:
+                    folder, depth = waiting.popleft()
+                    future = executor.submit(self._list_folder, public_key, folder)
+                    in_flight.append((folder, depth, future))
+
+                folder, depth, future = in_flight.popleft()
+                try:
+                    items = future.result()
+                except Exception as e:
+                    if folder == root:
+                        raise
+                    logger.error(f"Error crawling folder {folder}: {e}")
+                    self.failed_folders.append(folder)
+                    continue
+
+                for item in items:
+                    if emitted >= self.max_nodes:
+                        self.truncated = True
+                        return
+                    emitted += 1
+                    yield CrawlNode(file=item, depth=depth)
+
+                    if item.type == "dir":
+                        if depth < self.max_depth:
+                            waiting.append(("/" + item.path, depth + 1))
+                        else:
+                            self.truncated = True
+        finally:
+            for _, _, future in in_flight:
+                future.cancel()
+
+    def _list_folder(self, public_key: str, folder: str) -> List[YandexDiskFile]:
+        """List a single folder on a pool worker."""
+        return list(
+            self.disk_service.iter_public_resources(public_key, folder, prefetch=False)
+        )
@@ -3,19 +3,38 @@ Yandex.Disk API Service Module
 Handles file operations and downloads from Yandex.Disk public folders.
 """
 
+from concurrent.futures import ThreadPoolExecutor
 from dataclasses import dataclass
-from typing import List, Optional, Dict, Any
+from datetime import datetime, timezone
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
 import logging
 import requests
 from urllib.parse import urlparse
 import os
-import io
-import zipfile
+
+from django.conf import settings
+
+from .archive_service import stream_archive
+from .hedging import api_hedging
+from .http_client import (
+    THROTTLE_STATUSES,
+    get_api_session,
+    get_http_session,
+    parse_retry_after,
+)
+from .prefetch import PrefetchPipeline
+from .rate_limiter import api_limiter
 
 logger = logging.getLogger(__name__)
 
+# Folder metadata compared to decide whether a cached listing is current
+VALIDATOR_FIELDS = ("revision", "modified", "md5", "total")
+
+# File metadata identifying the version of a file's content
+REVISION_FIELDS = ("md5", "sha256", "modified")
+
 
-@dataclass
+@dataclass(slots=True)
 class YandexDiskFile:
     """
     Represents a file from Yandex.Disk.
@@ -28,7 +47,8 @@ class YandexDiskFile:
         created: Creation timestamp
         modified: Last modification timestamp
         mime_type: MIME type
-        download_link: Direct download URL
+        download_link: Direct download URL, resolved on demand
+        public_key: Public key of the folder the file belongs to
     """
 
     name: str
@@ -39,6 +59,7 @@ class YandexDiskFile:
     modified: str
     mime_type: str
     download_link: Optional[str] = None
+    public_key: str = ""
 
     @property
     def size_formatted(self) -> str:
@@ -54,19 +75,24 @@ class YandexDiskFile:
 class YandexDiskService:
     """Service for interacting with Yandex.Disk API."""
 
-    BASE_URL = "https://cloud-api.yandex.net/v1/disk/public"
     CHUNK_SIZE = 8192  # Chunk size for streaming
 
     def __init__(self):
-        """Initialize service with OAuth token."""
+        """
+        Initialize service with the API URL and the optional OAuth token.
+
+        Public resources can be read anonymously; the token, if set, is sent
+        with API calls.
+        """
+        self.base_url = settings.YANDEX_DISK_API_URL.rstrip("/")
         self.token = os.getenv("YANDEX_OAUTH_TOKEN")
-        if not self.token:
-            raise ValueError("Yandex OAuth token not found in environment")
 
-        self.session = requests.Session()
-        self.session.headers.update(
-            {"Authorization": f"OAuth {self.token}", "Accept": "application/json"}
-        )
+        # Process-wide pooled sessions; credentials are sent per request
+        self.session = get_http_session()
+        self.api_session = get_api_session()
+        self.headers = {"Accept": "application/json"}
+        if self.token:
+            self.headers["Authorization"] = f"OAuth {self.token}"
 
     @staticmethod
     def extract_public_key(url: str) -> str:
@@ -87,12 +113,15 @@ class YandexDiskService:
             logger.error(f"Error extracting public key: {e}")
             raise ValueError(f"Invalid Yandex.Disk URL format: {str(e)}")
 
-    def get_public_resources(self, public_url: str) -> List[YandexDiskFile]:
+    def get_public_resources(
+        self, public_url: str, path: str = ""
+    ) -> List[YandexDiskFile]:
         """
         Fetch files from public folder.
 
         Args:
             public_url: Yandex.Disk public URL or direct key
+            path: Folder path inside the public resource, root by default
 
         Returns:
             List of YandexDiskFile objects
@@ -100,39 +129,224 @@ class YandexDiskService:
         Raises:
             RuntimeError: If API request fails
         """
+        return list(self.iter_public_resources(public_url, path))
+
+    def iter_public_resources(
+        self,
+        public_url: str,
+        path: str = "",
+        page_size: Optional[int] = None,
+        prefetch: bool = True,
+        sort: str = "name",
+    ) -> Iterator[YandexDiskFile]:
+        """
+        Enumerate a public folder page by page.
+
+        Files are yielded as each page arrives, so at most two pages are held
+        in memory regardless of the folder size.
+
+        Args:
+            public_url: Yandex.Disk public URL or direct key
+            path: Folder path inside the public resource, root by default
+            page_size: Items per API request, defaults to
+                settings.YANDEX_DISK_PAGE_SIZE
+            prefetch: Fetch the next page while the current one is consumed
+            sort: API sort field, prefixed with ``-`` for descending order
+
+        Yields:
+            YandexDiskFile objects in API order
+
+        Raises:
+            RuntimeError: If API request fails
+        """
+        limit = page_size or settings.YANDEX_DISK_PAGE_SIZE
+        executor = (
+            ThreadPoolExecutor(max_workers=1, thread_name_prefix="yadisk-page")
+            if prefetch
+            else None
+        )
+
+        try:
+            offset = 0
+            items, total = self._fetch_page(public_url, path, offset, limit, sort)
+            while True:
+                offset += len(items)
+                has_next = len(items) == limit and (total is None or offset < total)
+
+                next_page = None
+                if has_next and executor:
+                    next_page = executor.submit(
+                        self._fetch_page, public_url, path, offset, limit, sort
+                    )
+
+                # Download links are resolved lazily when a download starts
+                for item in items:
+                    yield self._to_file(item, public_url)
+
+                if not has_next:
+                    break
+                if next_page:
+                    items, total = next_page.result()
+                else:
+                    items, total = self._fetch_page(
+                        public_url, path, offset, limit, sort
+                    )
+        finally:
+            if executor:
+                executor.shutdown(wait=False, cancel_futures=True)
+
+    def _fetch_page(
+        self, public_url: str, path: str, offset: int, limit: int, sort: str = "name"
+    ) -> Tuple[List[Dict[str, Any]], Optional[int]]:
+        """
+        Fetch one page of folder items.
+
+        Returns:
+            Tuple of raw items and the total number of items in the folder
+        """
         try:
             params = {
                 "public_key": public_url,
-                "limit": 100,
-                "sort": "name",
-                "fields": "name,path,type,size,created,modified,mime_type,_embedded.items",
+                "offset": offset,
+                "limit": limit,
+                "sort": sort,
+                "fields": (
+                    "name,path,type,size,created,modified,mime_type,"
+                    "_embedded.items,_embedded.total"
+                ),
             }
+            if path:
+                params["path"] = path
 
-            response = self.session.get(f"{self.BASE_URL}/resources", params=params)
+            response = self._api_get(f"{self.base_url}/resources", params)
             response.raise_for_status()
             data = response.json()
 
             if "_embedded" not in data or "items" not in data["_embedded"]:
                 raise ValueError("Invalid API response format")
 
-            return [
-                YandexDiskFile(
-                    name=item["name"],
-                    path=item["path"].lstrip("/"),
-                    type=item["type"],
-                    size=item.get("size", 0),
-                    created=item["created"],
-                    modified=item["modified"],
-                    mime_type=item.get("mime_type", "application/octet-stream"),
-                    download_link=self.get_download_link(public_url, item["path"]),
-                )
-                for item in data["_embedded"]["items"]
-            ]
+            return data["_embedded"]["items"], data["_embedded"].get("total")
 
         except requests.RequestException as e:
             logger.error(f"API request failed: {e}")
             raise RuntimeError(f"Failed to fetch resources: {str(e)}")
 
+    def get_resource_validators(
+        self, public_url: str, path: str = ""
+    ) -> Dict[str, Any]:
+        """
+        Fetch the folder fields that change when its content changes.
+
+        Args:
+            public_url: Yandex.Disk public URL or direct key
+            path: Folder path inside the public resource, root by default
+
+        Returns:
+            Dict of VALIDATOR_FIELDS; fields the API omits are None
+
+        Raises:
+            RuntimeError: If API request fails
+        """
+        try:
+            params = {
+                "public_key": public_url,
+                "limit": 1,
+                "fields": "revision,modified,md5,_embedded.total",
+            }
+            if path:
+                params["path"] = path
+
+            response = self._api_get(f"{self.base_url}/resources", params)
+            response.raise_for_status()
+            data = response.json()
+
+        except requests.RequestException as e:
+            logger.error(f"API request failed: {e}")
+            raise RuntimeError(f"Failed to fetch resource metadata: {str(e)}")
+
+        validators = {name: data.get(name) for name in VALIDATOR_FIELDS}
+        validators["total"] = data.get("_embedded", {}).get("total")
+        return validators
+
+    def revalidate_public_resources(
+        self,
+        public_url: str,
+        files: Sequence[YandexDiskFile],
+        validators: Dict[str, Any],
+        path: str = "",
+    ) -> Tuple[List[YandexDiskFile], Dict[str, Any]]:
+        """
+        Bring a cached folder listing up to date with as few requests as possible.
+
+        An unchanged folder costs one metadata request and ``files`` is
+        returned as is. Otherwise items are read newest first down to the
+        newest modification time in ``files`` and merged into the listing.
+        The folder is fetched in full when none of those items is new or
+        changed, or when the merged listing does not match the folder's item
+        count, i.e. when items were removed or renamed.
+
+        Args:
+            public_url: Yandex.Disk public URL or direct key
+            files: Cached listing of the folder
+            validators: Validators stored with the cached listing, may be empty
+            path: Folder path inside the public resource, root by default
+
+        Returns:
+            Tuple of the current listing and its validators
+
+        Raises:
+            RuntimeError: If API request fails
+        """
+        current = self.get_resource_validators(public_url, path)
+        if validators and current == validators:
+            return files, current
+
+        watermark = max(
+            filter(None, (parse_timestamp(f.modified) for f in files)), default=None
+        )
+        if watermark is not None and current["total"] is not None:
+            merged = {f.path: f for f in files}
+            changed = 0
+            for item in self.iter_public_resources(
+                public_url, path, prefetch=False, sort="-modified"
+            ):
+                modified = parse_timestamp(item.modified)
+                if modified is not None and modified < watermark:
+                    break
+                # Compared parsed, as stored listings may spell the same
+                # time with another offset
+                cached = merged.get(item.path)
+                if (
+                    cached is None
+                    or parse_timestamp(cached.modified) != modified
+                    or cached.size != item.size
+                ):
+                    changed += 1
+                merged[item.path] = item
+
+            # A new revision that no item explains is a rename or removal
+            # that kept the item count, which only a full fetch can reveal
+            if changed and len(merged) == current["total"]:
+                logger.debug(f"Merged {changed} changed items into {public_url}")
+                return sorted(merged.values(), key=lambda f: f.name), current
+
+        logger.debug(f"Refetching {public_url} in full")
+        return self.get_public_resources(public_url, path), current
+
+    @staticmethod
+    def _to_file(item: Dict[str, Any], public_url: str) -> YandexDiskFile:
+        """Build a YandexDiskFile from a raw API item."""
+        return YandexDiskFile(
+            name=item["name"],
+            path=item["path"].lstrip("/"),
+            type=item["type"],
+            size=item.get("size", 0),
+            created=item["created"],
+            modified=item["modified"],
+            mime_type=item.get("mime_type", "application/octet-stream"),
+            public_key=public_url,
+        )
+
     def _get_public_key(self, url: str) -> str:
         """Extract public key from URL or return direct key."""
         if not url.startswith("http"):
@@ -153,9 +367,7 @@ class YandexDiskService:
         """Get direct download link for a file."""
         try:
             params = {"public_key": public_key, "path": path}
-            response = self.session.get(
-                f"{self.BASE_URL}/resources/download", params=params
-            )
+            response = self._api_get(f"{self.base_url}/resources/download", params)
             response.raise_for_status()
 
             data = response.json()
@@ -165,37 +377,180 @@ class YandexDiskService:
             logger.error(f"Failed to get download link: {e}")
             return None
 
-    def create_zip(self, files: List[Dict[str, str]]) -> io.BytesIO:
+    def get_file_revision(self, public_key: str, path: str) -> Optional[Dict[str, Any]]:
+        """
+        Fetch the fields identifying the current version of a file.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            path: File path inside the public folder
+
+        Returns:
+            Dict of REVISION_FIELDS; fields the API omits are None. None if
+            the resource is not a file or could not be fetched
+        """
+        try:
+            params = {
+                "public_key": public_key,
+                "path": path,
+                "fields": "type," + ",".join(REVISION_FIELDS),
+            }
+            response = self._api_get(f"{self.base_url}/resources", params)
+            response.raise_for_status()
+            data = response.json()
+
+        except (requests.RequestException, ValueError) as e:
+            logger.error(f"Failed to get file revision: {e}")
+            return None
+
+        if data.get("type") != "file":
+            return None
+        return {name: data.get(name) for name in REVISION_FIELDS}
+
+    def resolve_download_links(
+        self, public_key: str, paths: List[str], max_workers: Optional[int] = None
+    ) -> List[Optional[str]]:
+        """
+        Resolve download links for several files concurrently.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            paths: File paths inside the public folder
+            max_workers: Number of parallel requests, defaults to
+                settings.YANDEX_DISK_LINK_WORKERS
+
+        Returns:
+            Links in the same order as ``paths``; ``None`` for items that
+            could not be resolved
         """
-        Create ZIP archive with multiple files.
+        return self._resolve_many(
+            public_key, paths, self.get_download_link, "download links", max_workers
+        )
+
+    def resolve_file_revisions(
+        self, public_key: str, paths: List[str], max_workers: Optional[int] = None
+    ) -> List[Optional[Dict[str, Any]]]:
+        """
+        Fetch the revisions of several files concurrently.
+
+        Args:
+            public_key: Yandex.Disk public URL or key
+            paths: File paths inside the public folder
+            max_workers: Number of parallel requests, defaults to
+                settings.YANDEX_DISK_LINK_WORKERS
+
+        Returns:
+            Revisions in the same order as ``paths``; ``None`` for items
+            that could not be fetched
+        """
+        return self._resolve_many(
+            public_key, paths, self.get_file_revision, "file revisions", max_workers
+        )
+
+    def _resolve_many(
+        self,
+        public_key: str,
+        paths: List[str],
+        resolve_one: Callable[[str, str], Any],
+        what: str,
+        max_workers: Optional[int],
+    ) -> List[Any]:
+        """Run a per-file API lookup for several paths on a thread pool."""
+        if not paths:
+            return []
+
+        workers = max_workers or settings.YANDEX_DISK_LINK_WORKERS
+        workers = max(1, min(workers, len(paths)))
+
+        def resolve(path: str) -> Any:
+            try:
+                return resolve_one(public_key, path)
+            except Exception as e:
+                logger.error(f"Error resolving {what} for {path}: {e}")
+                return None
+
+        with ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix="yadisk-link"
+        ) as executor:
+            results = list(executor.map(resolve, paths))
+
+        failed = sum(1 for result in results if result is None)
+        if failed:
+            logger.warning(f"Could not resolve {failed} of {len(paths)} {what}")
+
+        return results
+
+    def create_zip(self, files: List[Dict[str, str]]) -> Iterator[bytes]:
+        """
+        Stream ZIP archive with multiple files.
+
+        Upcoming files are downloaded concurrently into bounded spool
+        buffers, so memory use stays constant regardless of archive size.
+        Already compressed media is stored rather than deflated.
 
         Args:
             files: List of dicts with 'name' and 'download_url' keys
 
+        Yields:
+            ZIP archive bytes
+        """
+        pipeline = PrefetchPipeline(self._download_chunks)
+        entries = ((file["name"], file["download_url"], None) for file in files)
+        yield from stream_archive(pipeline.run(entries), "zip")
+
+    def _api_get(self, url: str, params: Dict[str, Any]) -> requests.Response:
+        """
+        Send an API GET request through the shared rate limiter.
+
+        Throttling responses are retried once the limiter lets the call
+        through again; other failures are retried by the session. Slow
+        attempts are hedged when settings.YANDEX_DISK_HEDGE_REQUESTS is on.
+
         Returns:
-            ZIP file as BytesIO object
+            The last response received
         """
-        buffer = io.BytesIO()
 
-        with zipfile.ZipFile(buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for file in files:
-                try:
-                    response = self.session.get(file["download_url"], stream=True)
-                    response.raise_for_status()
+        def send() -> requests.Response:
+            return self.api_session.get(url, params=params, headers=self.headers)
 
-                    # Stream directly to ZIP
-                    content = io.BytesIO()
-                    for chunk in response.iter_content(chunk_size=self.CHUNK_SIZE):
-                        if chunk:
-                            content.write(chunk)
+        def record(response: requests.Response) -> None:
+            api_limiter.record_response(
+                response.status_code,
+                parse_retry_after(response.headers.get("Retry-After")),
+            )
 
-                    content.seek(0)
-                    zip_file.writestr(file["name"], content.getvalue())
-                    logger.debug(f"Added {file['name']} to ZIP")
+        endpoint = url[len(self.base_url) :]
+        retries = settings.YANDEX_DISK_HTTP_RETRIES
+        for attempt in range(retries + 1):
+            response = api_hedging.call(endpoint, send, record)
+            if response.status_code not in THROTTLE_STATUSES or attempt == retries:
+                break
+            response.close()
+        return response
+
+    def _download_chunks(self, download_url: str) -> Iterator[bytes]:
+        """Stream the content of a direct download URL."""
+        with self.session.get(download_url, stream=True) as response:
+            response.raise_for_status()
+            yield from response.iter_content(chunk_size=self.CHUNK_SIZE)
+
+
+def parse_timestamp(value: Optional[str]) -> Optional[datetime]:
+    """
+    Parse an API timestamp such as ``2024-01-31T12:00:00+00:00``.
+
+    Timestamps without an offset are taken as UTC, so all parsed values
+    compare with each other.
 
-                except Exception as e:
-                    logger.error(f"Error adding {file['name']}: {e}")
-                    continue
+    Returns:
+        Aware datetime, or None if ``value`` is empty
 
-        buffer.seek(0)
-        return buffer
+    Raises:
+        ValueError: If ``value`` is not an ISO 8601 timestamp
+    """
+    if not value:
+        return None
+    parsed = datetime.fromisoformat(value)
+    if parsed.tzinfo is None:
+        parsed = parsed.replace(tzinfo=timezone.utc)
+    return parsed
@@ -0,0 +1,54 @@
+"""
+File type helpers.
+Shared MIME type categories used for filtering listings and building archives.
+"""
+
+from typing import Optional
+import mimetypes
+import os
+
+from django.conf import settings
+
+# MIME type prefixes for each file type filter
+FILE_TYPE_FILTERS = {
+    "document": [
+        "application/pdf",
+        "text/",
+        "application/msword",
+        "application/vnd.openxmlformats-officedocument",
+    ],
+    "image": ["image/"],
+    "video": ["video/"],
+    "audio": ["audio/"],
+    "archive": [
+        "application/zip",
+        "application/x-rar",
+        "application/x-7z",
+        "application/x-tar",
+        "application/x-gzip",
+    ],
+}
+
+
+def match_file_type(mime_type: str, file_type: str) -> bool:
+    """Check whether a MIME type belongs to a file type category."""
+    mime_type = mime_type.lower()
+    return any(mime_type.startswith(t) for t in FILE_TYPE_FILTERS.get(file_type, []))
+
+
+def get_file_category(mime_type: Optional[str]) -> Optional[str]:
+    """Return the file type category of a MIME type, if any."""
+    if not mime_type:
+        return None
+    for file_type in FILE_TYPE_FILTERS:
+        if match_file_type(mime_type, file_type):
+            return file_type
+    return None
+
+
+def guess_mime_type(filename: str) -> Optional[str]:
+    """Guess a MIME type from a file name using settings.MIME_TYPES first."""
+    extension = os.path.splitext(filename)[1].lstrip(".").lower()
+    if extension in settings.MIME_TYPES:
+        return settings.MIME_TYPES[extension]
+    return mimetypes.guess_type(filename)[0]
@@ -0,0 +1,375 @@
+"""
+Hedged requests.
+Sends a second copy of a slow idempotent API call and uses whichever copy
+answers first, trimming the latency tail of metadata requests.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, as_completed, wait
+from typing import Any, Awaitable, Callable, Deque, Dict, Optional, TypeVar
+import asyncio
+import logging
+import math
+import os
+import threading
+import time
+
+from django.conf import settings
+
+from .rate_limiter import AdaptiveRateLimiter, api_limiter
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Latency samples kept per endpoint
+SAMPLE_SIZE = 256
+
+# Samples needed before an endpoint is hedged
+MIN_SAMPLES = 20
+
+# Hedge tokens saved up at most, allowing short bursts of hedging
+BUDGET_BURST = 10.0
+
+
+class _Latencies:
+    """Recent latencies of one endpoint and the hedge delay derived from them."""
+
+    def __init__(self):
+        self.samples: Deque[float] = deque(maxlen=SAMPLE_SIZE)
+        self.delay: Optional[float] = None
+        self.pending = 0
+
+
+class HedgePolicy:
+    """
+    Hedging of idempotent calls with a delay and a budget.
+
+    A call that has not completed after the configured percentile of the
+    endpoint's recent latencies is sent a second time. Every call adds a
+    fraction of a token to the hedge budget and every hedge spends a whole
+    one, so hedges stay below that fraction of all calls.
+
+    Every copy of a call holds a slot and a token of the rate limiter, and
+    latencies are measured from when a copy gets through it, so queueing in
+    the limiter does not raise the hedge delay. Calls that had to wait for
+    the limiter are not hedged, and a hedge is only sent if the limiter has
+    a slot and a token free at once.
+
+    Calls that are not hedged run on the caller's thread. The copies of a
+    hedged call run on a pool with a worker per limiter slot, so no thread
+    is started per call and a copy never waits for a worker.
+    """
+
+    def __init__(
+        self,
+        limiter: Optional[AdaptiveRateLimiter] = None,
+        percentile: Optional[float] = None,
+        ratio: Optional[float] = None,
+        min_delay: Optional[float] = None,
+    ):
+        """
+        Initialize the policy.
+
+        Args:
+            limiter: Rate limiter every copy of a call goes through, if any
+            percentile: Latency percentile after which a call is hedged,
+                defaults to settings.YANDEX_DISK_HEDGE_PERCENTILE
+            ratio: Largest share of extra calls, defaults to
+                settings.YANDEX_DISK_HEDGE_RATIO
+            min_delay: Shortest hedge delay in seconds, defaults to
+                settings.YANDEX_DISK_HEDGE_MIN_DELAY
+        """
+        self.limiter = limiter
+        self.percentile = percentile or settings.YANDEX_DISK_HEDGE_PERCENTILE
+        self.ratio = settings.YANDEX_DISK_HEDGE_RATIO if ratio is None else ratio
+        self.min_delay = (
+            settings.YANDEX_DISK_HEDGE_MIN_DELAY if min_delay is None else min_delay
+        )
+        self._reset()
+
+    def _reset(self) -> None:
+        self._endpoints: Dict[str, _Latencies] = {}
+        self._budget = BUDGET_BURST
+        self._lock = threading.Lock()
+        self._executor: Optional[ThreadPoolExecutor] = None
+        self._stats = {
+            "calls": 0,
+            "hedged": 0,
+            "hedge_wins": 0,
+            "budget_exhausted": 0,
+            "limited": 0,
+        }
+
+    def call(
+        self,
+        endpoint: str,
+        fetch: Callable[[], T],
+        record: Optional[Callable[[T], None]] = None,
+    ) -> T:
+        """
+        Run ``fetch`` through the limiter, hedging it if it is slow.
+
+        Args:
+            endpoint: Name the latencies are tracked under
+            fetch: Idempotent callable; may run twice concurrently
+            record: Called with the result of every copy that completes,
+                e.g. to report the response to the limiter
+
+        Returns:
+            Result of the first copy that succeeds
+        """
+        waited = self.limiter.acquire() if self.limiter is not None else 0.0
+        delay = self._start(endpoint, waited)
+        if delay is None:
+            return self._run(endpoint, fetch, record)
+
+        primary = self._spawn(endpoint, fetch, record)
+        done, _ = wait([primary], timeout=delay)
+        if done or not self._reserve_hedge(self._try_acquire()):
+            return primary.result()
+
+        logger.debug(f"Hedging {endpoint} call after {delay:.3f}s")
+        hedge = self._spawn(endpoint, fetch, record)
+        return self._first_result(primary, hedge)
+
+    async def acall(
+        self,
+        endpoint: str,
+        fetch: Callable[[], Awaitable[T]],
+        record: Optional[Callable[[T], Awaitable[None]]] = None,
+    ) -> T:
+        """
+        Async variant of call; the slower copy is cancelled.
+
+        Args:
+            endpoint: Name the latencies are tracked under
+            fetch: Idempotent coroutine function; may run twice concurrently
+            record: Coroutine function called with the result of every copy
+                that completes
+
+        Returns:
+            Result of the first copy that succeeds
+        """
+        waited = await self.limiter.aacquire() if self.limiter is not None else 0.0
+        delay = self._start(endpoint, waited)
+        if delay is None:
+            try:
+                return await self._arun(endpoint, fetch, record)
+            finally:
+                self._release()
+
+        primary = self._atask(endpoint, fetch, record)
+        try:
+            done, _ = await asyncio.wait({primary}, timeout=delay)
+            if done or not self._reserve_hedge(await self._atry_acquire()):
+                return await primary
+        except asyncio.CancelledError:
+            primary.cancel()
+            raise
+
+        logger.debug(f"Hedging {endpoint} call after {delay:.3f}s")
+        hedge = self._atask(endpoint, fetch, record)
+        pending = {primary, hedge}
+        try:
+            while pending:
+                done, pending = await asyncio.wait(
+                    pending, return_when=asyncio.FIRST_COMPLETED
+                )
+                for task in done:
+                    if task.exception() is None:
+                        if task is hedge:
+                            self._count("hedge_wins")
+                        return task.result()
+            return primary.result()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Report hedging counters of the current process.
+
+        Returns:
+            Dict of call, hedge and win counts, calls not hedged because of
+            the limiter, the remaining budget and the current hedge delay
+            per endpoint
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            stats["budget"] = round(self._budget, 2)
+            stats["delays"] = {
+                name: None if latencies.delay is None else round(latencies.delay, 3)
+                for name, latencies in self._endpoints.items()
+            }
+        return stats
+
+    def _start(self, endpoint: str, waited: float) -> Optional[float]:
+        """
+        Count a call and earn its share of the budget.
+
+        Args:
+            endpoint: Name the latencies are tracked under
+            waited: Seconds the call waited for the limiter
+
+        Returns:
+            Seconds to wait before hedging, or None if the call is not hedged
+        """
+        with self._lock:
+            self._stats["calls"] += 1
+            self._budget = min(BUDGET_BURST, self._budget + self.ratio)
+            if not settings.YANDEX_DISK_HEDGE_REQUESTS or self.ratio <= 0:
+                return None
+            latencies = self._endpoints.get(endpoint)
+            if latencies is None or latencies.delay is None:
+                return None
+            if waited > 0:
+                self._stats["limited"] += 1
+                return None
+            return max(self.min_delay, latencies.delay)
+
+    def _try_acquire(self) -> bool:
+        return self.limiter is None or self.limiter.try_acquire()
+
+    async def _atry_acquire(self) -> bool:
+        return self.limiter is None or await self.limiter.atry_acquire()
+
+    def _reserve_hedge(self, acquired: bool) -> bool:
+        """
+        Take a hedge token from the budget once the limiter let the hedge in.
+
+        Args:
+            acquired: Whether the hedge got a limiter slot and token
+
+        Returns:
+            True if the hedge may be sent; otherwise any limiter slot taken
+            for it is released
+        """
+        with self._lock:
+            if not acquired:
+                self._stats["limited"] += 1
+                return False
+            if self._budget >= 1:
+                self._budget -= 1
+                self._stats["hedged"] += 1
+                return True
+            self._stats["budget_exhausted"] += 1
+        self._release()
+        return False
+
+    def _release(self) -> None:
+        if self.limiter is not None:
+            self.limiter.release()
+
+    def _spawn(
+        self,
+        endpoint: str,
+        fetch: Callable[[], T],
+        record: Optional[Callable[[T], None]],
+    ) -> Future:
+        """
+        Run a copy of a call that holds a limiter slot on the worker pool.
+
+        The pool has as many workers as the limiter has slots and a copy
+        keeps its slot until it is done, so copies do not queue for a
+        worker and a hedge starts when it is due.
+        """
+        with self._lock:
+            if self._executor is None:
+                workers = (
+                    self.limiter.max_concurrency
+                    if self.limiter is not None
+                    else settings.YANDEX_DISK_API_MAX_CONCURRENCY
+                )
+                self._executor = ThreadPoolExecutor(
+                    max_workers=workers, thread_name_prefix="yadisk-hedge"
+                )
+        return self._executor.submit(self._run, endpoint, fetch, record)
+
+    def _first_result(self, primary: Future, hedge: Future) -> Any:
+        """
+        Return the first successful result of two concurrent copies.
+
+        The slower copy cannot be interrupted and finishes unused. If both
+        fail, the primary's error is raised.
+        """
+        for future in as_completed([primary, hedge]):
+            if future.exception() is None:
+                if future is hedge:
+                    self._count("hedge_wins")
+                return future.result()
+        return primary.result()
+
+    def _run(
+        self,
+        endpoint: str,
+        fetch: Callable[[], T],
+        record: Optional[Callable[[T], None]],
+    ) -> T:
+        """Run a copy that holds a limiter slot, timing only ``fetch``."""
+        try:
+            started = time.monotonic()
+            result = fetch()
+            self._record(endpoint, time.monotonic() - started)
+            if record is not None:
+                record(result)
+        finally:
+            self._release()
+        return result
+
+    def _atask(
+        self,
+        endpoint: str,
+        fetch: Callable[[], Awaitable[T]],
+        record: Optional[Callable[[T], Awaitable[None]]],
+    ) -> asyncio.Future:
+        """
+        Run a copy that holds a limiter slot as a task.
+
+        The slot is released when the task ends, even if it is cancelled
+        before it starts.
+        """
+        task = asyncio.ensure_future(self._arun(endpoint, fetch, record))
+        task.add_done_callback(lambda _: self._release())
+        return task
+
+    async def _arun(
+        self,
+        endpoint: str,
+        fetch: Callable[[], Awaitable[T]],
+        record: Optional[Callable[[T], Awaitable[None]]],
+    ) -> T:
+        """Run a copy, timing only ``fetch``; the caller releases its slot."""
+        started = time.monotonic()
+        result = await fetch()
+        self._record(endpoint, time.monotonic() - started)
+        if record is not None:
+            await record(result)
+        return result
+
+    def _record(self, endpoint: str, latency: float) -> None:
+        """Add a latency sample, refreshing the hedge delay now and then."""
+        with self._lock:
+            latencies = self._endpoints.get(endpoint)
+            if latencies is None:
+                latencies = self._endpoints[endpoint] = _Latencies()
+            latencies.samples.append(latency)
+            latencies.pending += 1
+            if len(latencies.samples) >= MIN_SAMPLES and (
+                latencies.delay is None or latencies.pending >= MIN_SAMPLES
+            ):
+                ordered = sorted(latencies.samples)
+                rank = math.ceil(len(ordered) * self.percentile / 100) - 1
+                latencies.delay = ordered[max(0, min(rank, len(ordered) - 1))]
+                latencies.pending = 0
+
+    def _count(self, name: str) -> None:
+        with self._lock:
+            self._stats[name] += 1
+
+
+api_hedging = HedgePolicy(api_limiter)
+
+if hasattr(os, "register_at_fork"):
+    # Locks are not inherited by forked workers
+    os.register_at_fork(after_in_child=api_hedging._reset)
@@ -0,0 +1,219 @@
+"""
+Shared HTTP clients for Yandex.Disk traffic.
+One pooled requests session per worker process, and one httpx client per
+event loop for async views, with default timeouts and retries.
+"""
+
+from email.utils import parsedate_to_datetime
+from http.cookiejar import DefaultCookiePolicy
+from typing import Dict, Iterable, Optional, Tuple
+import asyncio
+import os
+import random
+import threading
+import time
+import weakref
+
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+import httpx
+import requests
+
+# Responses worth retrying for idempotent requests
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+# Throttling responses; API calls leave them to the rate limiter
+THROTTLE_STATUSES = (429, 503)
+API_RETRY_STATUSES = tuple(s for s in RETRY_STATUSES if s not in THROTTLE_STATUSES)
+
+# Retried statuses -> session
+_sessions: Dict[Tuple[int, ...], requests.Session] = {}
+_session_lock = threading.Lock()
+
+# Event loop -> httpx.AsyncClient
+_async_clients = weakref.WeakKeyDictionary()
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """HTTP adapter applying a default timeout to every request."""
+
+    def __init__(self, *args, timeout=None, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get("timeout") is None:
+            kwargs["timeout"] = self.timeout
+        return super().send(request, **kwargs)
+
+
+def create_http_session(
+    retry_statuses: Iterable[int] = RETRY_STATUSES,
+) -> requests.Session:
+    """
+    Build a session configured from settings.
+
+    Idempotent requests are retried on connection errors and on 429 and 5xx
+    responses with jittered exponential backoff, honouring ``Retry-After``.
+    Cookies are never stored, so the session can be shared between users.
+
+    Args:
+        retry_statuses: Response statuses retried by the session
+
+    Returns:
+        Configured requests.Session
+    """
+    retry = Retry(
+        total=settings.YANDEX_DISK_HTTP_RETRIES,
+        backoff_factor=settings.YANDEX_DISK_HTTP_BACKOFF,
+        backoff_jitter=settings.YANDEX_DISK_HTTP_BACKOFF,
+        status_forcelist=tuple(retry_statuses),
+        allowed_methods=frozenset({"GET", "HEAD", "OPTIONS"}),
+        respect_retry_after_header=True,
+        raise_on_status=False,
+    )
+    adapter = TimeoutHTTPAdapter(
+        pool_connections=settings.YANDEX_DISK_HTTP_POOL_CONNECTIONS,
+        pool_maxsize=settings.YANDEX_DISK_HTTP_POOL_MAXSIZE,
+        max_retries=retry,
+        timeout=(
+            settings.YANDEX_DISK_HTTP_CONNECT_TIMEOUT,
+            settings.YANDEX_DISK_HTTP_READ_TIMEOUT,
+        ),
+    )
+
+    session = requests.Session()
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    session.cookies.set_policy(DefaultCookiePolicy(allowed_domains=[]))
+    return session
+
+
+def get_http_session() -> requests.Session:
+    """
+    Return the session shared by all threads of this worker process.
+
+    Connection pools are thread-safe; callers must not change the session's
+    headers or other state and should pass per-call headers instead.
+    """
+    return _get_session(RETRY_STATUSES)
+
+
+def get_api_session() -> requests.Session:
+    """
+    Return the shared session for Yandex.Disk API calls.
+
+    Throttling responses are not retried by the session; API calls retry
+    them through the rate limiter, so every worker backs off together.
+    """
+    return _get_session(API_RETRY_STATUSES)
+
+
+def _get_session(retry_statuses: Tuple[int, ...]) -> requests.Session:
+    session = _sessions.get(retry_statuses)
+    if session is None:
+        with _session_lock:
+            session = _sessions.get(retry_statuses)
+            if session is None:
+                session = _sessions[retry_statuses] = create_http_session(
+                    retry_statuses
+                )
+    return session
+
+
+def get_async_http_client() -> httpx.AsyncClient:
+    """
+    Return the async client for the running event loop.
+
+    httpx clients are bound to the loop that created them, so each loop
+    (one per ASGI worker) gets its own connection pool.
+    """
+    loop = asyncio.get_running_loop()
+    client = _async_clients.get(loop)
+    if client is None:
+        client = httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=settings.YANDEX_DISK_ASYNC_MAX_CONNECTIONS,
+                max_keepalive_connections=settings.YANDEX_DISK_HTTP_POOL_MAXSIZE,
+            ),
+            timeout=httpx.Timeout(
+                settings.YANDEX_DISK_HTTP_READ_TIMEOUT,
+                connect=settings.YANDEX_DISK_HTTP_CONNECT_TIMEOUT,
+            ),
+            transport=httpx.AsyncHTTPTransport(
+                retries=settings.YANDEX_DISK_HTTP_RETRIES
+            ),
+            follow_redirects=True,
+        )
+        _async_clients[loop] = client
+    return client
+
+
+async def send_with_retries(
+    client: httpx.AsyncClient,
+    request: httpx.Request,
+    stream: bool = False,
+    retry_statuses: Iterable[int] = RETRY_STATUSES,
+) -> httpx.Response:
+    """
+    Send an idempotent request, retrying 429 and 5xx responses.
+
+    Uses the same retry count and jittered exponential backoff as the
+    sync session and honours ``Retry-After``.
+
+    Args:
+        client: Async client to send with
+        request: Request to send
+        stream: Leave the response body unread
+        retry_statuses: Response statuses to retry
+
+    Returns:
+        The last response received
+    """
+    retries = settings.YANDEX_DISK_HTTP_RETRIES
+    for attempt in range(retries + 1):
+        response = await client.send(request, stream=stream)
+        if response.status_code not in retry_statuses or attempt == retries:
+            return response
+
+        await response.aclose()
+        await asyncio.sleep(_retry_delay(response, attempt))
+    return response
+
+
+def _retry_delay(response: httpx.Response, attempt: int) -> float:
+    """Seconds to wait before retrying a response."""
+    retry_after = parse_retry_after(response.headers.get("Retry-After"))
+    if retry_after is not None:
+        return retry_after
+    backoff = settings.YANDEX_DISK_HTTP_BACKOFF
+    return backoff * (2**attempt) + random.uniform(0, backoff)
+
+
+def parse_retry_after(value: Optional[str]) -> Optional[float]:
+    """
+    Parse a ``Retry-After`` header given in seconds or as an HTTP date.
+
+    Returns:
+        Seconds to wait, or None if the header is missing or invalid
+    """
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+
+def _reset_after_fork() -> None:
+    """Drop the parent's clients so forked workers open their own sockets."""
+    global _session_lock
+    _sessions.clear()
+    _session_lock = threading.Lock()
+    _async_clients.clear()
+
+
+os.register_at_fork(after_in_child=_reset_after_fork)
@@ -0,0 +1,170 @@
+"""
+Binary cache format for folder listings.
+Versioned, optionally compressed encoding of CachedListing built from the
+listing's columns and index arrays instead of pickled objects.
+"""
+
+from array import array
+from typing import Any, Dict, List, Optional, Tuple
+import json
+import logging
+import struct
+import sys
+import zlib
+
+from django.conf import settings
+
+from .listing_columns import ARRAY_COLUMNS, STRING_COLUMNS, STRING_TABLES
+from .listing_columns import ListingColumns
+from .listing_index import ListingIndex
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"YDL"
+# Bump whenever the layout changes; entries of other versions are ignored
+FORMAT_VERSION = 2
+
+FLAG_ZLIB = 1
+
+_HEADER = struct.Struct("<3sBB")
+_LENGTH = struct.Struct("<I")
+
+
+def encode_listing(
+    resources: ListingColumns,
+    index: ListingIndex,
+    validators: Dict[str, Any],
+    fetched_at: float,
+) -> bytes:
+    """
+    Encode a cached listing.
+
+    The body is zlib-compressed when it exceeds
+    settings.YANDEX_DISK_LISTING_COMPRESS_THRESHOLD bytes, if set.
+
+    Args:
+        resources: Listing columns
+        index: Listing index
+        validators: Folder validators
+        fetched_at: Fetch timestamp
+
+    Returns:
+        Encoded listing
+    """
+    order_keys = list(index.orders)
+    meta = {
+        "count": len(resources),
+        "fetched_at": fetched_at,
+        "validators": validators,
+        "tables": {name: len(getattr(resources, name)) for name in STRING_TABLES},
+        "orders": order_keys,
+    }
+    blobs = [json.dumps(meta).encode("utf-8")]
+    for name in STRING_COLUMNS + STRING_TABLES:
+        blobs.append("\0".join(getattr(resources, name)).encode("utf-8"))
+    for name in ARRAY_COLUMNS:
+        blobs.append(_array_bytes(getattr(resources, name)))
+    for key in order_keys:
+        blobs.append(_array_bytes(index.orders[key]))
+
+    body = b"".join(_LENGTH.pack(len(blob)) + blob for blob in blobs)
+    flags = 0
+    threshold = settings.YANDEX_DISK_LISTING_COMPRESS_THRESHOLD
+    if threshold and len(body) > threshold:
+        body = zlib.compress(body, 1)
+        flags |= FLAG_ZLIB
+    return _HEADER.pack(MAGIC, FORMAT_VERSION, flags) + body
+
+
+def decode_listing(
+    data: Any,
+) -> Optional[Tuple[ListingColumns, ListingIndex, Dict[str, Any], float]]:
+    """
+    Decode a cached listing.
+
+    Args:
+        data: Value read from the cache
+
+    Returns:
+        Tuple of columns, index, validators and fetch timestamp, or None if
+        the value is not a listing of the current format version
+    """
+    if not isinstance(data, bytes) or len(data) < _HEADER.size:
+        return None
+    magic, version, flags = _HEADER.unpack_from(data)
+    if magic != MAGIC or version != FORMAT_VERSION:
+        return None
+
+    try:
+        body = memoryview(data)[_HEADER.size :]
+        if flags & FLAG_ZLIB:
+            body = memoryview(zlib.decompress(body))
+        blobs = _split_blobs(body)
+
+        meta = json.loads(bytes(blobs[0]))
+        count = meta["count"]
+        position = 1
+        columns: Dict[str, Any] = {}
+        for name in STRING_COLUMNS + STRING_TABLES:
+            size = meta["tables"][name] if name in STRING_TABLES else count
+            columns[name] = _split_strings(blobs[position], size)
+            position += 1
+        for name, typecode in ARRAY_COLUMNS.items():
+            columns[name] = _bytes_array(typecode, blobs[position])
+            position += 1
+        orders = {}
+        for field, file_type in meta["orders"]:
+            orders[(field, file_type)] = _bytes_array("I", blobs[position])
+            position += 1
+    except (zlib.error, ValueError, KeyError, IndexError, struct.error) as e:
+        logger.warning(f"Ignoring corrupt cached listing: {e}")
+        return None
+
+    resources = ListingColumns.from_columns(columns)
+    return (
+        resources,
+        ListingIndex(resources, orders),
+        meta["validators"],
+        meta["fetched_at"],
+    )
+
+
+def _split_blobs(body: memoryview) -> List[memoryview]:
+    """Split a body into its length-prefixed blobs."""
+    blobs = []
+    offset = 0
+    while offset < len(body):
+        (length,) = _LENGTH.unpack_from(body, offset)
+        offset += _LENGTH.size
+        if offset + length > len(body):
+            raise ValueError("Truncated cached listing")
+        blobs.append(body[offset : offset + length])
+        offset += length
+    return blobs
+
+
+def _split_strings(blob: memoryview, size: int) -> List[str]:
+    """Decode a NUL-separated string column of known length."""
+    if not size:
+        return []
+    values = str(blob, "utf-8").split("\0")
+    if len(values) != size:
+        raise ValueError("String column length mismatch")
+    return values
+
+
+def _array_bytes(values: array) -> bytes:
+    """Serialize an array in little-endian byte order."""
+    if sys.byteorder == "big":
+        values = array(values.typecode, values)
+        values.byteswap()
+    return values.tobytes()
+
+
+def _bytes_array(typecode: str, blob: memoryview) -> array:
+    """Deserialize a little-endian array."""
+    values = array(typecode)
+    values.frombytes(blob)
+    if sys.byteorder == "big":
+        values.byteswap()
+    return values
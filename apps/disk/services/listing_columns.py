@@ -0,0 +1,211 @@
+"""
+Column-oriented folder listings.
+Holds large listings in typed arrays instead of one object per file.
+"""
+
+from array import array
+from datetime import datetime, timedelta, timezone
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .disk_service import YandexDiskFile
+from .file_types import FILE_TYPE_FILTERS, get_file_category
+
+# Sortable fields
+SORT_FIELDS = ("name", "size", "modified")
+
+# Category code used for files outside FILE_TYPE_FILTERS
+NO_CATEGORY = 255
+
+# Per-row string columns
+STRING_COLUMNS = ("names", "paths")
+
+# Tables of distinct values referenced by code columns
+STRING_TABLES = ("types", "mime_types", "public_keys")
+
+# Stored time of a missing timestamp; sorts before every real one
+MISSING_TIMESTAMP = float("-inf")
+
+# Offset column values of timestamps without a UTC offset, and of missing
+# timestamps given as None or as an empty string
+NAIVE_OFFSET = -(2**31)
+MISSING_NONE = NAIVE_OFFSET + 1
+MISSING_EMPTY = NAIVE_OFFSET + 2
+
+# Typed array columns and their typecodes
+ARRAY_COLUMNS = {
+    "sizes": "q",
+    "created": "d",
+    "created_offsets": "i",
+    "modified": "d",
+    "modified_offsets": "i",
+    "type_codes": "B",
+    "mime_codes": "I",
+    "public_key_codes": "I",
+}
+
+
+class ListingColumns(Sequence):
+    """
+    Immutable listing stored column by column.
+
+    Sizes and timestamps live in typed arrays, timestamps as seconds since
+    the epoch next to the UTC offset they were given in; MIME types, item
+    types and public keys, which repeat across a listing, are stored once
+    and referenced by code. Indexing returns YandexDiskFile rows built on
+    demand, so the container can stand in for a list of files.
+    """
+
+    def __init__(self, files: Iterable[YandexDiskFile] = ()):
+        """
+        Build the columns from a listing.
+
+        Args:
+            files: Listing in display order
+        """
+        self.names: List[str] = []
+        self.paths: List[str] = []
+        self.sizes = array("q")
+        self.created = array("d")
+        self.created_offsets = array("i")
+        self.modified = array("d")
+        self.modified_offsets = array("i")
+        self.types: List[str] = []
+        self.type_codes = array("B")
+        self.mime_types: List[str] = []
+        self.mime_codes = array("I")
+        self.public_keys: List[str] = []
+        self.public_key_codes = array("I")
+
+        type_table: Dict[str, int] = {}
+        mime_table: Dict[str, int] = {}
+        key_table: Dict[str, int] = {}
+        for file in files:
+            self.names.append(file.name)
+            self.paths.append(file.path)
+            self.sizes.append(file.size or 0)
+            _append_timestamp(self.created, self.created_offsets, file.created)
+            _append_timestamp(self.modified, self.modified_offsets, file.modified)
+            self.type_codes.append(_intern(type_table, self.types, file.type))
+            self.mime_codes.append(_intern(mime_table, self.mime_types, file.mime_type))
+            self.public_key_codes.append(
+                _intern(key_table, self.public_keys, file.public_key)
+            )
+
+    @classmethod
+    def from_columns(cls, columns: Dict[str, Any]) -> "ListingColumns":
+        """
+        Restore a listing from its columns, as produced by listing_codec.
+
+        Args:
+            columns: Values for every STRING_COLUMNS, STRING_TABLES and
+                ARRAY_COLUMNS attribute
+        """
+        listing = cls.__new__(cls)
+        for name in STRING_COLUMNS + STRING_TABLES + tuple(ARRAY_COLUMNS):
+            setattr(listing, name, columns[name])
+        return listing
+
+    def __len__(self) -> int:
+        return len(self.names)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        return YandexDiskFile(
+            name=self.names[index],
+            path=self.paths[index],
+            type=self.types[self.type_codes[index]],
+            size=self.sizes[index],
+            created=_format_timestamp(self.created[index], self.created_offsets[index]),
+            modified=_format_timestamp(
+                self.modified[index], self.modified_offsets[index]
+            ),
+            mime_type=self.mime_types[self.mime_codes[index]],
+            public_key=self.public_keys[self.public_key_codes[index]],
+        )
+
+    def __iter__(self) -> Iterator[YandexDiskFile]:
+        for i in range(len(self)):
+            yield self[i]
+
+    def argsort(self, field: str) -> array:
+        """
+        Return row positions ordered by a field, ascending.
+
+        Ties keep listing order.
+
+        Args:
+            field: One of SORT_FIELDS
+        """
+        if field == "name":
+            keys = [name.lower() for name in self.names]
+        elif field == "size":
+            keys = self.sizes
+        elif field == "modified":
+            keys = self.modified
+        else:
+            raise ValueError(f"Unsupported sort field: {field}")
+        return array("I", sorted(range(len(self)), key=keys.__getitem__))
+
+    def category_codes(self) -> bytes:
+        """
+        Return the file type category of every row as one byte per row.
+
+        Codes are positions in FILE_TYPE_FILTERS, NO_CATEGORY for other
+        files. Categories are resolved once per distinct MIME type.
+        """
+        categories = list(FILE_TYPE_FILTERS)
+        by_mime = [
+            categories.index(category) if category else NO_CATEGORY
+            for category in map(get_file_category, self.mime_types)
+        ]
+        return bytes(by_mime[code] for code in self.mime_codes)
+
+
+def _intern(table: Dict[str, int], values: List[str], value: str) -> int:
+    """Return the code of a repeated value, adding it on first use."""
+    code = table.get(value)
+    if code is None:
+        code = table[value] = len(values)
+        values.append(value)
+    return code
+
+
+def _append_timestamp(times: array, offsets: array, value: Optional[str]) -> None:
+    """Append an API timestamp to a time column and its offset column."""
+    time, offset = _parse_timestamp(value)
+    times.append(time)
+    offsets.append(offset)
+
+
+def _parse_timestamp(value: Optional[str]) -> Tuple[float, int]:
+    """
+    Split an API timestamp into seconds since the epoch and UTC offset.
+
+    Returns:
+        Tuple of the time and the offset in seconds, NAIVE_OFFSET for
+        timestamps without one; missing timestamps give MISSING_TIMESTAMP
+        and MISSING_NONE or MISSING_EMPTY
+    """
+    if not value:
+        return MISSING_TIMESTAMP, MISSING_NONE if value is None else MISSING_EMPTY
+    parsed = datetime.fromisoformat(value)
+    offset = parsed.utcoffset()
+    if offset is None:
+        return parsed.replace(tzinfo=timezone.utc).timestamp(), NAIVE_OFFSET
+    return parsed.timestamp(), int(offset.total_seconds())
+
+
+def _format_timestamp(value: float, offset: int) -> Optional[str]:
+    """Convert a stored time and offset back to the original API timestamp."""
+    if offset == MISSING_NONE:
+        return None
+    if offset == MISSING_EMPTY:
+        return ""
+    if offset == NAIVE_OFFSET:
+        return (
+            datetime.fromtimestamp(value, timezone.utc).replace(tzinfo=None).isoformat()
+        )
+    return datetime.fromtimestamp(
+        value, timezone(timedelta(seconds=offset))
+    ).isoformat()
@@ -0,0 +1,126 @@
+"""
+Listing indexes.
+Precomputed sort orders and file type buckets for cached folder listings,
+so a page of a large listing is served without scanning it.
+"""
+
+from array import array
+from itertools import compress
+from typing import Dict, Optional, Sequence, Tuple
+
+from .disk_service import YandexDiskFile
+from .file_types import FILE_TYPE_FILTERS
+from .listing_columns import SORT_FIELDS, ListingColumns
+
+DEFAULT_SORT = "name"
+
+# Byte translation tables turning category codes into 0/1 masks
+_CATEGORY_MASKS = [
+    bytes(int(value == code) for value in range(256))
+    for code in range(len(FILE_TYPE_FILTERS))
+]
+
+
+def parse_sort(sort: Optional[str]) -> Tuple[str, bool]:
+    """
+    Parse a ``sort`` query parameter such as ``size`` or ``-modified``.
+
+    Returns:
+        Tuple of sort field and descending flag; unknown fields fall back
+        to DEFAULT_SORT
+    """
+    sort = sort or DEFAULT_SORT
+    descending = sort.startswith("-")
+    field = sort.lstrip("-")
+    if field not in SORT_FIELDS:
+        return DEFAULT_SORT, False
+    return field, descending
+
+
+class ListingIndex:
+    """
+    Sorted row orders of a listing, per sort field and file type.
+
+    Built once when a listing is cached. Each order is an array of row
+    positions, so selecting and sorting a page costs no more than reading
+    the rows on it.
+    """
+
+    def __init__(
+        self,
+        columns: ListingColumns,
+        orders: Optional[Dict[Tuple[str, str], array]] = None,
+    ):
+        """
+        Build the orders for a listing.
+
+        Sorting and bucketing run over the listing's typed columns with
+        C-level key lookups, byte translation and itertools.compress.
+
+        Args:
+            columns: Listing in cache order
+            orders: Previously built orders, reused instead of sorting again
+        """
+        if orders is not None:
+            self.orders = orders
+            return
+
+        categories = columns.category_codes()
+        self.orders: Dict[Tuple[str, str], array] = {}
+        for field in SORT_FIELDS:
+            order = columns.argsort(field)
+            self.orders[(field, "")] = order
+            ordered_categories = bytes(map(categories.__getitem__, order))
+            for file_type, mask in zip(FILE_TYPE_FILTERS, _CATEGORY_MASKS):
+                self.orders[(field, file_type)] = array(
+                    "I", compress(order, ordered_categories.translate(mask))
+                )
+
+    def select(
+        self,
+        files: Sequence[YandexDiskFile],
+        file_type: Optional[str] = None,
+        sort: Optional[str] = None,
+    ) -> "ListingSelection":
+        """
+        Select the rows of a listing matching a file type, in sort order.
+
+        Args:
+            files: Listing the index was built for
+            file_type: File type filter, all files if empty
+            sort: Sort field, prefixed with ``-`` for descending order
+
+        Returns:
+            Lazy sequence of matching files
+        """
+        field, descending = parse_sort(sort)
+        order = self.orders.get((field, file_type or ""), array("I"))
+        return ListingSelection(files, order, descending)
+
+
+class ListingSelection(Sequence):
+    """
+    Read-only view of selected listing rows.
+
+    Works with django.core.paginator.Paginator: only the rows of the
+    requested page are materialized.
+    """
+
+    def __init__(self, files: Sequence[YandexDiskFile], order: array, descending: bool):
+        self._files = files
+        self._order = order
+        self._descending = descending
+
+    def __len__(self) -> int:
+        return len(self._order)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("selection index out of range")
+        if self._descending:
+            index = len(self) - 1 - index
+        return self._files[self._order[index]]
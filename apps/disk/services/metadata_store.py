@@ -0,0 +1,195 @@
+"""
+Persistent folder metadata.
+Stores crawled listings in the database so they survive worker restarts.
+"""
+
+from datetime import datetime, timezone
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+import logging
+
+from django.db import transaction
+from django.db.models import Q
+
+from ..models import FileEntry, FolderSnapshot
+from .disk_service import YandexDiskFile, parse_timestamp
+from .file_types import get_file_category
+
+logger = logging.getLogger(__name__)
+
+# Fetch time of snapshots that must be refreshed on the next read
+EXPIRED = datetime.fromtimestamp(0, timezone.utc)
+
+# Rows written per INSERT statement
+BULK_BATCH_SIZE = 500
+
+# Validator marking a listing that misses part of the folder, e.g. after a
+# crawl with failed folders
+PARTIAL_LISTING = "partial"
+
+# FileEntry fields refreshed when an entry is seen again
+UPDATE_FIELDS = [
+    "parent_path",
+    "name",
+    "type",
+    "size",
+    "created",
+    "modified",
+    "mime_type",
+    "category",
+    "synced_at",
+]
+
+
+class MetadataStore:
+    """
+    Database tier for folder listings.
+
+    Listings are keyed by canonical public key, folder path and recursive
+    flag. Entries are shared between listings: a folder listing reads the
+    folder's direct children, a recursive one everything below it.
+    """
+
+    @staticmethod
+    def load_listing(
+        public_key: str, path: str = "", recursive: bool = False
+    ) -> Optional[Tuple[List[YandexDiskFile], Dict[str, Any], float]]:
+        """
+        Load a stored listing.
+
+        Args:
+            public_key: Canonical public key
+            path: Folder path inside the public resource
+            recursive: Whether the listing includes subfolders
+
+        Returns:
+            Tuple of files, validators and fetch timestamp, or None if the
+            folder has never been stored
+        """
+        path = path.strip("/")
+        snapshot = FolderSnapshot.objects.filter(
+            public_key=public_key, path=path, recursive=recursive
+        ).first()
+        if snapshot is None:
+            return None
+
+        entries = FileEntry.objects.filter(
+            MetadataStore._scope(public_key, path, recursive)
+        ).order_by(*(["path"] if recursive else ["name"]))
+
+        files = [
+            YandexDiskFile(
+                name=entry.name,
+                path=entry.path,
+                type=entry.type,
+                size=entry.size,
+                created=_format_timestamp(entry.created),
+                modified=_format_timestamp(entry.modified),
+                mime_type=entry.mime_type,
+                public_key=snapshot.public_url,
+            )
+            for entry in entries.iterator(chunk_size=2000)
+        ]
+        return files, snapshot.validators, snapshot.fetched_at.timestamp()
+
+    @staticmethod
+    def save_listing(
+        public_key: str,
+        public_url: str,
+        path: str,
+        recursive: bool,
+        files: Sequence[YandexDiskFile],
+        validators: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """
+        Store a listing, upserting its entries and removing vanished ones.
+
+        A partial listing, marked by the PARTIAL_LISTING validator, only
+        upserts its entries: entries it misses may still exist, so nothing
+        is removed and the snapshot is stored as already expired.
+
+        Args:
+            public_key: Canonical public key
+            public_url: URL or key the folder was listed with
+            path: Folder path inside the public resource
+            recursive: Whether the listing includes subfolders
+            files: Current listing
+            validators: Folder metadata at fetch time
+        """
+        path = path.strip("/")
+        validators = validators or {}
+        partial = bool(validators.get(PARTIAL_LISTING))
+        now = datetime.now(timezone.utc)
+        entries = [MetadataStore._to_entry(public_key, f, now) for f in files]
+        scope = MetadataStore._scope(public_key, path, recursive)
+
+        with transaction.atomic():
+            FileEntry.objects.bulk_create(
+                entries,
+                batch_size=BULK_BATCH_SIZE,
+                update_conflicts=True,
+                unique_fields=["public_key", "path"],
+                update_fields=UPDATE_FIELDS,
+            )
+            if partial:
+                item_count = FileEntry.objects.filter(scope).count()
+            else:
+                FileEntry.objects.filter(scope, synced_at__lt=now).delete()
+                item_count = len(entries)
+            FolderSnapshot.objects.update_or_create(
+                public_key=public_key,
+                path=path,
+                recursive=recursive,
+                defaults={
+                    "public_url": public_url,
+                    "validators": validators,
+                    "item_count": item_count,
+                    "fetched_at": EXPIRED if partial else now,
+                },
+            )
+        logger.debug(
+            f"Stored {len(entries)} {'partial ' if partial else ''}entries "
+            f"for {public_key}:/{path}"
+        )
+
+    @staticmethod
+    def touch_listing(
+        public_key: str,
+        path: str,
+        recursive: bool,
+        validators: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        """Mark a stored listing as revalidated without rewriting its entries."""
+        FolderSnapshot.objects.filter(
+            public_key=public_key, path=path.strip("/"), recursive=recursive
+        ).update(validators=validators or {}, fetched_at=datetime.now(timezone.utc))
+
+    @staticmethod
+    def _scope(public_key: str, path: str, recursive: bool) -> Q:
+        """Filter selecting the entries of a listing."""
+        if not recursive:
+            return Q(public_key=public_key, parent_path=path)
+        if not path:
+            return Q(public_key=public_key)
+        return Q(public_key=public_key, path__startswith=f"{path}/")
+
+    @staticmethod
+    def _to_entry(public_key: str, file: YandexDiskFile, now: datetime) -> FileEntry:
+        """Build a FileEntry row from a listed file."""
+        return FileEntry(
+            public_key=public_key,
+            path=file.path,
+            parent_path=file.path.rpartition("/")[0],
+            name=file.name,
+            type=file.type,
+            size=file.size or 0,
+            created=parse_timestamp(file.created),
+            modified=parse_timestamp(file.modified),
+            mime_type=file.mime_type,
+            category=get_file_category(file.mime_type) or "",
+            synced_at=now,
+        )
+
+
+def _format_timestamp(value: Optional[datetime]) -> Optional[str]:
+    """Format a stored timestamp the way the API does, keeping missing ones."""
+    return value.isoformat() if value is not None else None
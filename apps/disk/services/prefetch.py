@@ -0,0 +1,292 @@
+"""
+Prefetch pipeline for archive building.
+Downloads the next few files concurrently into bounded spool buffers while
+the archive writer consumes them in selection order.
+"""
+
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor
+from dataclasses import dataclass
+from tempfile import SpooledTemporaryFile
+from typing import (
+    IO,
+    Any,
+    AsyncIterable,
+    AsyncIterator,
+    Callable,
+    Deque,
+    Iterable,
+    Iterator,
+    Optional,
+    Tuple,
+)
+import asyncio
+import logging
+import os
+
+from django.conf import settings
+
+from .blob_cache import BlobCache, BlobWriter
+
+# Archive name, download URL and blob cache key of a file
+ArchiveEntry = Tuple[str, Optional[str], Optional[str]]
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class SpooledDownload:
+    """
+    A downloaded file held in memory or, above the spool threshold, on disk.
+
+    Attributes:
+        name: Archive name of the file
+        size: Number of bytes downloaded
+        spool: Buffer or cached blob with the file content, None if the
+            download failed
+        error: Exception raised by the download, if any
+    """
+
+    name: str
+    size: int = 0
+    spool: Optional[IO[bytes]] = None
+    error: Optional[Exception] = None
+
+    def iter_chunks(self, chunk_size: int = 64 * 1024) -> Iterator[bytes]:
+        """Read the spooled content back in chunks."""
+        self.spool.seek(0)
+        while True:
+            chunk = self.spool.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+
+    def read_sample(self, size: int = 64 * 1024) -> bytes:
+        """Return up to ``size`` leading bytes of the content."""
+        self.spool.seek(0)
+        return self.spool.read(size)
+
+    def close(self) -> None:
+        """Release the spool buffer and any temporary file behind it."""
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
+
+
+class _SpoolingPipeline:
+    """Limits and spool handling shared by the sync and async pipelines."""
+
+    def __init__(
+        self,
+        download: Callable[[str], Any],
+        window: Optional[int] = None,
+        spool_memory: Optional[int] = None,
+        blob_cache: Optional[BlobCache] = None,
+    ):
+        """
+        Initialize pipeline limits.
+
+        Args:
+            download: Callable returning the content chunks of a download URL,
+                as an iterable or, for the async pipeline, an async iterable
+            window: Number of files downloaded ahead of the writer, defaults
+                to settings.YANDEX_DISK_ARCHIVE_PREFETCH
+            spool_memory: Memory budget in bytes shared by all spool buffers,
+                defaults to settings.YANDEX_DISK_ARCHIVE_SPOOL_MEMORY; files
+                larger than their share spill to temporary files
+            blob_cache: Cache read instead of downloading files it holds and
+                filled with files downloaded in full
+        """
+        self.download = download
+        self.blob_cache = blob_cache
+        self.window = max(1, window or settings.YANDEX_DISK_ARCHIVE_PREFETCH)
+        budget = spool_memory or settings.YANDEX_DISK_ARCHIVE_SPOOL_MEMORY
+        # One extra share for the file the writer is currently reading
+        self.spool_threshold = budget // (self.window + 1)
+
+    def _open_cached(
+        self, name: str, blob_key: Optional[str]
+    ) -> Optional[SpooledDownload]:
+        """Return a download backed by a cached blob, if there is one."""
+        if self.blob_cache is None or not blob_key:
+            return None
+        blob = self.blob_cache.open(blob_key)
+        if blob is None:
+            return None
+        return SpooledDownload(
+            name=name, size=os.fstat(blob.fileno()).st_size, spool=blob
+        )
+
+    def _create_spool(
+        self, blob_key: Optional[str]
+    ) -> Tuple[IO[bytes], Optional[BlobWriter]]:
+        """
+        Create the buffer for a download.
+
+        Files that can be cached are downloaded straight into a blob, which
+        then serves as the spool; others go to a spooled temporary file.
+        """
+        writer = None
+        if self.blob_cache is not None and blob_key:
+            writer = self.blob_cache.create(blob_key)
+        if writer is not None:
+            return writer.file, writer
+        return SpooledTemporaryFile(max_size=self.spool_threshold), None
+
+    @staticmethod
+    def _commit_spool(writer: Optional[BlobWriter], size: int) -> None:
+        """Publish a completed download to the blob cache."""
+        if writer is not None:
+            writer.size = size
+            writer.commit()
+
+    @staticmethod
+    def _discard_spool(spool: IO[bytes], writer: Optional[BlobWriter]) -> None:
+        """Release the buffer of a failed download."""
+        if writer is not None:
+            writer.abort()
+        spool.close()
+
+
+class PrefetchPipeline(_SpoolingPipeline):
+    """Download files concurrently while yielding them in input order."""
+
+    download: Callable[[str], Iterable[bytes]]
+
+    def run(self, entries: Iterable[ArchiveEntry]) -> Iterator[SpooledDownload]:
+        """
+        Download entries ahead of the consumer.
+
+        Each yielded download is closed when the next one is requested, so
+        callers must finish reading it before advancing.
+
+        Args:
+            entries: Archive names, download URLs and blob keys, in output
+                order
+
+        Yields:
+            SpooledDownload objects in the same order as ``entries``
+        """
+        entries = iter(entries)
+        pending: Deque[Future] = deque()
+        executor = ThreadPoolExecutor(
+            max_workers=self.window, thread_name_prefix="yadisk-prefetch"
+        )
+
+        def fill() -> None:
+            while len(pending) < self.window:
+                try:
+                    entry = next(entries)
+                except StopIteration:
+                    return
+                pending.append(executor.submit(self._fetch, *entry))
+
+        try:
+            fill()
+            while pending:
+                item = pending.popleft().result()
+                fill()
+                try:
+                    yield item
+                finally:
+                    item.close()
+        finally:
+            for future in pending:
+                if not future.cancel():
+                    future.add_done_callback(lambda f: f.result().close())
+            executor.shutdown(wait=False)
+
+    def _fetch(
+        self, name: str, url: Optional[str], blob_key: Optional[str] = None
+    ) -> SpooledDownload:
+        """Download a single file into a spool buffer."""
+        item = self._open_cached(name, blob_key)
+        if item is not None:
+            return item
+
+        item = SpooledDownload(name=name)
+        spool, writer = self._create_spool(blob_key)
+        try:
+            if not url:
+                raise ValueError("Download URL could not be resolved")
+            for chunk in self.download(url):
+                spool.write(chunk)
+                item.size += len(chunk)
+            self._commit_spool(writer, item.size)
+            item.spool = spool
+        except Exception as e:
+            self._discard_spool(spool, writer)
+            item.error = e
+        return item
+
+
+class AsyncPrefetchPipeline(_SpoolingPipeline):
+    """Download files concurrently on the event loop for async views."""
+
+    download: Callable[[str], AsyncIterable[bytes]]
+
+    async def run(
+        self, entries: AsyncIterable[ArchiveEntry]
+    ) -> AsyncIterator[SpooledDownload]:
+        """
+        Download entries ahead of the consumer.
+
+        Entries are pulled only as the window has room, so they can be
+        resolved lazily while earlier files are downloaded.
+
+        Args:
+            entries: Archive names, download URLs and blob keys, in output
+                order
+
+        Yields:
+            SpooledDownload objects in the same order as ``entries``
+        """
+        entries = aiter(entries)
+        pending: Deque[asyncio.Task] = deque()
+
+        async def fill() -> None:
+            while len(pending) < self.window:
+                try:
+                    entry = await anext(entries)
+                except StopAsyncIteration:
+                    return
+                pending.append(asyncio.create_task(self._fetch(*entry)))
+
+        try:
+            await fill()
+            while pending:
+                item = await pending.popleft()
+                await fill()
+                try:
+                    yield item
+                finally:
+                    item.close()
+        finally:
+            for task in pending:
+                task.cancel()
+
+    async def _fetch(
+        self, name: str, url: Optional[str], blob_key: Optional[str] = None
+    ) -> SpooledDownload:
+        """Download a single file into a spool buffer."""
+        item = self._open_cached(name, blob_key)
+        if item is not None:
+            return item
+
+        item = SpooledDownload(name=name)
+        spool, writer = self._create_spool(blob_key)
+        try:
+            if not url:
+                raise ValueError("Download URL could not be resolved")
+            async for chunk in self.download(url):
+                spool.write(chunk)
+                item.size += len(chunk)
+            self._commit_spool(writer, item.size)
+            item.spool = spool
+        except asyncio.CancelledError:
+            self._discard_spool(spool, writer)
+            raise
+        except Exception as e:
+            self._discard_spool(spool, writer)
+            item.error = e
+        return item
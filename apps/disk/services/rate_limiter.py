@@ -0,0 +1,411 @@
+"""
+Adaptive rate limiting of Yandex.Disk API calls.
+Keeps all worker processes below a shared request rate and backs off
+together when the API starts throttling.
+"""
+
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, AsyncIterator, Dict, Iterator, Optional, Tuple
+import asyncio
+import logging
+import os
+import random
+import threading
+import time
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import cache
+
+from .http_client import THROTTLE_STATUSES
+
+logger = logging.getLogger(__name__)
+
+# Length of a token bucket window in seconds
+BUCKET_WINDOW = 1.0
+
+# Seconds each process reuses the shared rate and pause before reading
+# them again
+STATE_TTL = 0.5
+
+# Pause after a throttling response without Retry-After
+DEFAULT_PAUSE = 1.0
+
+# Seconds between checks of async callers waiting for a concurrency slot
+POLL_INTERVAL = 0.05
+
+
+class AdaptiveRateLimiter:
+    """
+    Token bucket and concurrency limit with additive increase and
+    multiplicative decrease (AIMD).
+
+    Tokens are counted per window in the shared cache, so every process
+    using the same cache backend draws from one bucket. A call is let
+    through while the calls of the current window plus the share of the
+    previous window's calls that still falls into the last BUCKET_WINDOW
+    seconds, assuming they were spread evenly, stay within the rate. This
+    keeps bursts at window edges from doubling the rate. The rate itself is shared as well: a throttling response halves it
+    at most once per window, and each second of successful calls grows it
+    by a fixed step. ``Retry-After`` pauses all processes until the given
+    time. Processes reuse the rate and pause they read for STATE_TTL
+    seconds, so taking a token usually costs one cache round trip.
+
+    The number of calls in flight is limited per process, halved on
+    throttling and grown by one slot per limit's worth of successful calls.
+    """
+
+    def __init__(
+        self,
+        name: str,
+        rate: Optional[float] = None,
+        min_rate: Optional[float] = None,
+        rate_step: Optional[float] = None,
+        max_concurrency: Optional[int] = None,
+    ):
+        """
+        Initialize the limiter.
+
+        Args:
+            name: Prefix of the shared cache keys
+            rate: Highest rate in calls per second, defaults to
+                settings.YANDEX_DISK_API_RATE
+            min_rate: Rate never decreased below, defaults to
+                settings.YANDEX_DISK_API_MIN_RATE
+            rate_step: Rate increase per second without throttling, defaults
+                to settings.YANDEX_DISK_API_RATE_STEP
+            max_concurrency: Highest number of calls in flight per process,
+                defaults to settings.YANDEX_DISK_API_MAX_CONCURRENCY
+        """
+        self.name = name
+        self.max_rate = rate or settings.YANDEX_DISK_API_RATE
+        self.min_rate = min(
+            min_rate or settings.YANDEX_DISK_API_MIN_RATE, self.max_rate
+        )
+        self.rate_step = rate_step or settings.YANDEX_DISK_API_RATE_STEP
+        self.max_concurrency = (
+            max_concurrency or settings.YANDEX_DISK_API_MAX_CONCURRENCY
+        )
+        self._reset()
+
+    def _reset(self) -> None:
+        self._concurrency = float(self.max_concurrency)
+        self._in_flight = 0
+        self._condition = threading.Condition()
+        self._stats_lock = threading.Lock()
+        self._state_lock = threading.Lock()
+        self._state: Tuple[float, float] = (self.max_rate, 0.0)
+        self._state_expires = 0.0
+        self._previous_window: Tuple[int, int] = (-1, 0)
+        self._stats = {
+            "requests": 0,
+            "throttled": 0,
+            "waits": 0,
+            "wait_seconds": 0.0,
+            "max_wait_seconds": 0.0,
+        }
+
+    @contextmanager
+    def limit(self) -> Iterator[float]:
+        """
+        Hold a concurrency slot and a token for the duration of a call.
+
+        Yields:
+            Seconds spent waiting, see acquire
+        """
+        waited = self.acquire()
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    @asynccontextmanager
+    async def alimit(self) -> AsyncIterator[float]:
+        """Async variant of limit."""
+        waited = await self.aacquire()
+        try:
+            yield waited
+        finally:
+            self.release()
+
+    def acquire(self) -> float:
+        """
+        Take a concurrency slot and a token, waiting until both are free.
+
+        Every acquire must be followed by a release.
+
+        Returns:
+            Seconds spent waiting, 0 if the slot and token were free at once
+        """
+        started = time.monotonic()
+        blocked = False
+        with self._condition:
+            while self._in_flight >= self.concurrency_limit:
+                blocked = True
+                self._condition.wait()
+            self._in_flight += 1
+        try:
+            delay = self._token_delay()
+            while delay > 0:
+                blocked = True
+                time.sleep(delay)
+                delay = self._token_delay()
+        except BaseException:
+            self.release()
+            raise
+        waited = time.monotonic() - started
+        self._record_wait(waited)
+        return waited if blocked else 0.0
+
+    async def aacquire(self) -> float:
+        """Async variant of acquire."""
+        started = time.monotonic()
+        blocked = False
+        while not self._try_enter():
+            blocked = True
+            await asyncio.sleep(POLL_INTERVAL)
+        try:
+            token_delay = sync_to_async(self._token_delay, thread_sensitive=False)
+            delay = await token_delay()
+            while delay > 0:
+                blocked = True
+                await asyncio.sleep(delay)
+                delay = await token_delay()
+        except BaseException:
+            self.release()
+            raise
+        waited = time.monotonic() - started
+        self._record_wait(waited)
+        return waited if blocked else 0.0
+
+    def try_acquire(self) -> bool:
+        """
+        Take a concurrency slot and a token only if both are free right now.
+
+        Returns:
+            True if they were taken and must be released after the call
+        """
+        if not self._try_enter():
+            return False
+        if self._token_delay() > 0:
+            self.release()
+            return False
+        return True
+
+    async def atry_acquire(self) -> bool:
+        """Async variant of try_acquire."""
+        if not self._try_enter():
+            return False
+        if await sync_to_async(self._token_delay, thread_sensitive=False)() > 0:
+            self.release()
+            return False
+        return True
+
+    def release(self) -> None:
+        """Give back the concurrency slot taken by acquire."""
+        with self._condition:
+            self._in_flight -= 1
+            self._condition.notify()
+
+    def record_response(self, status: int, retry_after: Optional[float] = None) -> None:
+        """
+        Adapt the limits to the outcome of a call.
+
+        Args:
+            status: HTTP status of the response
+            retry_after: Seconds from the response's ``Retry-After`` header
+        """
+        with self._stats_lock:
+            self._stats["requests"] += 1
+        if status in THROTTLE_STATUSES:
+            self._on_throttled(status, retry_after)
+        elif status < 500:
+            self._on_success()
+
+    @property
+    def concurrency_limit(self) -> int:
+        return max(1, int(self._concurrency))
+
+    def get_stats(self) -> Dict[str, Any]:
+        """
+        Report the limiter state.
+
+        Rate and pause are shared by all processes; the other values belong
+        to the process serving the request.
+
+        Returns:
+            Dict of limits, calls in flight and wait counters
+        """
+        rate, paused_until = self._shared_state(refresh=True)
+        with self._stats_lock:
+            stats = dict(self._stats)
+        stats.update(
+            {
+                "rate": rate,
+                "max_rate": self.max_rate,
+                "concurrency_limit": self.concurrency_limit,
+                "max_concurrency": self.max_concurrency,
+                "in_flight": self._in_flight,
+                "paused_for": round(max(0.0, paused_until - time.time()), 3),
+            }
+        )
+        stats["wait_seconds"] = round(stats["wait_seconds"], 3)
+        stats["max_wait_seconds"] = round(stats["max_wait_seconds"], 3)
+        return stats
+
+    def _try_enter(self) -> bool:
+        with self._condition:
+            if self._in_flight >= self.concurrency_limit:
+                return False
+            self._in_flight += 1
+            return True
+
+    def _token_delay(self) -> float:
+        """
+        Take a token from the shared bucket.
+
+        Returns:
+            0 if a token was taken, otherwise seconds to wait before trying
+            again
+        """
+        now = time.time()
+        rate, paused_until = self._shared_state()
+        if paused_until > now:
+            return paused_until - now + random.uniform(0, BUCKET_WINDOW)
+
+        slot = int(now // BUCKET_WINDOW)
+        key = self._key(f"tokens:{slot}")
+        try:
+            taken = cache.incr(key)
+        except ValueError:
+            # First token of the window
+            if cache.add(key, 1, timeout=int(BUCKET_WINDOW * 3) + 1):
+                taken = 1
+            else:
+                taken = cache.incr(key)
+
+        # Calls of the previous window still within the last BUCKET_WINDOW
+        elapsed = now / BUCKET_WINDOW - slot
+        previous_count = self._previous_count(slot)
+        previous = previous_count * (1 - elapsed)
+        capacity = max(1, int(rate * BUCKET_WINDOW))
+        if taken + previous <= capacity:
+            return 0.0
+
+        # Give the token back so refused attempts do not count as calls
+        try:
+            cache.decr(key)
+        except ValueError:
+            pass
+        until_next_window = (slot + 1) * BUCKET_WINDOW - now
+        if taken > capacity or not previous_count:
+            # Spread the callers over the next window instead of waking
+            # them at once
+            return until_next_window + random.uniform(0, BUCKET_WINDOW)
+        # The previous window's share drops by one call every
+        # BUCKET_WINDOW / previous_count seconds
+        needed = min(
+            (taken + previous - capacity) * BUCKET_WINDOW / previous_count,
+            until_next_window,
+        )
+        return needed + random.uniform(0, needed)
+
+    def _previous_count(self, slot: int) -> int:
+        """Return the calls of the window before ``slot``, read once per window."""
+        with self._state_lock:
+            cached_slot, count = self._previous_window
+        if cached_slot == slot:
+            return count
+        count = cache.get(self._key(f"tokens:{slot - 1}")) or 0
+        with self._state_lock:
+            self._previous_window = (slot, count)
+        return count
+
+    def _shared_state(self, refresh: bool = False) -> Tuple[float, float]:
+        """
+        Return the shared rate and the time the API is paused until.
+
+        Args:
+            refresh: Read them from the shared cache even if the local copy
+                is still valid
+
+        Returns:
+            Tuple of the rate in calls per second and the pause end as a
+            Unix timestamp, 0 if not paused
+        """
+        now = time.monotonic()
+        with self._state_lock:
+            if not refresh and now < self._state_expires:
+                return self._state
+        values = cache.get_many([self._key("rate"), self._key("pause")])
+        rate = values.get(self._key("rate"))
+        state = (
+            self.max_rate if rate is None else min(rate, self.max_rate),
+            values.get(self._key("pause")) or 0.0,
+        )
+        self._set_state(*state)
+        return state
+
+    def _set_state(self, rate: float, paused_until: float) -> None:
+        """Update the local copy of the shared rate and pause."""
+        with self._state_lock:
+            self._state = (rate, paused_until)
+            self._state_expires = time.monotonic() + STATE_TTL
+
+    def _on_throttled(self, status: int, retry_after: Optional[float]) -> None:
+        pause = retry_after if retry_after is not None else DEFAULT_PAUSE
+        with self._stats_lock:
+            self._stats["throttled"] += 1
+        with self._condition:
+            self._concurrency = max(1.0, self._concurrency / 2)
+
+        rate, shared_pause = self._shared_state(refresh=True)
+        paused_until = max(time.time() + pause, shared_pause)
+        if paused_until > shared_pause:
+            cache.set(self._key("pause"), paused_until, timeout=int(pause) + 1)
+
+        slot = int(time.time() // BUCKET_WINDOW)
+        if cache.add(self._key(f"decrease:{slot}"), True, timeout=2):
+            rate = max(self.min_rate, rate / 2)
+            cache.set(self._key("rate"), rate, timeout=None)
+            logger.warning(
+                f"Yandex.Disk API throttled ({status}), rate lowered to "
+                f"{rate:.1f}/s, pausing {pause:.1f}s"
+            )
+        self._set_state(rate, paused_until)
+
+    def _on_success(self) -> None:
+        with self._condition:
+            if self._concurrency < self.max_concurrency:
+                self._concurrency = min(
+                    float(self.max_concurrency),
+                    self._concurrency + 1 / self.concurrency_limit,
+                )
+
+        rate, paused_until = self._shared_state()
+        if rate < self.max_rate and cache.add(
+            self._key(f"increase:{int(time.time())}"), True, timeout=2
+        ):
+            rate, paused_until = self._shared_state(refresh=True)
+            rate = min(self.max_rate, rate + self.rate_step)
+            cache.set(self._key("rate"), rate, timeout=None)
+            self._set_state(rate, paused_until)
+
+    def _record_wait(self, waited: float) -> None:
+        with self._stats_lock:
+            if waited >= POLL_INTERVAL:
+                self._stats["waits"] += 1
+            self._stats["wait_seconds"] += waited
+            self._stats["max_wait_seconds"] = max(
+                self._stats["max_wait_seconds"], waited
+            )
+
+    def _key(self, suffix: str) -> str:
+        return f"rate_limit:{self.name}:{suffix}"
+
+
+api_limiter = AdaptiveRateLimiter("yandex_api")
+
+if hasattr(os, "register_at_fork"):
+    # Locks and in-flight counts are not inherited by forked workers
+    os.register_at_fork(after_in_child=api_limiter._reset)
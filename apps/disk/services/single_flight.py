@@ -0,0 +1,191 @@
+"""
+Request coalescing.
+Lets concurrent identical upstream fetches share one call, within a process
+and, through a cache lock, across processes sharing the cache backend.
+"""
+
+from concurrent.futures import Future
+from typing import Awaitable, Callable, Dict, Optional, Tuple, TypeVar
+import asyncio
+import hashlib
+import logging
+import threading
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+# Seconds between checks while another process holds the fetch lock
+POLL_INTERVAL = 0.1
+
+
+class SingleFlight:
+    """
+    One in-flight call per key.
+
+    The first caller for a key becomes the leader and runs the fetch; other
+    callers in the process wait for its result. The leader also takes a
+    lock in the shared cache, so callers in other processes wait for the
+    result to show up in the cache instead of fetching it again. If it does
+    not show up in time, they fetch it themselves.
+    """
+
+    def __init__(self, name: str, timeout: Optional[float] = None):
+        """
+        Initialize the group.
+
+        Args:
+            name: Prefix of the cache lock keys
+            timeout: Seconds to wait for another process, and lifetime of
+                the cache lock; defaults to settings.YANDEX_DISK_SINGLE_FLIGHT_TIMEOUT
+        """
+        self.name = name
+        self.timeout = timeout or settings.YANDEX_DISK_SINGLE_FLIGHT_TIMEOUT
+        self.coalesced = 0
+        self._calls: Dict[str, Future] = {}
+        self._lock = threading.Lock()
+
+    def do(
+        self,
+        key: str,
+        fetch: Callable[[], T],
+        check: Optional[Callable[[], Optional[T]]] = None,
+    ) -> T:
+        """
+        Run ``fetch`` unless an identical call is already in flight.
+
+        Args:
+            key: Identity of the call
+            fetch: Callable performing the upstream fetch
+            check: Callable returning the cached result, or None; polled
+                while another process fetches
+
+        Returns:
+            Result of this or the concurrent call
+        """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return future.result()
+
+        try:
+            result = self._fetch_once(key, fetch, check)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+
+    async def ado(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[T]],
+        check: Optional[Callable[[], Awaitable[Optional[T]]]] = None,
+    ) -> T:
+        """
+        Async variant of do; shares in-flight calls with it.
+
+        Args:
+            key: Identity of the call
+            fetch: Coroutine function performing the upstream fetch
+            check: Coroutine function returning the cached result, or None
+
+        Returns:
+            Result of this or the concurrent call
+        """
+        future, is_leader = self._join(key)
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+
+        try:
+            result = await self._afetch_once(key, fetch, check)
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            raise
+        finally:
+            self._leave(key)
+
+    def _join(self, key: str) -> Tuple[Future, bool]:
+        """Return the call in flight for a key, starting one if there is none."""
+        with self._lock:
+            future = self._calls.get(key)
+            if future is not None:
+                self.coalesced += 1
+                return future, False
+            future = self._calls[key] = Future()
+            return future, True
+
+    def _count_coalesced(self) -> None:
+        with self._lock:
+            self.coalesced += 1
+
+    def _leave(self, key: str) -> None:
+        with self._lock:
+            self._calls.pop(key, None)
+
+    def _lock_key(self, key: str) -> str:
+        digest = hashlib.sha256(key.encode("utf-8")).hexdigest()[:32]
+        return f"single_flight:{self.name}:{digest}"
+
+    def _fetch_once(
+        self,
+        key: str,
+        fetch: Callable[[], T],
+        check: Optional[Callable[[], Optional[T]]],
+    ) -> T:
+        """Fetch under the cache lock, or wait for the process holding it."""
+        lock_key = self._lock_key(key)
+        if cache.add(lock_key, True, timeout=self.timeout):
+            try:
+                return fetch()
+            finally:
+                cache.delete(lock_key)
+
+        if check is not None:
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                time.sleep(POLL_INTERVAL)
+                released = cache.get(lock_key) is None
+                result = check()
+                if result is not None:
+                    self._count_coalesced()
+                    return result
+                if released:
+                    break
+            logger.debug(f"No result from the process fetching {key}, fetching")
+        return fetch()
+
+    async def _afetch_once(
+        self,
+        key: str,
+        fetch: Callable[[], Awaitable[T]],
+        check: Optional[Callable[[], Awaitable[Optional[T]]]],
+    ) -> T:
+        """Async variant of _fetch_once."""
+        lock_key = self._lock_key(key)
+        if await cache.aadd(lock_key, True, timeout=self.timeout):
+            try:
+                return await fetch()
+            finally:
+                await cache.adelete(lock_key)
+
+        if check is not None:
+            deadline = time.monotonic() + self.timeout
+            while time.monotonic() < deadline:
+                await asyncio.sleep(POLL_INTERVAL)
+                released = await cache.aget(lock_key) is None
+                result = await check()
+                if result is not None:
+                    self._count_coalesced()
+                    return result
+                if released:
+                    break
+            logger.debug(f"No result from the process fetching {key}, fetching")
+        return await fetch()
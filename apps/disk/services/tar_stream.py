@@ -0,0 +1,115 @@
+"""
+Streaming TAR writer.
+Produces tar or tar.gz archives chunk by chunk from entries of known size.
+"""
+
+from typing import Optional
+import tarfile
+import time
+import zlib
+
+BLOCK_SIZE = tarfile.BLOCKSIZE
+RECORD_SIZE = tarfile.RECORDSIZE
+
+
+class TarStreamWriter:
+    """
+    Incremental PAX tar writer for non-seekable output.
+
+    Mirrors ZipStreamWriter: every method returns the bytes to append to
+    the output. Entry sizes must be known when the entry is started.
+    """
+
+    def __init__(self, gzip: bool = False, compresslevel: int = 6):
+        """
+        Initialize writer state.
+
+        Args:
+            gzip: Compress the whole stream as tar.gz
+            compresslevel: zlib level used when ``gzip`` is set
+        """
+        self._compressor = (
+            zlib.compressobj(compresslevel, zlib.DEFLATED, 31) if gzip else None
+        )
+        self._tar_offset = 0
+        self._offset = 0
+        self._remaining: Optional[int] = None
+
+    @property
+    def bytes_written(self) -> int:
+        """Total number of archive bytes produced so far."""
+        return self._offset
+
+    def start_entry(self, name: str, size: int, mtime: Optional[float] = None) -> bytes:
+        """
+        Begin a new archive entry.
+
+        Args:
+            name: Path of the entry inside the archive
+            size: Exact content size in bytes
+            mtime: Modification time, defaults to now
+
+        Returns:
+            Header bytes
+        """
+        if self._remaining is not None:
+            raise RuntimeError("Previous entry has not been ended")
+
+        info = tarfile.TarInfo(name)
+        info.size = size
+        info.mtime = int(time.time() if mtime is None else mtime)
+        info.mode = 0o644
+        self._remaining = size
+        return self._emit(info.tobuf(format=tarfile.PAX_FORMAT, encoding="utf-8"))
+
+    def write(self, data: bytes) -> bytes:
+        """
+        Add content to the current entry.
+
+        Returns:
+            Bytes ready to be sent, possibly empty
+        """
+        if self._remaining is None:
+            raise RuntimeError("No entry has been started")
+        if len(data) > self._remaining:
+            raise ValueError("Entry content exceeds its declared size")
+        self._remaining -= len(data)
+        return self._emit(data)
+
+    def end_entry(self) -> bytes:
+        """
+        Finish the current entry.
+
+        Returns:
+            Block padding bytes
+        """
+        if self._remaining:
+            raise ValueError("Entry content is shorter than its declared size")
+        self._remaining = None
+        padding = -self._tar_offset % BLOCK_SIZE
+        return self._emit(b"\0" * padding)
+
+    def close(self) -> bytes:
+        """
+        Finish the archive.
+
+        Returns:
+            End-of-archive blocks and, for tar.gz, the gzip trailer
+        """
+        if self._remaining is not None:
+            raise RuntimeError("Current entry has not been ended")
+        end = b"\0" * (2 * BLOCK_SIZE)
+        end += b"\0" * (-(self._tar_offset + len(end)) % RECORD_SIZE)
+        data = self._emit(end)
+        if self._compressor:
+            tail = self._compressor.flush()
+            self._offset += len(tail)
+            data += tail
+        return data
+
+    def _emit(self, data: bytes) -> bytes:
+        self._tar_offset += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        self._offset += len(data)
+        return data
@@ -0,0 +1,361 @@
+"""
+Streaming ZIP writer.
+Produces ZIP archives chunk by chunk without seeking or buffering whole files,
+using data descriptors for entry sizes and ZIP64 records for large archives.
+"""
+
+from dataclasses import dataclass
+from typing import Iterable, Iterator, List, Optional, Tuple
+import struct
+import time
+import zipfile
+import zlib
+
+ZIP32_LIMIT = 0xFFFFFFFF
+ZIP32_COUNT_LIMIT = 0xFFFF
+
+LOCAL_HEADER = struct.Struct("<IHHHHHIIIHH")
+DATA_DESCRIPTOR = struct.Struct("<IIII")
+DATA_DESCRIPTOR64 = struct.Struct("<IIQQ")
+CENTRAL_HEADER = struct.Struct("<IHHHHHHIIIHHHHHII")
+END_RECORD = struct.Struct("<IHHHHIIH")
+END_RECORD64 = struct.Struct("<IQHHIIQQQQ")
+END_LOCATOR64 = struct.Struct("<IIQI")
+
+FLAG_DATA_DESCRIPTOR = 0x08
+FLAG_UTF8 = 0x800
+VERSION_DEFAULT = 20
+VERSION_ZIP64 = 45
+CREATE_SYSTEM_UNIX = 3
+FILE_ATTRIBUTES = 0o100644 << 16
+
+
+@dataclass
+class _Entry:
+    """Bookkeeping for an entry written to the archive."""
+
+    name: bytes
+    compress_type: int
+    dos_time: int
+    dos_date: int
+    offset: int
+    zip64: bool
+    crc: int = 0
+    compress_size: int = 0
+    file_size: int = 0
+
+
+def _max_output_size(size: int) -> int:
+    """Upper bound of the compressed size of ``size`` bytes (zlib compressBound)."""
+    return size + (size >> 12) + (size >> 14) + (size >> 25) + 13
+
+
+def _dos_datetime(date_time: Optional[Tuple[int, ...]]) -> Tuple[int, int]:
+    """Convert a date-time tuple to MS-DOS time and date fields."""
+    if date_time is None:
+        date_time = time.localtime()[:6]
+    year, month, day, hour, minute, second = date_time[:6]
+    if year < 1980:
+        year, month, day, hour, minute, second = 1980, 1, 1, 0, 0, 0
+    dos_date = (year - 1980) << 9 | month << 5 | day
+    dos_time = hour << 11 | minute << 5 | second // 2
+    return dos_time, dos_date
+
+
+class ZipStreamWriter:
+    """
+    Incremental ZIP writer for non-seekable output.
+
+    Every method returns the bytes to append to the output; nothing is
+    buffered beyond what the compressor holds internally.
+
+    Example:
+        writer = ZipStreamWriter()
+        out.write(writer.start_entry("a.txt"))
+        out.write(writer.write(b"data"))
+        out.write(writer.end_entry())
+        out.write(writer.close())
+    """
+
+    def __init__(self, compresslevel: int = 6):
+        """
+        Initialize writer state.
+
+        Args:
+            compresslevel: zlib level used for DEFLATE entries
+        """
+        self.compresslevel = compresslevel
+        self._offset = 0
+        self._entries: List[_Entry] = []
+        self._current: Optional[_Entry] = None
+        self._compressor = None
+
+    @property
+    def bytes_written(self) -> int:
+        """Total number of archive bytes produced so far."""
+        return self._offset
+
+    def start_entry(
+        self,
+        name: str,
+        compress_type: int = zipfile.ZIP_DEFLATED,
+        date_time: Optional[Tuple[int, ...]] = None,
+        size: Optional[int] = None,
+    ) -> bytes:
+        """
+        Begin a new archive entry.
+
+        Args:
+            name: Path of the entry inside the archive
+            compress_type: zipfile.ZIP_STORED or zipfile.ZIP_DEFLATED
+            date_time: Modification time tuple, defaults to now
+            size: Uncompressed size if known; ZIP64 fields are used when it is
+                unknown or too large for the classic format
+
+        Returns:
+            Local file header bytes
+        """
+        if self._current is not None:
+            raise RuntimeError("Previous entry has not been ended")
+        if compress_type not in (zipfile.ZIP_STORED, zipfile.ZIP_DEFLATED):
+            raise ValueError(f"Unsupported compression method: {compress_type}")
+
+        encoded_name = name.encode("utf-8")
+        dos_time, dos_date = _dos_datetime(date_time)
+        zip64 = size is None or _max_output_size(size) >= ZIP32_LIMIT
+
+        self._current = _Entry(
+            name=encoded_name,
+            compress_type=compress_type,
+            dos_time=dos_time,
+            dos_date=dos_date,
+            offset=self._offset,
+            zip64=zip64,
+        )
+        self._compressor = (
+            zlib.compressobj(self.compresslevel, zlib.DEFLATED, -15)
+            if compress_type == zipfile.ZIP_DEFLATED
+            else None
+        )
+
+        extra = b""
+        sizes = 0
+        if zip64:
+            extra = struct.pack("<HHQQ", 0x0001, 16, 0, 0)
+            sizes = ZIP32_LIMIT
+
+        header = LOCAL_HEADER.pack(
+            0x04034B50,
+            VERSION_ZIP64 if zip64 else VERSION_DEFAULT,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+            compress_type,
+            dos_time,
+            dos_date,
+            0,
+            sizes,
+            sizes,
+            len(encoded_name),
+            len(extra),
+        )
+        return self._emit(header + encoded_name + extra)
+
+    def write(self, data: bytes) -> bytes:
+        """
+        Add uncompressed data to the current entry.
+
+        Returns:
+            Compressed bytes ready to be sent, possibly empty
+        """
+        entry = self._require_entry()
+        entry.crc = zlib.crc32(data, entry.crc)
+        entry.file_size += len(data)
+        if self._compressor:
+            data = self._compressor.compress(data)
+        return self._emit_data(data)
+
+    def write_deflated(self, data: bytes, deflated: bytes) -> bytes:
+        """
+        Add content to the current DEFLATE entry that was compressed elsewhere.
+
+        ``deflated`` must be a raw deflate fragment ending on a sync flush
+        (see compression.deflate_block). The writer's own compressor sees no
+        input, so end_entry() still appends the final empty block that
+        terminates the stream. Do not mix with write() in the same entry.
+
+        Args:
+            data: Uncompressed content, used for the CRC and size
+            deflated: Compressed form of ``data``
+
+        Returns:
+            The compressed bytes, ready to be sent
+        """
+        entry = self._require_entry()
+        if entry.compress_type != zipfile.ZIP_DEFLATED:
+            raise ValueError("Entry is not compressed with DEFLATE")
+        entry.crc = zlib.crc32(data, entry.crc)
+        entry.file_size += len(data)
+        return self._emit_data(deflated)
+
+    def end_entry(self) -> bytes:
+        """
+        Finish the current entry.
+
+        Returns:
+            Remaining compressed bytes followed by the data descriptor
+        """
+        entry = self._require_entry()
+        tail = b""
+        if self._compressor:
+            tail = self._emit_data(self._compressor.flush())
+
+        if not entry.zip64 and max(entry.file_size, entry.compress_size) >= ZIP32_LIMIT:
+            raise ValueError(f"Entry {entry.name!r} exceeded its declared size")
+
+        if entry.zip64:
+            descriptor = DATA_DESCRIPTOR64.pack(
+                0x08074B50, entry.crc, entry.compress_size, entry.file_size
+            )
+        else:
+            descriptor = DATA_DESCRIPTOR.pack(
+                0x08074B50, entry.crc, entry.compress_size, entry.file_size
+            )
+
+        self._entries.append(entry)
+        self._current = None
+        self._compressor = None
+        return tail + self._emit(descriptor)
+
+    def close(self) -> bytes:
+        """
+        Finish the archive.
+
+        Returns:
+            Central directory and end of central directory records
+        """
+        if self._current is not None:
+            raise RuntimeError("Current entry has not been ended")
+
+        directory_offset = self._offset
+        records = [self._central_record(entry) for entry in self._entries]
+        directory = b"".join(records)
+        directory_size = len(directory)
+        count = len(self._entries)
+
+        end = b""
+        if (
+            count >= ZIP32_COUNT_LIMIT
+            or directory_offset >= ZIP32_LIMIT
+            or directory_size >= ZIP32_LIMIT
+        ):
+            end64_offset = directory_offset + directory_size
+            end += END_RECORD64.pack(
+                0x06064B50,
+                END_RECORD64.size - 12,
+                VERSION_ZIP64,
+                VERSION_ZIP64,
+                0,
+                0,
+                count,
+                count,
+                directory_size,
+                directory_offset,
+            )
+            end += END_LOCATOR64.pack(0x07064B50, 0, end64_offset, 1)
+
+        end += END_RECORD.pack(
+            0x06054B50,
+            0,
+            0,
+            min(count, ZIP32_COUNT_LIMIT),
+            min(count, ZIP32_COUNT_LIMIT),
+            min(directory_size, ZIP32_LIMIT),
+            min(directory_offset, ZIP32_LIMIT),
+            0,
+        )
+        return self._emit(directory + end)
+
+    def _central_record(self, entry: _Entry) -> bytes:
+        """Build the central directory record for an entry."""
+        extra_fields = []
+        file_size = entry.file_size
+        compress_size = entry.compress_size
+        offset = entry.offset
+
+        if file_size >= ZIP32_LIMIT:
+            extra_fields.append(file_size)
+            file_size = ZIP32_LIMIT
+        if compress_size >= ZIP32_LIMIT:
+            extra_fields.append(compress_size)
+            compress_size = ZIP32_LIMIT
+        if offset >= ZIP32_LIMIT:
+            extra_fields.append(offset)
+            offset = ZIP32_LIMIT
+
+        extra = b""
+        if extra_fields:
+            extra = struct.pack(
+                f"<HH{len(extra_fields)}Q",
+                0x0001,
+                8 * len(extra_fields),
+                *extra_fields,
+            )
+
+        version = VERSION_ZIP64 if entry.zip64 or extra else VERSION_DEFAULT
+        header = CENTRAL_HEADER.pack(
+            0x02014B50,
+            CREATE_SYSTEM_UNIX << 8 | version,
+            version,
+            FLAG_DATA_DESCRIPTOR | FLAG_UTF8,
+            entry.compress_type,
+            entry.dos_time,
+            entry.dos_date,
+            entry.crc,
+            compress_size,
+            file_size,
+            len(entry.name),
+            len(extra),
+            0,
+            0,
+            0,
+            FILE_ATTRIBUTES,
+            offset,
+        )
+        return header + entry.name + extra
+
+    def _require_entry(self) -> _Entry:
+        if self._current is None:
+            raise RuntimeError("No entry has been started")
+        return self._current
+
+    def _emit_data(self, data: bytes) -> bytes:
+        self._current.compress_size += len(data)
+        return self._emit(data)
+
+    def _emit(self, data: bytes) -> bytes:
+        self._offset += len(data)
+        return data
+
+
+def iter_zip(
+    entries: Iterable[Tuple[str, Iterable[bytes]]],
+    compress_type: int = zipfile.ZIP_DEFLATED,
+) -> Iterator[bytes]:
+    """
+    Stream a ZIP archive from entry names and content chunks.
+
+    Args:
+        entries: Pairs of archive name and an iterable of content chunks
+        compress_type: Compression method for every entry
+
+    Yields:
+        Archive bytes, chunk by chunk
+    """
+    writer = ZipStreamWriter()
+    for name, chunks in entries:
+        yield writer.start_entry(name, compress_type)
+        for chunk in chunks:
+            data = writer.write(chunk)
+            if data:
+                yield data
+        yield writer.end_entry()
+    yield writer.close()
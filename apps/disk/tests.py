@@ -1,3 +1,1946 @@
-from django.test import TestCase
+import asyncio
+import dataclasses
+import io
+import json
+import os
+import shutil
+import tarfile
+import tempfile
+import threading
+import time
+import zipfile
+import zlib
+from datetime import timedelta
+from email.utils import format_datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import sync_to_async
+import httpx
+
+from django.conf import settings
+from django.contrib.auth.models import User
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.test import (
+    AsyncRequestFactory,
+    Client,
+    SimpleTestCase,
+    TestCase,
+    TransactionTestCase,
+    override_settings,
+)
+from django.urls import reverse
+from django.utils import timezone
+
+from apps.disk.fake_server import FakeDiskConfig, FakeDiskServer
+from apps.disk import views
+from apps.disk.models import ArchiveJob, FileEntry
+from apps.disk.services.archive_jobs import ArchiveJobQueue
+from apps.disk.services.archive_service import stream_archive
+from apps.disk.services.async_disk_service import AsyncYandexDiskService
+from apps.disk.services.blob_cache import BlobCache, BlobRange
+from apps.disk.services import cache_service
+from apps.disk.services.cache_service import CacheService
+from apps.disk.services.compression import (
+    DEFLATE_WINDOW,
+    CompressionPolicy,
+    byte_entropy,
+    deflate_block,
+)
+from apps.disk.services.crawler_service import FolderCrawler
+from apps.disk.services.disk_service import YandexDiskFile, YandexDiskService
+from apps.disk.services.hedging import BUDGET_BURST, MIN_SAMPLES, HedgePolicy
+from apps.disk.services.http_client import (
+    API_RETRY_STATUSES,
+    create_http_session,
+    get_http_session,
+    parse_retry_after,
+    send_with_retries,
+)
+from apps.disk.services.listing_codec import (
+    FORMAT_VERSION,
+    MAGIC,
+    decode_listing,
+    encode_listing,
+)
+from apps.disk.services.listing_columns import NO_CATEGORY, ListingColumns
+from apps.disk.services.listing_index import ListingIndex, parse_sort
+from apps.disk.services.metadata_store import (
+    EXPIRED,
+    PARTIAL_LISTING,
+    MetadataStore,
+)
+from apps.disk.services.prefetch import SpooledDownload
+from apps.disk.services import rate_limiter
+from apps.disk.services.rate_limiter import AdaptiveRateLimiter
+from apps.disk.services.single_flight import SingleFlight
+from apps.disk.views import _blob_key, _parse_byte_range
+
+PUBLIC_KEY = "https://disk.yandex.ru/d/test"
+
+
+def make_file(path: str, **fields) -> YandexDiskFile:
+    """Build a listed file with defaults for the fields a test does not set."""
+    values = {
+        "name": path.rpartition("/")[2],
+        "path": path,
+        "type": "file",
+        "size": 10,
+        "created": "2024-01-01T00:00:00+00:00",
+        "modified": "2024-01-01T00:00:00+00:00",
+        "mime_type": "application/octet-stream",
+        "public_key": PUBLIC_KEY,
+    }
+    values.update(fields)
+    return YandexDiskFile(**values)
+
+
+class FakeServerMixin:
+    """Runs a FakeDiskServer on a background thread for the test class."""
+
+    # Text files are deflated and binary files stored
+    config = FakeDiskConfig(
+        depth=1,
+        folders=2,
+        files=3,
+        min_file_size=0,
+        max_file_size=200_000,
+        extensions=(".bin", ".txt"),
+    )
+
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = FakeDiskServer(cls.config).start()
+        cls.addClassCleanup(cls.server.stop)
+        cls.enterClassContext(override_settings(YANDEX_DISK_API_URL=cls.server.api_url))
+
+    def setUp(self):
+        super().setUp()
+        cache.clear()
+
+    def content(self, path: str) -> bytes:
+        """Return the full content the fake server serves for a file."""
+        resource = self.server.tree.get(path)
+        return resource.read(0, resource.size)
+
+
+class FakeServerTestCase(FakeServerMixin, TestCase):
+    """Requests made by a logged-in user against the fake server."""
+
+    def setUp(self):
+        super().setUp()
+        self.user = User.objects.create_user("reader", password="secret")
+        self.client.force_login(self.user)
+
+
+class ArchiveDownloadTests(FakeServerTestCase):
+    """Bulk downloads read back with the standard library archive modules."""
+
+    def download_archive(self, files, archive_format: str) -> bytes:
+        response = self.client.post(
+            reverse("disk:download_files"),
+            json.dumps({"files": files, "format": archive_format}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 200)
+        return b"".join(response.streaming_content)
+
+    def selection(self):
+        return [
+            {"name": "file_0.bin", "public_key": PUBLIC_KEY, "path": "/file_0.bin"},
+            {"name": "file_1.txt", "public_key": PUBLIC_KEY, "path": "/file_1.txt"},
+            {
+                "name": "folder_1",
+                "public_key": PUBLIC_KEY,
+                "path": "/folder_1",
+                "type": "dir",
+            },
+        ]
+
+    def expected(self):
+        paths = ["/file_0.bin", "/file_1.txt"] + [
+            file.path for file in self.server.tree.get("/folder_1").children
+        ]
+        return {path[1:]: self.content(path) for path in paths}
+
+    def assert_zip(self, data: bytes) -> None:
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertIsNone(archive.testzip())
+            contents = {name: archive.read(name) for name in archive.namelist()}
+            methods = {info.filename: info.compress_type for info in archive.infolist()}
+        self.assertEqual(contents, self.expected())
+        for name, method in methods.items():
+            expected = (
+                zipfile.ZIP_DEFLATED if name.endswith(".txt") else zipfile.ZIP_STORED
+            )
+            self.assertEqual(method, expected, name)
+
+    def test_zip_round_trip(self):
+        data = self.download_archive(self.selection(), "zip")
+        self.assert_zip(data)
+
+    @override_settings(
+        YANDEX_DISK_ARCHIVE_COMPRESS_WORKERS=2,
+        YANDEX_DISK_ARCHIVE_COMPRESS_BLOCK=16 * 1024,
+    )
+    def test_zip_round_trip_with_parallel_compression(self):
+        data = self.download_archive(self.selection(), "zip")
+        self.assert_zip(data)
+
+    def test_tar_round_trip(self):
+        for archive_format, mode in (("tar", "r:"), ("tar.gz", "r:gz")):
+            with self.subTest(archive_format):
+                data = self.download_archive(self.selection(), archive_format)
+                with tarfile.open(fileobj=io.BytesIO(data), mode=mode) as archive:
+                    contents = {
+                        member.name: archive.extractfile(member).read()
+                        for member in archive.getmembers()
+                    }
+                self.assertEqual(contents, self.expected())
+
+    def test_unsupported_format_is_rejected(self):
+        response = self.client.post(
+            reverse("disk:download_files"),
+            json.dumps({"files": self.selection(), "format": "rar"}),
+            content_type="application/json",
+        )
+        self.assertEqual(response.status_code, 400)
+
+    def test_failed_downloads_are_skipped(self):
+        downloads = [
+            SpooledDownload(name="ok.txt", size=5, spool=io.BytesIO(b"hello")),
+            SpooledDownload(name="failed.txt", error=RuntimeError("boom")),
+        ]
+        data = b"".join(stream_archive(downloads, "zip"))
+        with zipfile.ZipFile(io.BytesIO(data)) as archive:
+            self.assertEqual(archive.namelist(), ["ok.txt"])
+            self.assertEqual(archive.read("ok.txt"), b"hello")
+
+
+class DownloadResourceTests(FakeServerTestCase):
+    """Single downloads resolved by public key and path."""
+
+    def download(self, path: str, **headers):
+        return self.client.get(
+            reverse("disk:download_resource"),
+            {"public_key": PUBLIC_KEY, "path": path},
+            **headers,
+        )
+
+    def test_full_download(self):
+        response = self.download("/folder_0/file_2.bin")
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(
+            b"".join(response.streaming_content),
+            self.content("/folder_0/file_2.bin"),
+        )
+
+    def test_range_download(self):
+        content = self.content("/file_2.bin")
+        response = self.download("/file_2.bin", HTTP_RANGE="bytes=10-19")
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(response["Content-Range"], f"bytes 10-19/{len(content)}")
+        self.assertEqual(b"".join(response.streaming_content), content[10:20])
+
+    def test_unsatisfiable_range(self):
+        size = len(self.content("/file_2.bin"))
+        response = self.download("/file_2.bin", HTTP_RANGE=f"bytes={size}-")
+        self.assertEqual(response.status_code, 416)
+
+    def test_missing_arguments(self):
+        response = self.client.get(reverse("disk:download_resource"))
+        self.assertEqual(response.status_code, 400)
+
+    def test_anonymous_downloads_are_refused(self):
+        self.client.logout()
+        response = self.download("/file_2.bin")
+        self.assertEqual(response.status_code, 302)
+        response = self.client.get(
+            reverse("disk:download_files"), {"download_url": "http://example.com/"}
+        )
+        self.assertEqual(response.status_code, 302)
+
+
+class CachedDownloadTests(FakeServerTestCase):
+    """Single downloads stored in and served from the blob cache."""
+
+    def setUp(self):
+        super().setUp()
+        root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, root)
+        self.blob_cache = BlobCache(root, max_bytes=10**7, max_file_size=10**7)
+        patcher = mock.patch(
+            "apps.disk.views.get_blob_cache", return_value=self.blob_cache
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.path = "/file_2.bin"
+        self.key = self.current_key(self.path)
+
+    def current_key(self, path: str) -> str:
+        """Return the blob key of the version of a file the server holds."""
+        revision = {"modified": self.server.tree.get(path).modified}
+        return _blob_key(PUBLIC_KEY, path, revision)
+
+    def download(self, params=None, **headers):
+        return self.client.get(
+            reverse("disk:download_resource"),
+            {"public_key": PUBLIC_KEY, "path": self.path, **(params or {})},
+            **headers,
+        )
+
+    def test_full_download_is_cached_and_served(self):
+        content = self.content(self.path)
+        self.assertEqual(b"".join(self.download().streaming_content), content)
+        with self.blob_cache.open(self.key) as blob:
+            self.assertEqual(blob.read(), content)
+
+        with mock.patch("apps.disk.views.get_http_session") as session:
+            response = self.download(HTTP_RANGE="bytes=-5")
+            self.assertEqual(response.status_code, 206)
+            self.assertEqual(b"".join(response.streaming_content), content[-5:])
+        session.assert_not_called()
+
+    def test_partial_download_is_not_cached(self):
+        response = self.download(HTTP_RANGE="bytes=0-9")
+        self.assertEqual(response.status_code, 206)
+        b"".join(response.streaming_content)
+        self.assertIsNone(self.blob_cache.open(self.key))
+
+    def test_revision_comes_from_the_api(self):
+        content = self.content(self.path)
+        response = self.download({"revision": "2000-01-01T00:00:00+00:00"})
+        self.assertEqual(b"".join(response.streaming_content), content)
+        self.assertEqual([e.name for e in self.blob_cache._scan()], [self.key])
+
+    def test_changed_file_is_cached_under_new_revision(self):
+        b"".join(self.download().streaming_content)
+        resource = self.server.tree.get(self.path)
+        resource.modified = "2030-01-01T00:00:00+00:00"
+        self.addCleanup(setattr, resource, "modified", resource.modified)
+        cache.clear()
+
+        b"".join(self.download().streaming_content)
+        self.assertNotEqual(self.current_key(self.path), self.key)
+        self.assertIsNotNone(self.blob_cache.open(self.current_key(self.path)))
+
+    def test_archive_files_are_cached_under_api_revision(self):
+        files = [
+            {
+                "name": "file_0.bin",
+                "public_key": PUBLIC_KEY,
+                "path": "/file_0.bin",
+                "revision": "2000-01-01T00:00:00+00:00",
+            }
+        ]
+        response = self.client.post(
+            reverse("disk:download_files"),
+            json.dumps({"files": files, "format": "zip"}),
+            content_type="application/json",
+        )
+        b"".join(response.streaming_content)
+        with self.blob_cache.open(self.current_key("/file_0.bin")) as blob:
+            self.assertEqual(blob.read(), self.content("/file_0.bin"))
+
+    def test_client_supplied_url_is_not_cached(self):
+        url = YandexDiskService().get_download_link(PUBLIC_KEY, "/file_0.bin")
+        response = self.client.get(
+            reverse("disk:download_files"), {"download_url": url}
+        )
+        self.assertEqual(
+            b"".join(response.streaming_content), self.content("/file_0.bin")
+        )
+        self.assertEqual(list(self.blob_cache._scan()), [])
+
+
+class AsyncViewTests(FakeServerTestCase):
+    """The async views and service, called as an ASGI server would."""
+
+    def request(self, method: str, path: str = "/", data=None, **extra):
+        factory = AsyncRequestFactory()
+        if method == "post":
+            request = factory.post(
+                path, json.dumps(data), content_type="application/json", **extra
+            )
+        else:
+            request = factory.get(path, data, **extra)
+        user = self.user
+
+        async def auser():
+            return user
+
+        request.user = user
+        request.auser = auser
+        request.session = {}
+        request._dont_enforce_csrf_checks = True
+        return request
+
+    async def read(self, response) -> bytes:
+        return b"".join([chunk async for chunk in response.streaming_content])
+
+    async def test_download(self):
+        request = self.request(
+            "get", data={"public_key": PUBLIC_KEY, "path": "/file_2.bin"}
+        )
+        response = await views.download_resource_async(request)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(await self.read(response), self.content("/file_2.bin"))
+
+    async def test_range_download(self):
+        request = self.request(
+            "get",
+            data={"public_key": PUBLIC_KEY, "path": "/file_2.bin"},
+            headers={"Range": "bytes=5-9"},
+        )
+        response = await views.download_resource_async(request)
+        self.assertEqual(response.status_code, 206)
+        self.assertEqual(await self.read(response), self.content("/file_2.bin")[5:10])
+
+    async def test_archive(self):
+        files = [
+            {"name": "file_0.bin", "public_key": PUBLIC_KEY, "path": "/file_0.bin"},
+            {
+                "name": "folder_1",
+                "public_key": PUBLIC_KEY,
+                "path": "/folder_1",
+                "type": "dir",
+            },
+        ]
+        request = self.request("post", data={"files": files, "format": "zip"})
+        response = await views.stream_file_async(request)
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(await self.read(response))) as archive:
+            contents = {name: archive.read(name) for name in archive.namelist()}
+        paths = ["/file_0.bin"] + [
+            f.path for f in self.server.tree.get("/folder_1").children
+        ]
+        self.assertEqual(contents, {path[1:]: self.content(path) for path in paths})
+
+    async def test_archive_starts_before_selection_is_resolved(self):
+        url = await AsyncYandexDiskService().get_download_link(
+            PUBLIC_KEY, "/file_0.bin"
+        )
+        pulled = []
+
+        def entries(files):
+            for i in range(50):
+                pulled.append(i)
+                yield f"copy_{i}.bin", url, None
+
+        request = self.request("post", data={"files": [{"name": "x"}], "format": "zip"})
+        with mock.patch.object(views, "_iter_selected_files", entries):
+            response = await views.stream_file_async(request)
+            content = response.streaming_content
+            await anext(content)
+            self.assertLess(len(pulled), 50)
+            await content.aclose()
+
+    async def test_file_list(self):
+        request = self.request("get", data={"public_url": PUBLIC_KEY})
+        response = await views.AsyncFileListView.as_view()(request)
+        self.assertEqual(response.status_code, 200)
+        response.render()
+        self.assertIn(b"folder_0", response.content)
+        self.assertIn(b"file_2.bin", response.content)
+
+    async def test_service_matches_sync_service(self):
+        service = AsyncYandexDiskService()
+        sync_service = YandexDiskService()
+        files = await service.get_public_resources(PUBLIC_KEY, "folder_1")
+        self.assertEqual(
+            files,
+            await sync_to_async(sync_service.get_public_resources)(
+                PUBLIC_KEY, "folder_1"
+            ),
+        )
+        self.assertEqual(
+            await service.get_file_revision(PUBLIC_KEY, "/file_2.bin"),
+            sync_service.get_file_revision(PUBLIC_KEY, "/file_2.bin"),
+        )
+        self.assertIsNone(await service.get_file_revision(PUBLIC_KEY, "/folder_1"))
+        links = await service.resolve_download_links(
+            PUBLIC_KEY, ["/file_0.bin", "/missing.bin"]
+        )
+        self.assertIsNotNone(links[0])
+        self.assertIsNone(links[1])
+
+
+class DiskServiceTests(FakeServerMixin, SimpleTestCase):
+    config = FakeDiskConfig(
+        depth=1, folders=2, files=25, min_file_size=0, max_file_size=1000
+    )
+
+    def setUp(self):
+        super().setUp()
+        self.service = YandexDiskService()
+
+    def fetch_counter(self):
+        """Patch _fetch_page to count the pages requested."""
+        return mock.patch.object(
+            self.service, "_fetch_page", wraps=self.service._fetch_page
+        )
+
+    def test_folder_is_read_page_by_page(self):
+        expected = sorted(child.name for child in self.server.tree.root.children)
+        for prefetch in (False, True):
+            with self.subTest(prefetch=prefetch), self.fetch_counter() as fetch:
+                files = self.service.iter_public_resources(
+                    PUBLIC_KEY, page_size=10, prefetch=prefetch
+                )
+                self.assertEqual([f.name for f in files], expected)
+                self.assertEqual(
+                    [c.args[2:4] for c in fetch.call_args_list],
+                    [(0, 10), (10, 10), (20, 10)],
+                )
+
+    def test_full_last_page_ends_on_total(self):
+        with self.fetch_counter() as fetch:
+            files = list(
+                self.service.iter_public_resources(PUBLIC_KEY, "/folder_0", page_size=5)
+            )
+        self.assertEqual(len(files), 25)
+        self.assertEqual(fetch.call_count, 5)
+
+    def test_pages_are_fetched_as_consumed(self):
+        with self.fetch_counter() as fetch:
+            files = self.service.iter_public_resources(
+                PUBLIC_KEY, page_size=10, prefetch=False
+            )
+            next(files)
+            self.assertEqual(fetch.call_count, 1)
+            files.close()
+
+    def test_sort_is_passed_to_the_api(self):
+        files = list(self.service.iter_public_resources(PUBLIC_KEY, sort="-size"))
+        sizes = [f.size for f in files]
+        self.assertEqual(sizes, sorted(sizes, reverse=True))
+
+    def test_missing_folder_raises(self):
+        with self.assertRaises(RuntimeError):
+            list(self.service.iter_public_resources(PUBLIC_KEY, "/missing"))
+
+    def listing(self) -> list:
+        return list(self.service.iter_public_resources(PUBLIC_KEY))
+
+    def revalidate(self, files, validators):
+        with mock.patch.object(
+            self.service,
+            "get_public_resources",
+            wraps=self.service.get_public_resources,
+        ) as full_fetch:
+            result = self.service.revalidate_public_resources(
+                PUBLIC_KEY, files, validators
+            )
+        return result, full_fetch.called
+
+    def test_unchanged_folder_is_kept(self):
+        files = self.listing()
+        validators = self.service.get_resource_validators(PUBLIC_KEY)
+        self.assertEqual(validators["total"], 27)
+
+        with self.fetch_counter() as fetch:
+            (current, new_validators), refetched = self.revalidate(files, validators)
+        self.assertIs(current, files)
+        self.assertEqual(new_validators, validators)
+        self.assertFalse(refetched)
+        fetch.assert_not_called()
+
+    def test_new_and_changed_items_are_merged(self):
+        files = self.listing()
+        validators = self.service.get_resource_validators(PUBLIC_KEY)
+        by_age = sorted(files, key=lambda f: f.modified, reverse=True)
+        newest, second = by_age[0], by_age[1]
+        cached = [
+            dataclasses.replace(f, size=f.size + 1) if f is second else f
+            for f in files
+            if f is not newest
+        ]
+
+        (current, _), refetched = self.revalidate(cached, dict(validators, revision=1))
+        self.assertFalse(refetched)
+        self.assertEqual(current, files)
+
+    def test_unexplained_revision_is_refetched(self):
+        files = self.listing()
+        validators = self.service.get_resource_validators(PUBLIC_KEY)
+
+        (current, _), refetched = self.revalidate(files, dict(validators, revision=1))
+        self.assertTrue(refetched)
+        self.assertEqual(current, files)
+
+    def test_removed_items_are_refetched(self):
+        files = self.listing()
+        validators = self.service.get_resource_validators(PUBLIC_KEY)
+        newest = max(files, key=lambda f: f.modified)
+        removed = make_file("old.bin", modified="2020-01-01T00:00:00+00:00")
+        cached = [f for f in files if f is not newest] + [removed]
+
+        # One item added and one removed keep the count of the folder
+        (current, _), refetched = self.revalidate(cached, dict(validators, revision=1))
+        self.assertTrue(refetched)
+        self.assertEqual(current, files)
+
+    def test_listing_without_validators_is_refetched(self):
+        (current, validators), refetched = self.revalidate([], {})
+        self.assertTrue(refetched)
+        self.assertEqual(len(current), validators["total"])
+
+    def test_links_are_resolved_in_order(self):
+        paths = ["/file_2.bin", "/missing.bin", "/file_0.bin"]
+        links = self.service.resolve_download_links(PUBLIC_KEY, paths)
+
+        self.assertEqual(len(links), 3)
+        self.assertIsNone(links[1])
+        for path, link in zip(paths[::2], links[::2]):
+            with self.service.session.get(link) as response:
+                self.assertEqual(response.content, self.content(path))
+
+    def test_links_are_resolved_concurrently(self):
+        barrier = threading.Barrier(3, timeout=5)
+
+        def resolve(public_key, path):
+            barrier.wait()
+            return path
+
+        with mock.patch.object(self.service, "get_download_link", resolve):
+            links = self.service.resolve_download_links(
+                PUBLIC_KEY, ["/a", "/b", "/c"], max_workers=3
+            )
+        self.assertEqual(links, ["/a", "/b", "/c"])
+
+    def test_resolver_errors_become_none(self):
+        def resolve(public_key, path):
+            if path == "/b":
+                raise RuntimeError("boom")
+            return path
+
+        with mock.patch.object(self.service, "get_download_link", resolve):
+            links = self.service.resolve_download_links(PUBLIC_KEY, ["/a", "/b"])
+        self.assertEqual(links, ["/a", None])
+
+    def test_no_paths_make_no_requests(self):
+        with mock.patch.object(self.service, "get_download_link") as resolve:
+            self.assertEqual(self.service.resolve_download_links(PUBLIC_KEY, []), [])
+        resolve.assert_not_called()
+
+
+class FolderCrawlerTests(FakeServerMixin, SimpleTestCase):
+    config = FakeDiskConfig(depth=2, folders=2, files=2, min_file_size=0)
+
+    def setUp(self):
+        super().setUp()
+        self.service = YandexDiskService()
+
+    def crawl(self, crawler: FolderCrawler, path: str = "") -> list:
+        return [
+            ("/" + node.file.path, node.depth)
+            for node in crawler.crawl(PUBLIC_KEY, path)
+        ]
+
+    def test_whole_tree_is_crawled_breadth_first(self):
+        crawler = FolderCrawler(self.service)
+        nodes = self.crawl(crawler)
+
+        expected = set(self.server.tree.resources) - {"/"}
+        self.assertEqual({path for path, _ in nodes}, expected)
+        self.assertEqual(len(nodes), len(expected))
+        depths = [depth for _, depth in nodes]
+        self.assertEqual(depths, sorted(depths))
+        self.assertEqual(dict(nodes)["/folder_1/folder_0/file_1.bin"], 3)
+        self.assertTrue(crawler.complete)
+
+    def test_crawl_starts_below_path(self):
+        nodes = self.crawl(FolderCrawler(self.service), "folder_1")
+        self.assertEqual(len(nodes), 8)
+        self.assertTrue(all(path.startswith("/folder_1/") for path, _ in nodes))
+
+    def test_depth_limit_truncates(self):
+        crawler = FolderCrawler(self.service, max_depth=1)
+        nodes = self.crawl(crawler)
+
+        self.assertEqual(len(nodes), 4)
+        self.assertEqual({depth for _, depth in nodes}, {1})
+        self.assertTrue(crawler.truncated)
+
+    def test_node_limit_truncates(self):
+        crawler = FolderCrawler(self.service, max_nodes=5)
+        self.assertEqual(len(self.crawl(crawler)), 5)
+        self.assertTrue(crawler.truncated)
+        self.assertFalse(crawler.complete)
+
+    def test_failed_subfolder_is_skipped(self):
+        crawler = FolderCrawler(self.service)
+        list_folder = crawler._list_folder
+
+        def fail_folder_0(public_key, folder):
+            if folder == "/folder_0":
+                raise RuntimeError("boom")
+            return list_folder(public_key, folder)
+
+        with mock.patch.object(crawler, "_list_folder", fail_folder_0):
+            nodes = self.crawl(crawler)
+
+        self.assertIn(("/folder_0", 1), nodes)
+        self.assertFalse(any(path.startswith("/folder_0/") for path, _ in nodes))
+        self.assertEqual(crawler.failed_folders, ["/folder_0"])
+        self.assertFalse(crawler.complete)
+
+    def test_failed_root_raises(self):
+        with self.assertRaises(RuntimeError):
+            self.crawl(FolderCrawler(self.service), "missing")
+
+    def test_parallel_listings_are_bounded(self):
+        crawler = FolderCrawler(self.service, max_workers=2)
+        list_folder = crawler._list_folder
+        lock = threading.Lock()
+        running, peak = 0, 0
+
+        def slow_list(public_key, folder):
+            nonlocal running, peak
+            with lock:
+                running += 1
+                peak = max(peak, running)
+            time.sleep(0.02)
+            with lock:
+                running -= 1
+            return list_folder(public_key, folder)
+
+        with mock.patch.object(crawler, "_list_folder", slow_list):
+            self.assertEqual(len(self.crawl(crawler)), 20)
+        self.assertEqual(peak, 2)
+
+
+class CompressionPolicyTests(SimpleTestCase):
+    def setUp(self):
+        self.policy = CompressionPolicy(sample_size=4096, entropy_threshold=7.5)
+
+    def test_compressed_media_is_stored(self):
+        for name in ("photo.jpg", "movie.mp4", "song.mp3", "backup.zip"):
+            with self.subTest(name=name):
+                self.assertEqual(self.policy.choose(name), zipfile.ZIP_STORED)
+
+    def test_documents_and_text_are_deflated(self):
+        for name in ("notes.txt", "report.pdf", "page.html"):
+            with self.subTest(name=name):
+                self.assertEqual(self.policy.choose(name), zipfile.ZIP_DEFLATED)
+
+    def test_exceptions_to_categories(self):
+        cases = {
+            "image/bmp": zipfile.ZIP_DEFLATED,
+            "audio/wav": zipfile.ZIP_DEFLATED,
+            "application/vnd.openxmlformats-officedocument.wordprocessingml"
+            ".document": zipfile.ZIP_STORED,
+            "application/epub+zip": zipfile.ZIP_STORED,
+        }
+        for mime_type, method in cases.items():
+            with self.subTest(mime_type=mime_type):
+                self.assertEqual(self.policy.choose("file", mime_type), method)
+
+    def test_known_mime_type_wins_over_name(self):
+        self.assertEqual(
+            self.policy.choose("photo.jpg", "text/plain"), zipfile.ZIP_DEFLATED
+        )
+
+    def test_unknown_types_are_sampled(self):
+        noise = os.urandom(4096)
+        self.assertEqual(self.policy.choose("data", sample=noise), zipfile.ZIP_STORED)
+        self.assertEqual(
+            self.policy.choose("data", sample=b"abc" * 1000), zipfile.ZIP_DEFLATED
+        )
+        self.assertEqual(self.policy.choose("data"), zipfile.ZIP_DEFLATED)
+
+        unsampled = CompressionPolicy(sample_size=0)
+        self.assertEqual(unsampled.choose("data", sample=noise), zipfile.ZIP_DEFLATED)
+
+    def test_byte_entropy(self):
+        self.assertEqual(byte_entropy(b""), 0.0)
+        self.assertEqual(byte_entropy(b"aaaa"), 0.0)
+        self.assertAlmostEqual(byte_entropy(bytes(range(256))), 8.0)
+
+    def test_blocks_join_into_one_deflate_stream(self):
+        data = b"".join(f"line {i}\n".encode() for i in range(20_000))
+        blocks = [data[i : i + 50_000] for i in range(0, len(data), 50_000)]
+        fragments = [
+            deflate_block(block, data[max(0, i * 50_000 - DEFLATE_WINDOW) : i * 50_000])
+            for i, block in enumerate(blocks)
+        ]
+        stream = b"".join(fragments) + zlib.compress(b"", wbits=-15)
+        self.assertEqual(zlib.decompress(stream, wbits=-15), data)
+        self.assertLess(len(stream), len(data) // 3)
+
+
+class ScriptedHandler(BaseHTTPRequestHandler):
+    """Answers each request with the next status of the server's script."""
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.requests += 1
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header("Content-Length", "0")
+        self.send_header("Set-Cookie", "session=secret")
+        self.end_headers()
+
+    def log_message(self, format, *args):
+        pass
+
+
+@override_settings(YANDEX_DISK_HTTP_RETRIES=2, YANDEX_DISK_HTTP_BACKOFF=0)
+class HttpClientTests(SimpleTestCase):
+    @classmethod
+    def setUpClass(cls):
+        super().setUpClass()
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ScriptedHandler)
+        cls.server.daemon_threads = True
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.addClassCleanup(cls.server.server_close)
+        cls.addClassCleanup(cls.server.shutdown)
+        host, port = cls.server.server_address[:2]
+        cls.url = f"http://{host}:{port}/"
+
+    def script(self, *statuses: int) -> None:
+        self.server.statuses = list(statuses)
+        self.server.requests = 0
+
+    def test_session_retries_server_errors(self):
+        self.script(503, 500)
+        response = create_http_session().get(self.url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_session_gives_up_after_retries(self):
+        self.script(502, 502, 502, 502)
+        response = create_http_session().get(self.url)
+        self.assertEqual(response.status_code, 502)
+        self.assertEqual(self.server.requests, 3)
+
+    def test_api_session_leaves_throttling_to_the_limiter(self):
+        self.script(429)
+        session = create_http_session(API_RETRY_STATUSES)
+        self.assertEqual(session.get(self.url).status_code, 429)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_client_errors_are_not_retried(self):
+        self.script(404)
+        self.assertEqual(create_http_session().get(self.url).status_code, 404)
+        self.assertEqual(self.server.requests, 1)
+
+    def test_cookies_are_not_kept(self):
+        self.script()
+        session = create_http_session()
+        session.get(self.url)
+        self.assertEqual(len(session.cookies), 0)
+
+    def test_session_is_shared(self):
+        self.assertIs(get_http_session(), get_http_session())
+
+    def test_async_requests_are_retried(self):
+        statuses = [503, 429, 200]
+
+        async def send():
+            transport = httpx.MockTransport(
+                lambda request: httpx.Response(statuses.pop(0))
+            )
+            async with httpx.AsyncClient(transport=transport) as client:
+                request = client.build_request("GET", self.url)
+                return await send_with_retries(client, request)
+
+        self.assertEqual(asyncio.run(send()).status_code, 200)
+        self.assertEqual(statuses, [])
+
+    def test_async_retries_end_with_last_response(self):
+        calls = []
+
+        async def send():
+            def handler(request):
+                calls.append(request)
+                return httpx.Response(503, headers={"Retry-After": "0"})
+
+            transport = httpx.MockTransport(handler)
+            async with httpx.AsyncClient(transport=transport) as client:
+                request = client.build_request("GET", self.url)
+                return await send_with_retries(client, request)
+
+        self.assertEqual(asyncio.run(send()).status_code, 503)
+        self.assertEqual(len(calls), 3)
+
+    def test_parse_retry_after(self):
+        self.assertEqual(parse_retry_after("7"), 7.0)
+        self.assertIsNone(parse_retry_after(None))
+        self.assertIsNone(parse_retry_after("soon"))
+        past = timezone.now() - timedelta(minutes=1)
+        self.assertEqual(parse_retry_after(format_datetime(past, usegmt=True)), 0.0)
+        future = timezone.now() + timedelta(minutes=1)
+        self.assertAlmostEqual(
+            parse_retry_after(format_datetime(future, usegmt=True)), 60, delta=2
+        )
+
+
+class ParseByteRangeTests(SimpleTestCase):
+    def test_whole_file_when_absent_or_unsupported(self):
+        for header in (None, "", "items=0-9", "bytes=0-9,20-29", "bytes=a-b"):
+            with self.subTest(header=header):
+                self.assertIsNone(_parse_byte_range(header, 100))
+
+    def test_malformed_ranges_are_ignored(self):
+        for header in ("bytes=-", "bytes=10-5", "bytes=1-x", "bytes= -"):
+            with self.subTest(header=header):
+                self.assertIsNone(_parse_byte_range(header, 100))
+
+    def test_bounded_range(self):
+        self.assertEqual(_parse_byte_range("bytes=0-9", 100), (0, 9))
+        self.assertEqual(_parse_byte_range("bytes=99-99", 100), (99, 99))
+
+    def test_end_is_clamped_to_file(self):
+        self.assertEqual(_parse_byte_range("bytes=90-200", 100), (90, 99))
+
+    def test_open_range(self):
+        self.assertEqual(_parse_byte_range("bytes=5-", 100), (5, 99))
+
+    def test_suffix_range(self):
+        self.assertEqual(_parse_byte_range("bytes=-10", 100), (90, 99))
+        self.assertEqual(_parse_byte_range("bytes=-200", 100), (0, 99))
+
+    def test_unsatisfiable_ranges(self):
+        for header, size in (
+            ("bytes=100-", 100),
+            ("bytes=100-200", 100),
+            ("bytes=-0", 100),
+            ("bytes=0-", 0),
+        ):
+            with self.subTest(header=header, size=size):
+                with self.assertRaises(ValueError):
+                    _parse_byte_range(header, size)
+
+
+class ListingCodecTests(SimpleTestCase):
+    def files(self):
+        return [
+            make_file("b.txt", size=3, mime_type="text/plain"),
+            make_file(
+                "a.jpg",
+                size=12,
+                mime_type="image/jpeg",
+                created="2024-05-01T10:00:00+03:00",
+                modified="2024-05-02T10:00:00.250000-07:30",
+            ),
+            make_file(
+                "docs",
+                type="dir",
+                size=0,
+                mime_type="",
+                created="2024-01-01T00:00:00",
+                modified="",
+            ),
+            make_file("c.bin", size=0, modified=None),
+        ]
+
+    def round_trip(self, files, validators=None):
+        columns = ListingColumns(files)
+        data = encode_listing(columns, ListingIndex(columns), validators or {}, 12.5)
+        decoded = decode_listing(data)
+        self.assertIsNotNone(decoded)
+        return decoded
+
+    def test_round_trip(self):
+        files = self.files()
+        resources, index, validators, fetched_at = self.round_trip(
+            files, {"revision": 7}
+        )
+        self.assertEqual(list(resources), files)
+        self.assertEqual(validators, {"revision": 7})
+        self.assertEqual(fetched_at, 12.5)
+
+    @override_settings(YANDEX_DISK_LISTING_COMPRESS_THRESHOLD=1)
+    def test_round_trip_compressed(self):
+        files = self.files()
+        resources, _, _, _ = self.round_trip(files)
+        self.assertEqual(list(resources), files)
+
+    def test_empty_listing(self):
+        resources, _, _, _ = self.round_trip([])
+        self.assertEqual(list(resources), [])
+
+    def test_orders_survive(self):
+        files = self.files()
+        columns = ListingColumns(files)
+        index = ListingIndex(columns)
+        _, decoded, _, _ = decode_listing(encode_listing(columns, index, {}, 0.0))
+        self.assertEqual(set(decoded.orders), set(index.orders))
+        for key, order in index.orders.items():
+            self.assertEqual(list(decoded.orders[key]), list(order))
+
+    def test_rejects_other_values(self):
+        columns = ListingColumns(self.files())
+        data = encode_listing(columns, ListingIndex(columns), {}, 0.0)
+        other_version = MAGIC + bytes([FORMAT_VERSION + 1]) + data[len(MAGIC) + 1 :]
+        for value in (None, b"", b"YD", other_version, [1, 2], data[:-8]):
+            with self.subTest(
+                value=value if not isinstance(value, bytes) else len(value)
+            ):
+                self.assertIsNone(decode_listing(value))
+
+
+class ListingColumnsTests(SimpleTestCase):
+    def files(self):
+        return [
+            make_file("b.txt", size=30, mime_type="text/plain"),
+            make_file(
+                "a.jpg",
+                mime_type="image/jpeg",
+                created="2024-05-01T10:00:00+03:00",
+                modified="2024-05-02T10:00:00.250000-07:30",
+            ),
+            make_file("docs", type="dir", size=0, mime_type="", modified=""),
+            make_file("c.bin", created="2024-01-01T00:00:00", modified=None),
+        ]
+
+    def test_rows_read_back_unchanged(self):
+        files = self.files()
+        columns = ListingColumns(files)
+        self.assertEqual(len(columns), 4)
+        self.assertEqual(list(columns), files)
+        self.assertEqual(columns[1], files[1])
+        self.assertEqual(columns[-1], files[-1])
+        self.assertEqual(columns[1:3], files[1:3])
+
+    def test_repeated_values_are_stored_once(self):
+        columns = ListingColumns(self.files() * 100)
+        self.assertEqual(len(columns), 400)
+        self.assertEqual(columns.types, ["file", "dir"])
+        self.assertEqual(columns.public_keys, [PUBLIC_KEY])
+        self.assertEqual(len(columns.mime_types), 4)
+        self.assertEqual(columns.sizes.typecode, "q")
+
+    def test_argsort(self):
+        columns = ListingColumns(self.files())
+        self.assertEqual(list(columns.argsort("name")), [1, 0, 3, 2])
+        self.assertEqual(list(columns.argsort("size")), [2, 1, 3, 0])
+        self.assertEqual(list(columns.argsort("modified")), [2, 3, 0, 1])
+        with self.assertRaises(ValueError):
+            columns.argsort("owner")
+
+    def test_category_codes(self):
+        codes = ListingColumns(self.files()).category_codes()
+        self.assertEqual(codes, bytes([0, 1, NO_CATEGORY, NO_CATEGORY]))
+
+
+class ListingIndexTests(SimpleTestCase):
+    def files(self):
+        return [
+            make_file("b.txt", size=30, mime_type="text/plain"),
+            make_file(
+                "A.jpg",
+                size=10,
+                mime_type="image/jpeg",
+                modified="2024-03-01T00:00:00+00:00",
+            ),
+            make_file("docs", type="dir", size=0, mime_type=""),
+            make_file(
+                "c.pdf",
+                size=20,
+                mime_type="application/pdf",
+                modified="2023-12-31T23:00:00-02:00",
+            ),
+            make_file("d.png", size=20, mime_type="image/png", modified=None),
+        ]
+
+    def select(self, file_type=None, sort=None):
+        files = self.files()
+        index = ListingIndex(ListingColumns(files))
+        return [f.name for f in index.select(files, file_type, sort)]
+
+    def test_parse_sort(self):
+        self.assertEqual(parse_sort(None), ("name", False))
+        self.assertEqual(parse_sort("size"), ("size", False))
+        self.assertEqual(parse_sort("-modified"), ("modified", True))
+        self.assertEqual(parse_sort("-owner"), ("name", False))
+
+    def test_sort_orders(self):
+        cases = {
+            None: ["A.jpg", "b.txt", "c.pdf", "d.png", "docs"],
+            "-name": ["docs", "d.png", "c.pdf", "b.txt", "A.jpg"],
+            # Ties keep listing order
+            "size": ["docs", "A.jpg", "c.pdf", "d.png", "b.txt"],
+            # Missing timestamps sort first, offsets are compared in UTC
+            "modified": ["d.png", "b.txt", "docs", "c.pdf", "A.jpg"],
+        }
+        for sort, names in cases.items():
+            with self.subTest(sort=sort):
+                self.assertEqual(self.select(sort=sort), names)
+
+    def test_file_type_filters(self):
+        self.assertEqual(self.select("image"), ["A.jpg", "d.png"])
+        self.assertEqual(self.select("image", "-size"), ["d.png", "A.jpg"])
+        self.assertEqual(self.select("document"), ["b.txt", "c.pdf"])
+        self.assertEqual(self.select("video"), [])
+        self.assertEqual(self.select("unknown"), [])
+
+    def test_selection_pages_lazily(self):
+        files = self.files()
+        selection = ListingIndex(ListingColumns(files)).select(files, sort="-size")
+        self.assertEqual(len(selection), 5)
+        self.assertEqual(selection[-1].name, "docs")
+        with self.assertRaises(IndexError):
+            selection[5]
+        self.assertEqual([f.name for f in selection[1:3]], ["d.png", "c.pdf"])
+
+        page = Paginator(selection, 2).get_page(3)
+        self.assertEqual([f.name for f in page.object_list], ["docs"])
+
+    def test_orders_can_be_reused(self):
+        columns = ListingColumns(self.files())
+        index = ListingIndex(columns)
+        self.assertIs(ListingIndex(columns, index.orders).orders, index.orders)
+
+
+@override_settings(YANDEX_DISK_BROWSER_PAGE_SIZE=2)
+class FileListViewTests(FakeServerTestCase):
+    def setUp(self):
+        super().setUp()
+        cache_service._local_listings.clear()
+
+    def page(self, **params):
+        response = self.client.get(
+            reverse("disk:file_list"), {"public_url": PUBLIC_KEY, **params}
+        )
+        self.assertEqual(response.status_code, 200)
+        return response.context
+
+    def test_listing_is_sorted_and_paginated(self):
+        children = self.server.tree.root.children
+        # Descending orders are ascending ones reversed, ties included
+        by_size = sorted(children, key=lambda r: r.size)[::-1]
+
+        context = self.page(sort="-size", page=2)
+        self.assertEqual(context["total_files"], len(children))
+        self.assertEqual(context["current_sort"], "-size")
+        self.assertEqual(
+            [f.name for f in context["files"]], [r.name for r in by_size[2:4]]
+        )
+
+    def test_listing_is_filtered(self):
+        context = self.page(filter="document")
+        self.assertEqual([f.name for f in context["files"]], ["file_1.txt"])
+        self.assertEqual(context["total_files"], 1)
+        self.assertEqual(context["current_file_type"], "document")
+
+    def test_unknown_sort_and_page_fall_back(self):
+        context = self.page(sort="owner", page=99)
+        self.assertEqual(context["current_sort"], "name")
+        self.assertEqual(context["page_obj"].number, 3)
+
+
+@override_settings(YANDEX_DISK_METADATA_STORE=False)
+class CacheServiceTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        cache_service._local_listings.clear()
+
+    def test_link_key_ignores_spelling_of_public_key_and_path(self):
+        key = CacheService.get_link_cache_key(PUBLIC_KEY, "/a/b.txt")
+        for public_key, path in (
+            ("http://www.disk.yandex.com/d/test/", "a/b.txt"),
+            (" https://disk.yandex.ru/d/test?x=1", "/a/b.txt/"),
+        ):
+            with self.subTest(public_key=public_key, path=path):
+                self.assertEqual(CacheService.get_link_cache_key(public_key, path), key)
+        self.assertNotEqual(CacheService.get_link_cache_key(PUBLIC_KEY, "/a/c"), key)
+        self.assertNotEqual(CacheService.get_link_cache_key("other", "/a/b.txt"), key)
+
+    def test_link_key_has_fixed_length(self):
+        short = CacheService.get_link_cache_key("k", "")
+        long = CacheService.get_link_cache_key("k" * 300, "/\u0444" * 300)
+        self.assertEqual(len(short), len(long))
+        self.assertLess(len(long), 250)
+
+    def test_local_cache_evicts_least_recently_used(self):
+        lru = cache_service.LocalLRUCache(max_size=2, ttl=60)
+        lru.set("a", 1)
+        lru.set("b", 2)
+        self.assertEqual(lru.get("a"), 1)
+        lru.set("c", 3)
+        self.assertIsNone(lru.get("b"))
+        self.assertEqual((lru.get("a"), lru.get("c")), (1, 3))
+        self.assertEqual(len(lru), 2)
+
+    def test_local_cache_expires_entries(self):
+        lru = cache_service.LocalLRUCache(max_size=2, ttl=60)
+        lru.set("a", 1)
+        with mock.patch.object(
+            cache_service.time, "monotonic", return_value=time.monotonic() + 61
+        ):
+            self.assertIsNone(lru.get("a"))
+        self.assertEqual(len(lru), 0)
+
+    def test_disabled_local_cache_stores_nothing(self):
+        lru = cache_service.LocalLRUCache(max_size=0, ttl=60)
+        lru.set("a", 1)
+        self.assertIsNone(lru.get("a"))
+
+    def test_listing_tiers_and_stats(self):
+        before = CacheService.get_stats()
+        self.assertIsNone(CacheService.get_cached_listing(PUBLIC_KEY, "docs"))
+        CacheService.cache_resources(PUBLIC_KEY, "docs", [make_file("docs/a.txt")])
+        self.assertIsNotNone(CacheService.get_cached_listing(PUBLIC_KEY, "docs"))
+        cache_service._local_listings.clear()
+        entry = CacheService.get_cached_listing(PUBLIC_KEY, "docs")
+        self.assertEqual([f.path for f in entry.resources], ["docs/a.txt"])
+
+        after = CacheService.get_stats()
+        self.assertEqual(after["misses"] - before["misses"], 1)
+        self.assertEqual(after["local_hits"] - before["local_hits"], 1)
+        self.assertEqual(after["shared_hits"] - before["shared_hits"], 1)
+        self.assertGreater(after["hit_ratio"], 0)
+        self.assertGreaterEqual(after["local_size"], 1)
+
+    @override_settings(YANDEX_DISK_LISTING_TTL=60)
+    def test_stale_listing_is_served_and_refreshed_in_background(self):
+        old = [make_file("docs/a.txt")]
+        new = [make_file("docs/a.txt"), make_file("docs/b.txt")]
+        entry = CacheService.cache_resources(PUBLIC_KEY, "docs", old)
+        entry.fetched_at = time.time() - 61
+        cache_service._local_listings.clear()
+        cache.set(CacheService.get_cache_key(PUBLIC_KEY, "docs"), entry.to_bytes())
+        refreshed = threading.Event()
+
+        def refresh(resources, validators):
+            refreshed.wait(5)
+            return new, {"revision": 2}
+
+        before = CacheService.get_stats()
+        stale = CacheService.get_cached_listing(PUBLIC_KEY, "docs", refresh=refresh)
+        self.assertEqual(list(stale.resources), old)
+        # A second stale read does not start another refresh
+        CacheService.get_cached_listing(PUBLIC_KEY, "docs", refresh=refresh)
+        refreshed.set()
+
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if CacheService.get_stats()["refreshes"] > before["refreshes"]:
+                break
+            time.sleep(0.01)
+        after = CacheService.get_stats()
+        self.assertEqual(after["refreshes"] - before["refreshes"], 1)
+        self.assertEqual(after["stale_hits"] - before["stale_hits"], 2)
+        entry = CacheService.get_cached_listing(PUBLIC_KEY, "docs")
+        self.assertEqual(list(entry.resources), new)
+        self.assertEqual(entry.validators, {"revision": 2})
+
+    @override_settings(YANDEX_DISK_LISTING_TTL=60)
+    def test_unchanged_refresh_keeps_resources(self):
+        files = [make_file("docs/a.txt")]
+        entry = CacheService.cache_resources(PUBLIC_KEY, "docs", files)
+        entry.fetched_at = time.time() - 61
+        done = threading.Event()
+
+        def refresh(resources, validators):
+            done.set()
+            return resources, validators
+
+        before = CacheService.get_stats()
+        CacheService.get_cached_listing(PUBLIC_KEY, "docs", refresh=refresh)
+        self.assertTrue(done.wait(5))
+        deadline = time.monotonic() + 5
+        while time.monotonic() < deadline:
+            if CacheService.get_stats()["not_modified"] > before["not_modified"]:
+                break
+            time.sleep(0.01)
+        self.assertEqual(
+            CacheService.get_stats()["not_modified"] - before["not_modified"], 1
+        )
+        entry = CacheService.get_cached_listing(PUBLIC_KEY, "docs")
+        self.assertLess(time.time() - entry.fetched_at, 60)
+        self.assertEqual(list(entry.resources), files)
+
+
+class MetadataStoreTests(TestCase):
+    def setUp(self):
+        self.root = [
+            make_file("a", type="dir", size=0),
+            make_file("b", type="dir", size=0),
+            make_file("top.txt"),
+        ]
+        self.folder_a = [make_file("a/one.txt"), make_file("a/two.txt")]
+        self.folder_b = [make_file("b/three.txt")]
+        MetadataStore.save_listing(PUBLIC_KEY, PUBLIC_KEY, "", False, self.root)
+        MetadataStore.save_listing(PUBLIC_KEY, PUBLIC_KEY, "a", False, self.folder_a)
+        MetadataStore.save_listing(PUBLIC_KEY, PUBLIC_KEY, "b", False, self.folder_b)
+
+    def paths(self, path: str = "", recursive: bool = False, public_key=PUBLIC_KEY):
+        files, _, _ = MetadataStore.load_listing(public_key, path, recursive)
+        return [f.path for f in files]
+
+    def test_unknown_listing(self):
+        self.assertIsNone(MetadataStore.load_listing(PUBLIC_KEY, "c"))
+        self.assertIsNone(MetadataStore.load_listing(PUBLIC_KEY, "", True))
+        self.assertIsNone(MetadataStore.load_listing("other", ""))
+
+    def test_folder_listing_reads_direct_children(self):
+        self.assertEqual(self.paths(), ["a", "b", "top.txt"])
+        self.assertEqual(self.paths("/a/"), ["a/one.txt", "a/two.txt"])
+
+    def test_round_trip_keeps_fields(self):
+        files, validators, fetched_at = MetadataStore.load_listing(PUBLIC_KEY, "a")
+        self.assertEqual(files, self.folder_a)
+        self.assertEqual(validators, {})
+        self.assertGreater(fetched_at, EXPIRED.timestamp())
+
+    def test_missing_and_naive_timestamps(self):
+        files = [
+            make_file("c/none.txt", created=None, modified=""),
+            make_file("c/naive.txt", modified="2024-05-01T10:00:00"),
+        ]
+        MetadataStore.save_listing(PUBLIC_KEY, PUBLIC_KEY, "c", False, files)
+        loaded = {f.name: f for f in MetadataStore.load_listing(PUBLIC_KEY, "c")[0]}
+        self.assertIsNone(loaded["none.txt"].created)
+        self.assertIsNone(loaded["none.txt"].modified)
+        self.assertEqual(loaded["naive.txt"].modified, "2024-05-01T10:00:00+00:00")
+
+    def test_restored_listing_is_not_seen_as_modified(self):
+        files = [
+            make_file("d/a.txt", modified="2024-05-01T13:00:00+03:00"),
+            make_file("d/b.txt", modified="2024-05-01T12:00:00+03:00"),
+        ]
+        MetadataStore.save_listing(PUBLIC_KEY, PUBLIC_KEY, "d", False, files)
+        stored, _, _ = MetadataStore.load_listing(PUBLIC_KEY, "d")
+        self.assertEqual(stored[0].modified, "2024-05-01T10:00:00+00:00")
+
+        # The folder has a new revision that none of its items explains
+        service = YandexDiskService()
+        with mock.patch.multiple(
+            service,
+            get_resource_validators=mock.Mock(return_value={"revision": 2, "total": 2}),
+            iter_public_resources=mock.Mock(return_value=iter(files)),
+            get_public_resources=mock.Mock(return_value=files),
+        ):
+            result, _ = service.revalidate_public_resources(
+                PUBLIC_KEY, stored, {"revision": 1, "total": 2}, "d"
+            )
+            service.get_public_resources.assert_called_once()
+        self.assertEqual(result, files)
+
+    def test_recursive_listing_reads_subtree(self):
+        everything = self.root + self.folder_a + self.folder_b
+        MetadataStore.save_listing(PUBLIC_KEY, PUBLIC_KEY, "", True, everything)
+        self.assertEqual(self.paths("", True), sorted(f.path for f in everything))
+
+        MetadataStore.save_listing(PUBLIC_KEY, PUBLIC_KEY, "a", True, self.folder_a)
+        self.assertEqual(self.paths("a", True), ["a/one.txt", "a/two.txt"])
+
+    def test_save_removes_vanished_entries_in_scope_only(self):
+        MetadataStore.save_listing(
+            PUBLIC_KEY, PUBLIC_KEY, "a", False, self.folder_a[:1]
+        )
+        self.assertEqual(self.paths("a"), ["a/one.txt"])
+        self.assertEqual(self.paths("b"), ["b/three.txt"])
+        self.assertEqual(self.paths(), ["a", "b", "top.txt"])
+
+    def test_public_keys_are_isolated(self):
+        other = "https://disk.yandex.ru/d/other"
+        MetadataStore.save_listing(other, other, "a", False, [])
+        self.assertEqual(self.paths("a", public_key=other), [])
+        self.assertEqual(self.paths("a"), ["a/one.txt", "a/two.txt"])
+        self.assertEqual(FileEntry.objects.filter(public_key=other).count(), 0)
+
+    def test_partial_listing_keeps_entries_and_expires(self):
+        MetadataStore.save_listing(
+            PUBLIC_KEY,
+            PUBLIC_KEY,
+            "a",
+            False,
+            [make_file("a/new.txt")],
+            {PARTIAL_LISTING: True},
+        )
+        _, validators, fetched_at = MetadataStore.load_listing(PUBLIC_KEY, "a")
+        self.assertEqual(self.paths("a"), ["a/new.txt", "a/one.txt", "a/two.txt"])
+        self.assertEqual(validators, {PARTIAL_LISTING: True})
+        self.assertEqual(fetched_at, EXPIRED.timestamp())
+
+    def test_touch_listing_refreshes_validators(self):
+        MetadataStore.touch_listing(PUBLIC_KEY, "/a", False, {"revision": 2})
+        _, validators, _ = MetadataStore.load_listing(PUBLIC_KEY, "a")
+        self.assertEqual(validators, {"revision": 2})
+
+
+class BlobKeyTests(SimpleTestCase):
+    def test_content_hash_wins(self):
+        by_sha = BlobCache.make_key(md5="AB", sha256="CD", public_key="k", path="p")
+        self.assertEqual(by_sha, BlobCache.make_key(sha256="cd"))
+        self.assertEqual(BlobCache.make_key(md5="AB"), BlobCache.make_key(md5="ab"))
+        self.assertNotEqual(BlobCache.make_key(md5="ab"), by_sha)
+
+    def test_resource_key_needs_key_path_and_revision(self):
+        self.assertIsNone(BlobCache.make_key())
+        self.assertIsNone(BlobCache.make_key(public_key="k", path="p"))
+        self.assertIsNone(BlobCache.make_key(public_key="k", revision="r"))
+        self.assertIsNotNone(BlobCache.make_key(public_key="k", path="p", revision="r"))
+
+    def test_resource_key_identifies_version(self):
+        key = BlobCache.make_key(public_key="k", path="/a/b", revision="1")
+        self.assertEqual(
+            key, BlobCache.make_key(public_key="k", path="a/b/", revision="1")
+        )
+        for other in (
+            {"public_key": "k2", "path": "a/b", "revision": "1"},
+            {"public_key": "k", "path": "a/c", "revision": "1"},
+            {"public_key": "k", "path": "a/b", "revision": "2"},
+        ):
+            with self.subTest(**other):
+                self.assertNotEqual(key, BlobCache.make_key(**other))
+
+    def test_view_key_ignores_spelling_of_public_key(self):
+        revision = {"modified": "1"}
+        key = _blob_key("https://disk.yandex.ru/d/abc", "/f.txt", revision)
+        self.assertIsNotNone(key)
+        self.assertEqual(
+            key, _blob_key("https://disk.yandex.ru/d/abc/", "f.txt", revision)
+        )
+        self.assertIsNone(_blob_key("https://disk.yandex.ru/d/abc", "f.txt", None))
+        self.assertIsNone(_blob_key(None, "f.txt", revision))
+
+    def test_view_key_prefers_content_hash(self):
+        revision = {"md5": "ABC", "modified": "1"}
+        self.assertEqual(
+            _blob_key("k", "a.txt", revision),
+            _blob_key("other", "b.txt", {"md5": "abc", "modified": "2"}),
+        )
+
+
+class BlobCacheTests(SimpleTestCase):
+    def setUp(self):
+        self.root = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.root)
+        self.cache = BlobCache(self.root, max_bytes=1024, max_file_size=100)
+
+    def store(self, key: str, data: bytes, expected_size=None) -> bool:
+        writer = self.cache.create(key, expected_size)
+        if writer is None:
+            return False
+        writer.write(data)
+        stored = writer.commit()
+        writer.close()
+        return stored
+
+    def test_round_trip(self):
+        key = BlobCache.make_key(sha256="00ff")
+        self.assertIsNone(self.cache.open(key))
+        self.assertTrue(self.store(key, b"0123456789"))
+        with self.cache.open(key) as blob:
+            self.assertEqual(blob.read(), b"0123456789")
+        self.assertEqual(os.listdir(self.cache.temp_dir), [])
+
+    def test_incomplete_and_oversized_blobs_are_discarded(self):
+        self.assertFalse(self.store("aa01", b"short", expected_size=10))
+        self.assertFalse(self.store("aa02", b"x" * 101))
+        self.assertIsNone(self.cache.create("aa03", expected_size=101))
+        self.assertIsNone(self.cache.open("aa01"))
+        self.assertIsNone(self.cache.open("aa02"))
+        self.assertEqual(os.listdir(self.cache.temp_dir), [])
+
+    def test_range_reads(self):
+        self.assertTrue(self.store("bb01", b"0123456789"))
+        blob_range = BlobRange(self.cache.open("bb01"), 2, 5)
+        self.assertEqual(blob_range.read(3), b"234")
+        self.assertEqual(blob_range.read(10), b"56")
+        self.assertEqual(blob_range.read(), b"")
+        blob_range.close()
+
+        blob_range = BlobRange(self.cache.open("bb01"), 7, 10)
+        self.assertEqual(blob_range.read(), b"789")
+        blob_range.close()
+
+    def test_eviction_keeps_budget(self):
+        for i in range(15):
+            self.assertTrue(self.store(f"cc{i:02d}", b"x" * 100))
+        self.cache.evict()
+        stored = sum(
+            1 for i in range(15) if os.path.exists(self.cache.path_for(f"cc{i:02d}"))
+        )
+        self.assertLessEqual(stored * 100, self.cache.max_bytes)
+
+
+class SingleFlightTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.flight = SingleFlight("test", timeout=2)
+
+    def run_concurrently(self, fetch, callers: int = 5):
+        """Call the flight from several threads once they have all joined."""
+        results, errors = [], []
+
+        def call():
+            try:
+                results.append(self.flight.do("key", fetch))
+            except Exception as e:
+                errors.append(e)
+
+        threads = [threading.Thread(target=call) for _ in range(callers)]
+        for thread in threads:
+            thread.start()
+        return threads, results, errors
+
+    def test_concurrent_calls_share_one_fetch(self):
+        release = threading.Event()
+        fetches = []
+
+        def fetch():
+            fetches.append(None)
+            release.wait(5)
+            return "value"
+
+        threads, results, errors = self.run_concurrently(fetch)
+        deadline = time.monotonic() + 5
+        while self.flight.coalesced < 4 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(len(fetches), 1)
+        self.assertEqual(results, ["value"] * 5)
+        self.assertEqual(errors, [])
+        self.assertEqual(self.flight.coalesced, 4)
+
+    def test_leader_failure_reaches_waiters_and_is_not_kept(self):
+        release = threading.Event()
+
+        def fetch():
+            release.wait(5)
+            raise RuntimeError("upstream failed")
+
+        threads, results, errors = self.run_concurrently(fetch, callers=3)
+        deadline = time.monotonic() + 5
+        while self.flight.coalesced < 2 and time.monotonic() < deadline:
+            time.sleep(0.01)
+        release.set()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(results, [])
+        self.assertEqual([str(e) for e in errors], ["upstream failed"] * 3)
+        self.assertEqual(self.flight.do("key", lambda: "retried"), "retried")
+
+    def test_waits_for_result_of_another_process(self):
+        cache.add(self.flight._lock_key("key"), True)
+        results = iter([None, None, "cached"])
+        fetch = mock.Mock(return_value="fetched")
+        self.assertEqual(self.flight.do("key", fetch, lambda: next(results)), "cached")
+        fetch.assert_not_called()
+        self.assertEqual(self.flight.coalesced, 1)
+
+    def test_fetches_when_other_process_gives_up(self):
+        lock_key = self.flight._lock_key("key")
+        cache.add(lock_key, True)
+
+        def check():
+            cache.delete(lock_key)
+            return None
+
+        self.assertEqual(self.flight.do("key", lambda: "fetched", check), "fetched")
+
+    def test_async_calls_share_one_fetch(self):
+        fetches = []
+
+        async def fetch():
+            fetches.append(None)
+            await asyncio.sleep(0.05)
+            return "value"
+
+        async def main():
+            return await asyncio.gather(
+                *(self.flight.ado("key", fetch) for _ in range(3))
+            )
+
+        self.assertEqual(asyncio.run(main()), ["value"] * 3)
+        self.assertEqual(len(fetches), 1)
+
+
+class RateLimiterTests(SimpleTestCase):
+    def setUp(self):
+        cache.clear()
+        self.limiter = AdaptiveRateLimiter(
+            "test", rate=8, min_rate=1, rate_step=1, max_concurrency=8
+        )
+        # Start in the middle of a window of the real clock
+        self.now = int(time.time()) + 0.5
+
+    def at(self, seconds: float):
+        """Freeze the limiter's clock ``seconds`` after the test start."""
+        return mock.patch.object(
+            rate_limiter.time, "time", return_value=self.now + seconds
+        )
+
+    def take(self, count: int) -> int:
+        """Try to take ``count`` tokens and return how many were granted."""
+        granted = 0
+        for _ in range(count):
+            if self.limiter.try_acquire():
+                granted += 1
+                self.limiter.release()
+        return granted
+
+    def test_window_grants_the_rate(self):
+        with self.at(0):
+            self.assertEqual(self.take(10), 8)
+
+    def test_window_edges_do_not_double_the_rate(self):
+        with self.at(0.45):
+            self.assertEqual(self.take(8), 8)
+        # Most of the previous window still falls into the last second
+        with self.at(0.6):
+            self.assertLessEqual(self.take(8), 1)
+        with self.at(1.2):
+            self.assertEqual(self.take(8), 5)
+        with self.at(2.5):
+            self.assertEqual(self.take(8), 8)
+
+    def test_throttling_halves_rate_and_concurrency(self):
+        with self.at(0):
+            self.limiter.record_response(429)
+            self.assertEqual(self.limiter.get_stats()["rate"], 4)
+            self.assertEqual(self.limiter.concurrency_limit, 4)
+            # The rate is halved once per window; slots on every response
+            self.limiter.record_response(503)
+            self.assertEqual(self.limiter.get_stats()["rate"], 4)
+            self.assertEqual(self.limiter.concurrency_limit, 2)
+        for second in range(1, 5):
+            with self.at(second):
+                self.limiter.record_response(429)
+        self.assertEqual(self.limiter.get_stats()["rate"], 1)
+        self.assertEqual(self.limiter.concurrency_limit, 1)
+
+    def test_success_grows_rate_and_concurrency(self):
+        with self.at(0):
+            self.limiter.record_response(429)
+            for _ in range(4):
+                self.limiter.record_response(200)
+            # One rate step per second, one slot per limit's worth of calls
+            self.assertEqual(self.limiter.get_stats()["rate"], 5)
+            self.assertEqual(self.limiter.concurrency_limit, 5)
+        with self.at(1):
+            self.limiter.record_response(200)
+            self.assertEqual(self.limiter.get_stats()["rate"], 6)
+        for second in range(2, 10):
+            with self.at(second):
+                self.limiter.record_response(200)
+        self.assertEqual(self.limiter.get_stats()["rate"], 8)
+
+    def test_retry_after_pauses_calls(self):
+        with self.at(0):
+            self.limiter.record_response(429, retry_after=2)
+            self.assertEqual(self.take(1), 0)
+        with self.at(1.5):
+            self.assertEqual(self.take(1), 0)
+        with self.at(2.5):
+            self.assertEqual(self.take(1), 1)
+
+    def test_pause_is_shared_between_processes(self):
+        other = AdaptiveRateLimiter("test", rate=8, max_concurrency=8)
+        with self.at(0):
+            other.record_response(429, retry_after=2)
+            self.assertEqual(self.take(1), 0)
+
+    def test_shared_state_is_read_once_per_ttl(self):
+        with self.at(0), mock.patch.object(
+            rate_limiter.cache, "get_many", wraps=rate_limiter.cache.get_many
+        ) as get_many:
+            self.take(5)
+            for _ in range(5):
+                self.limiter.record_response(200)
+        self.assertEqual(get_many.call_count, 1)
+
+    def test_concurrency_slots(self):
+        limiter = AdaptiveRateLimiter("slots", rate=100, max_concurrency=2)
+        self.assertTrue(limiter.try_acquire())
+        self.assertTrue(limiter.try_acquire())
+        self.assertFalse(limiter.try_acquire())
+        limiter.release()
+        self.assertTrue(limiter.try_acquire())
+
+
+@override_settings(YANDEX_DISK_HEDGE_REQUESTS=True)
+class HedgePolicyTests(SimpleTestCase):
+    def policy(self, ratio: float = 0.05) -> HedgePolicy:
+        """Return a policy that hedges calls slower than its fast warm-up."""
+        policy = HedgePolicy(percentile=50, ratio=ratio, min_delay=0.02)
+        for _ in range(MIN_SAMPLES):
+            policy.call("fast", lambda: None)
+        return policy
+
+    def test_calls_are_not_hedged_until_latencies_are_known(self):
+        policy = HedgePolicy(percentile=50, min_delay=0.001)
+        threads = []
+        for _ in range(MIN_SAMPLES):
+            policy.call("fast", lambda: threads.append(threading.current_thread()))
+        self.assertEqual(set(threads), {threading.current_thread()})
+        self.assertIsNotNone(policy.get_stats()["delays"]["fast"])
+        self.assertEqual(policy.get_stats()["hedged"], 0)
+
+    def test_hedge_wins_over_slow_call(self):
+        policy = self.policy()
+        release = threading.Event()
+        self.addCleanup(release.set)
+        copies = []
+
+        def fetch():
+            copies.append(None)
+            if len(copies) == 1:
+                release.wait(5)
+                return "primary"
+            return "hedge"
+
+        self.assertEqual(policy.call("fast", fetch), "hedge")
+        stats = policy.get_stats()
+        self.assertEqual((stats["hedged"], stats["hedge_wins"]), (1, 1))
+
+    def test_fast_call_is_not_hedged(self):
+        policy = self.policy()
+        self.assertEqual(policy.call("fast", lambda: 1), 1)
+        self.assertEqual(policy.get_stats()["hedged"], 0)
+
+    def test_failed_copy_yields_to_the_other(self):
+        policy = self.policy()
+        copies = []
+
+        def fetch():
+            copies.append(None)
+            if len(copies) == 1:
+                time.sleep(0.1)
+                raise RuntimeError("slow and failed")
+            raise ValueError("hedge failed")
+
+        with self.assertRaises(RuntimeError):
+            policy.call("fast", fetch)
+
+    def test_budget_limits_hedges(self):
+        policy = self.policy(ratio=0.01)
+        for _ in range(int(BUDGET_BURST) + 2):
+            policy.call("fast", lambda: time.sleep(0.05))
+        stats = policy.get_stats()
+        self.assertEqual(stats["hedged"], BUDGET_BURST)
+        self.assertEqual(stats["budget_exhausted"], 2)
+        self.assertLess(stats["budget"], 1)
+
+    def test_copies_share_a_bounded_pool(self):
+        policy = self.policy()
+        threads = set()
+
+        def fetch():
+            threads.add(threading.current_thread())
+            time.sleep(0.05)
+
+        for _ in range(10):
+            policy.call("fast", fetch)
+        self.assertEqual(policy.get_stats()["hedged"], 10)
+        self.assertLessEqual(len(threads), 4)
+        self.assertEqual(
+            policy._executor._max_workers, settings.YANDEX_DISK_API_MAX_CONCURRENCY
+        )
+
+    def test_async_hedge_wins_over_slow_call(self):
+        policy = self.policy()
+        copies = []
+
+        async def fetch():
+            copies.append(None)
+            if len(copies) == 1:
+                await asyncio.sleep(5)
+                return "primary"
+            return "hedge"
+
+        self.assertEqual(asyncio.run(policy.acall("fast", fetch)), "hedge")
+        self.assertEqual(policy.get_stats()["hedge_wins"], 1)
+
+
+class ArchiveJobTests(FakeServerMixin, TransactionTestCase):
+    """Archive jobs run by worker threads against a committed database."""
+
+    def setUp(self):
+        super().setUp()
+        job_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, job_dir)
+        overrides = override_settings(
+            YANDEX_DISK_ARCHIVE_JOB_DIR=job_dir,
+            YANDEX_DISK_ARCHIVE_JOB_CHECK_INTERVAL=3600,
+        )
+        overrides.enable()
+        self.addCleanup(overrides.disable)
+        self.job_dir = job_dir
+        self.queue = self.create_queue()
+        self.user = User.objects.create_user("owner", password="secret")
+        self.client.force_login(self.user)
+
+    def create_queue(self, entries=views._iter_selected_files) -> ArchiveJobQueue:
+        queue = ArchiveJobQueue(entries, views._download_chunks, workers=1)
+        patcher = mock.patch.object(views, "archive_jobs", queue)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.wait_idle, queue)
+        return queue
+
+    def wait_idle(self, queue: ArchiveJobQueue) -> None:
+        """Let a queue's workers finish before the test's data goes away."""
+        deadline = time.monotonic() + 10
+        while queue._active and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def selection(self):
+        return [
+            {"name": "file_0.bin", "public_key": PUBLIC_KEY, "path": "/file_0.bin"},
+            {
+                "name": "folder_1",
+                "public_key": PUBLIC_KEY,
+                "path": "/folder_1",
+                "type": "dir",
+            },
+        ]
+
+    def submit(self, files=None, client=None):
+        return (client or self.client).post(
+            reverse("disk:archive_job_create"),
+            json.dumps({"files": files or self.selection(), "format": "zip"}),
+            content_type="application/json",
+        )
+
+    def wait_for(self, job_id, timeout: float = 10) -> ArchiveJob:
+        """Wait until a job has finished or failed."""
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            job = ArchiveJob.objects.get(pk=job_id)
+            if job.status in (ArchiveJob.Status.DONE, ArchiveJob.Status.FAILED):
+                return job
+            time.sleep(0.05)
+        self.fail(f"Archive job {job_id} did not finish")
+
+    def test_job_lifecycle(self):
+        response = self.submit()
+        self.assertEqual(response.status_code, 202)
+        status = response.json()
+        self.assertEqual(status["status"], "pending")
+
+        job = self.wait_for(status["job_id"])
+        self.assertEqual(job.status, ArchiveJob.Status.DONE, job.error)
+        self.assertEqual(job.files_total, 1 + self.config.files)
+        self.assertEqual(job.files_done, job.files_total)
+        self.assertEqual(job.user, self.user)
+
+        status = self.client.get(status["status_url"]).json()
+        self.assertEqual(status["status"], "done")
+        self.assertEqual(status["bytes_done"], os.path.getsize(job.result_path))
+        response = self.client.get(status["download_url"])
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b"".join(response.streaming_content))) as zf:
+            self.assertEqual(zf.read("file_0.bin"), self.content("/file_0.bin"))
+            self.assertEqual(
+                len(zf.namelist()), 1 + len(self.server.tree.get("/folder_1").children)
+            )
+
+    def test_identical_selection_reuses_job(self):
+        first = self.submit().json()["job_id"]
+        self.assertEqual(self.submit().json()["job_id"], first)
+        job = self.wait_for(first)
+        self.assertEqual(self.submit().json()["job_id"], first)
+
+        # A finished job whose archive is gone is not reused
+        os.unlink(job.result_path)
+        self.assertNotEqual(self.submit().json()["job_id"], first)
+
+    def test_jobs_are_private(self):
+        status = self.submit().json()
+        self.wait_for(status["job_id"])
+
+        other = Client()
+        other.force_login(User.objects.create_user("other", password="secret"))
+        self.assertEqual(other.get(status["status_url"]).status_code, 404)
+        download_url = reverse("disk:archive_job_download", args=[status["job_id"]])
+        self.assertEqual(other.get(download_url).status_code, 404)
+        # The same selection of another user gets a job of its own
+        self.assertNotEqual(
+            self.submit(client=other).json()["job_id"], status["job_id"]
+        )
+
+    def test_anonymous_requests_are_refused(self):
+        status = self.submit().json()
+        anonymous = Client()
+        self.assertEqual(self.submit(client=anonymous).status_code, 302)
+        self.assertEqual(anonymous.get(status["status_url"]).status_code, 302)
+        self.assertEqual(ArchiveJob.objects.count(), 1)
+
+    def test_csrf_is_enforced(self):
+        client = Client(enforce_csrf_checks=True)
+        client.force_login(self.user)
+        self.assertEqual(self.submit(client=client).status_code, 403)
+        self.assertFalse(ArchiveJob.objects.exists())
+
+    def test_client_urls_are_refused(self):
+        files = [{"name": "x.bin", "url": "http://127.0.0.1:1/secret"}]
+        self.assertEqual(self.submit(files).status_code, 400)
+        self.assertFalse(ArchiveJob.objects.exists())
+
+    def test_failing_job_is_marked_failed(self):
+        def entries(files):
+            raise RuntimeError("listing failed")
+            yield
+
+        self.create_queue(entries)
+        job = self.wait_for(self.submit().json()["job_id"])
+        self.assertEqual(job.status, ArchiveJob.Status.FAILED)
+        self.assertEqual(job.error, "listing failed")
+        self.assertEqual(os.listdir(self.job_dir), [])
+
+    def test_interrupted_job_is_recovered(self):
+        stale = timezone.now() - timedelta(hours=1)
+        job = ArchiveJob.objects.create(
+            selection_hash="0" * 64,
+            archive_format="zip",
+            files=self.selection(),
+            user=self.user,
+            status=ArchiveJob.Status.RUNNING,
+            files_done=3,
+        )
+        ArchiveJob.objects.filter(pk=job.pk).update(updated_at=stale)
+
+        self.queue.check()
+        job = self.wait_for(job.pk)
+        self.assertEqual(job.status, ArchiveJob.Status.DONE, job.error)
+        self.assertEqual(job.files_done, 1 + self.config.files)
+
+    def test_running_job_is_left_alone(self):
+        job = ArchiveJob.objects.create(
+            selection_hash="0" * 64,
+            archive_format="zip",
+            files=self.selection(),
+            status=ArchiveJob.Status.RUNNING,
+        )
+        self.queue.check()
+        time.sleep(0.2)
+        self.assertEqual(
+            ArchiveJob.objects.get(pk=job.pk).status, ArchiveJob.Status.RUNNING
+        )
+
+    def test_check_removes_expired_jobs_and_stale_parts(self):
+        result_path = os.path.join(self.job_dir, "old.zip")
+        stale_part = os.path.join(self.job_dir, "lost.zip.1.2.part")
+        fresh_part = os.path.join(self.job_dir, "busy.zip.1.3.part")
+        for path in (result_path, stale_part, fresh_part):
+            open(path, "wb").close()
+        an_hour_ago = time.time() - 3600
+        os.utime(stale_part, (an_hour_ago, an_hour_ago))
+        expired = ArchiveJob.objects.create(
+            selection_hash="0" * 64,
+            archive_format="zip",
+            status=ArchiveJob.Status.DONE,
+            result_path=result_path,
+            expires_at=timezone.now() - timedelta(seconds=1),
+        )
+
+        # Submitting does not clean up; the periodic check does
+        self.submit()
+        self.assertTrue(ArchiveJob.objects.filter(pk=expired.pk).exists())
+        self.assertEqual(self.queue.check(), 1)
+        self.assertFalse(ArchiveJob.objects.filter(pk=expired.pk).exists())
+        self.assertFalse(os.path.exists(result_path))
+        self.assertFalse(os.path.exists(stale_part))
+        self.assertTrue(os.path.exists(fresh_part))
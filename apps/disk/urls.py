@@ -1,9 +1,42 @@
+from django.conf import settings
 from django.urls import path
-from apps.disk.views import FileListView, stream_file
+from apps.disk.views import (
+    AsyncFileListView,
+    FileListView,
+    api_stats,
+    archive_job_status,
+    cache_stats,
+    create_archive_job,
+    download_archive_job,
+    download_resource,
+    download_resource_async,
+    stream_file,
+    stream_file_async,
+)
 
 app_name = "disk"
 
-urlpatterns = [
-    path("", FileListView.as_view(), name="file_list"),
-    path("download_files/", stream_file, name="download_files"),
+if settings.YANDEX_DISK_ASYNC_VIEWS:
+    urlpatterns = [
+        path("", AsyncFileListView.as_view(), name="file_list"),
+        path("download_files/", stream_file_async, name="download_files"),
+        path("download/", download_resource_async, name="download_resource"),
+    ]
+else:
+    urlpatterns = [
+        path("", FileListView.as_view(), name="file_list"),
+        path("download_files/", stream_file, name="download_files"),
+        path("download/", download_resource, name="download_resource"),
+    ]
+
+urlpatterns += [
+    path("archive-jobs/", create_archive_job, name="archive_job_create"),
+    path("archive-jobs/<uuid:job_id>/", archive_job_status, name="archive_job_status"),
+    path(
+        "archive-jobs/<uuid:job_id>/download/",
+        download_archive_job,
+        name="archive_job_download",
+    ),
+    path("cache/stats/", cache_stats, name="cache_stats"),
+    path("api/stats/", api_stats, name="api_stats"),
 ]
@@ -4,33 +4,78 @@ import logging
 import json
 import os
 from datetime import datetime
-from typing import Dict, Any, List
-from io import BytesIO
-import zipfile
+from functools import partial
+from typing import Dict, Any, AsyncIterator, Iterator, List, Optional, Tuple
 
 from django.http import (
+    FileResponse,
     JsonResponse,
     StreamingHttpResponse,
     HttpResponseBadRequest,
     HttpResponse,
 )
 from django.views.generic import FormView
+from django.contrib.auth.decorators import login_required
 from django.contrib.auth.mixins import LoginRequiredMixin
+from django.contrib.auth.views import redirect_to_login
+from django.contrib.admin.views.decorators import staff_member_required
 from django.views.decorators.csrf import csrf_protect
+from django.views.decorators.http import require_POST
 from django.utils.decorators import method_decorator
 from django.core.exceptions import ValidationError
+from django.core.paginator import Paginator
 from django.shortcuts import render
+from django.urls import reverse
 from django.conf import settings
+from asgiref.sync import sync_to_async
 
+import httpx
 import requests
 
 from .forms import PublicLinkForm
+from .models import ArchiveJob
 from .services.disk_service import YandexDiskService, YandexDiskFile
-from .services.cache_service import CacheService
+from .services.async_disk_service import AsyncYandexDiskService
+from .services.archive_jobs import ArchiveJobQueue
+from .services.archive_service import (
+    ARCHIVE_FORMATS,
+    astream_archive,
+    stream_archive,
+)
+from .services.blob_cache import (
+    BlobCache,
+    BlobRange,
+    BlobWriter,
+    atee_to_blob,
+    get_blob_cache,
+    tee_to_blob,
+)
+from .services.cache_service import CachedListing, CacheService
+from .services.crawler_service import FolderCrawler
+from .services.listing_index import parse_sort
+from .services.metadata_store import PARTIAL_LISTING
+from .services.http_client import (
+    get_async_http_client,
+    get_http_session,
+    send_with_retries,
+)
+from .services.prefetch import ArchiveEntry, AsyncPrefetchPipeline, PrefetchPipeline
+from .services.hedging import api_hedging
+from .services.rate_limiter import api_limiter
 
 # Configure logging
 logger = logging.getLogger(__name__)
 
+# Client headers forwarded to the upstream download for partial requests
+RANGE_REQUEST_HEADERS = ["Range", "If-Range"]
+
+# Upstream headers passed through to the client when proxying a download
+PROXIED_RESPONSE_HEADERS = ["Content-Length", "Content-Range", "ETag", "Last-Modified"]
+
+# Selected files whose download links are resolved together when an archive
+# reaches them; links expire upstream, so they are not resolved further ahead
+LINK_BATCH_SIZE = 50
+
 
 class FileListView(LoginRequiredMixin, FormView):
     """
@@ -67,6 +112,7 @@ class FileListView(LoginRequiredMixin, FormView):
         initial = super().get_initial()
         initial["public_url"] = self.request.GET.get("public_url", "")
         initial["file_type"] = self.request.GET.get("file_type", "")
+        initial["recursive"] = self.request.GET.get("recursive") == "on"
         return initial
 
     def get_context_data(self, **kwargs) -> Dict[str, Any]:
@@ -74,9 +120,10 @@ class FileListView(LoginRequiredMixin, FormView):
         Prepare context data for template rendering.
 
         Handles:
-        - File fetching from Yandex.Disk
+        - File fetching from Yandex.Disk, optionally including subfolders
         - Caching results
-        - File filtering
+        - File filtering (``filter``), sorting (``sort``) and pagination
+          (``page``)
         - Error handling
 
         Returns:
@@ -84,35 +131,31 @@ class FileListView(LoginRequiredMixin, FormView):
         """
         context = super().get_context_data(**kwargs)
         public_url = self.request.GET.get("public_url")
-        file_type = self.request.GET.get("file_type")
+        file_type = self.request.GET.get("filter") or self.request.GET.get("file_type")
+        sort = self.request.GET.get("sort")
+        recursive = self.request.GET.get("recursive") == "on"
 
         if public_url:
             try:
-                # Generate cache key from URL and file type
-                cache_key = f"yandex_files_{public_url}_{file_type}"
+                listing = self.get_listing(public_url, recursive)
 
-                # Try to get cached results first
-                files = CacheService.get_cached_resources(cache_key)
-
-                if files is None:
-                    # Extract public key and fetch resources
-                    public_key = self.disk_service.extract_public_key(public_url)
-                    files = self.disk_service.get_public_resources(public_url)
-
-                    # Cache the full result set
-                    CacheService.cache_resources(public_key, "", files)
-
-                # Apply file type filter if specified
-                if file_type:
-                    files = [f for f in files if self._match_file_type(f, file_type)]
+                # Filter and sort through the listing's index, then
+                # materialize only the requested page
+                files = listing.index.select(listing.resources, file_type, sort)
+                sort_field, descending = parse_sort(sort)
+                paginator = Paginator(files, settings.YANDEX_DISK_BROWSER_PAGE_SIZE)
+                page = paginator.get_page(self.request.GET.get("page"))
 
                 # Update context with results
                 context.update(
                     {
-                        "files": files,
+                        "files": page.object_list,
+                        "page_obj": page,
                         "public_url": public_url,
-                        "total_files": len(files),
+                        "total_files": paginator.count,
                         "current_file_type": file_type,
+                        "current_sort": f"-{sort_field}" if descending else sort_field,
+                        "recursive": recursive,
                     }
                 )
 
@@ -125,43 +168,161 @@ class FileListView(LoginRequiredMixin, FormView):
 
         return context
 
-    def _match_file_type(self, file: YandexDiskFile, file_type: str) -> bool:
+    def get_listing(self, public_url: str, recursive: bool) -> CachedListing:
         """
-        Match file against specified type filter.
+        Get the unfiltered folder listing, from cache when possible.
+
+        Expired listings are served at once and refreshed in the background.
 
         Args:
-            file: YandexDiskFile object to check
-            file_type: Type to filter by
+            public_url: Yandex.Disk public URL
+            recursive: Include files in subfolders
 
         Returns:
-            bool: True if file matches filter
+            CachedListing with the files and their index
         """
-        if not file_type:
-            return True
-
-        mime_type = file.mime_type.lower()
-        type_filters = {
-            "document": [
-                "application/pdf",
-                "text/",
-                "application/msword",
-                "application/vnd.openxmlformats-officedocument",
-            ],
-            "image": ["image/"],
-            "video": ["video/"],
-            "audio": ["audio/"],
-            "archive": [
-                "application/zip",
-                "application/x-rar",
-                "application/x-7z",
-                "application/x-tar",
-                "application/x-gzip",
-            ],
-        }
-
-        return any(mime_type.startswith(t) for t in type_filters.get(file_type, []))
+        # Reject malformed URLs before they reach the cache
+        self.disk_service.extract_public_key(public_url)
 
+        listing = CacheService.get_cached_listing(
+            public_url,
+            recursive=recursive,
+            refresh=partial(self._refresh_files, public_url, recursive),
+        )
+        if listing is None:
+            listing = CacheService.fetch_listing(
+                public_url,
+                "",
+                recursive,
+                partial(self._fetch_files, public_url, recursive),
+            )
+
+        return listing
+
+    def _fetch_files(
+        self, public_url: str, recursive: bool
+    ) -> Tuple[List[YandexDiskFile], Dict[str, Any]]:
+        """
+        Fetch the folder listing from Yandex.Disk.
 
+        Returns:
+            Tuple of the files and their validators; a crawl that missed
+            part of the tree is marked with the PARTIAL_LISTING validator
+        """
+        if recursive:
+            crawler = FolderCrawler(self.disk_service)
+            files = [node.file for node in crawler.crawl(public_url)]
+            if not crawler.complete:
+                logger.warning(f"Crawl of {public_url} is incomplete")
+                return files, {PARTIAL_LISTING: True}
+            return files, {}
+        return self.disk_service.get_public_resources(public_url), {}
+
+    def _refresh_files(
+        self,
+        public_url: str,
+        recursive: bool,
+        files: List[YandexDiskFile],
+        validators: Dict[str, Any],
+    ) -> Tuple[List[YandexDiskFile], Dict[str, Any]]:
+        """
+        Bring a cached listing up to date.
+
+        Folder listings are revalidated and patched incrementally; recursive
+        listings are crawled again.
+        """
+        if recursive:
+            return self._fetch_files(public_url, recursive)
+        return self.disk_service.revalidate_public_resources(
+            public_url, files, validators
+        )
+
+
+class AsyncFileListView(FileListView):
+    """
+    FileListView for ASGI deployments.
+
+    The folder listing is fetched before the page is built, without holding
+    a worker thread while Yandex.Disk responds.
+    """
+
+    http_method_names = ["get", "head", "options"]
+
+    def __init__(self, **kwargs):
+        """Initialize view with the sync and async disk services."""
+        super().__init__(**kwargs)
+        self.async_disk_service = AsyncYandexDiskService()
+        self._listing: Optional[CachedListing] = None
+        self._listing_error: Optional[Exception] = None
+
+    async def dispatch(self, request, *args, **kwargs):
+        """Check authentication without blocking, then dispatch."""
+        user = await request.auser()
+        if not user.is_authenticated:
+            return redirect_to_login(
+                request.get_full_path(),
+                self.get_login_url(),
+                self.get_redirect_field_name(),
+            )
+        return await super(LoginRequiredMixin, self).dispatch(request, *args, **kwargs)
+
+    async def get(self, request, *args, **kwargs):
+        """Fetch the requested listing, then render the page."""
+        public_url = request.GET.get("public_url")
+        if public_url:
+            try:
+                self._listing = await self.aget_listing(
+                    public_url, request.GET.get("recursive") == "on"
+                )
+            except Exception as e:
+                # Reported by get_context_data like a sync fetch error
+                self._listing_error = e
+
+        return self.render_to_response(self.get_context_data())
+
+    def get_listing(self, public_url: str, recursive: bool) -> CachedListing:
+        """Return the listing fetched by get()."""
+        if self._listing_error:
+            raise self._listing_error
+        return self._listing
+
+    async def aget_listing(self, public_url: str, recursive: bool) -> CachedListing:
+        """
+        Get the unfiltered folder listing, from cache when possible.
+
+        Recursive listings and background refreshes use the thread-based
+        services in worker threads.
+
+        Args:
+            public_url: Yandex.Disk public URL
+            recursive: Include files in subfolders
+
+        Returns:
+            CachedListing with the files and their index
+        """
+        # Reject malformed URLs before they reach the cache
+        self.disk_service.extract_public_key(public_url)
+
+        listing = await sync_to_async(CacheService.get_cached_listing)(
+            public_url,
+            recursive=recursive,
+            refresh=partial(self._refresh_files, public_url, recursive),
+        )
+        if listing is not None:
+            return listing
+
+        async def fetch() -> Tuple[List[YandexDiskFile], Dict[str, Any]]:
+            if recursive:
+                return await sync_to_async(self._fetch_files, thread_sensitive=False)(
+                    public_url, recursive
+                )
+            files = await self.async_disk_service.get_public_resources(public_url)
+            return files, {}
+
+        return await CacheService.afetch_listing(public_url, "", recursive, fetch)
+
+
+@login_required
 @csrf_protect
 def stream_file(request) -> HttpResponse:
     """
@@ -190,6 +351,9 @@ def _handle_single_file(request) -> HttpResponse:
     """
     Handle single file download request.
 
+    The download URL comes from the client, so the file is proxied without
+    going through the blob cache.
+
     Args:
         request: HTTP request object
 
@@ -200,33 +364,93 @@ def _handle_single_file(request) -> HttpResponse:
     if not download_url:
         return HttpResponseBadRequest("Download URL is required")
 
+    return _stream_download(request, download_url)
+
+
+@login_required
+def download_resource(request) -> HttpResponse:
+    """
+    Resolve a file's download link on demand and stream the file.
+
+    Listings only carry the public key and path of each file; the
+    download link is looked up here, when the download actually starts.
+    When the blob cache is enabled, the file's revision is looked up first
+    and cached files are served from disk without resolving a link.
+
+    Args:
+        request: HTTP request object with ``public_key`` and ``path``
+
+    Returns:
+        StreamingHttpResponse for file download
+    """
+    public_key = request.GET.get("public_key")
+    path = request.GET.get("path")
+    if not public_key or not path:
+        return HttpResponseBadRequest("Public key and path are required")
+
+    disk_service = YandexDiskService()
+    blob_key = _resource_blob_key(public_key, path, disk_service)
+    cached = _serve_blob(request, blob_key, path)
+    if cached is not None:
+        return cached
+
     try:
-        # Request file with streaming enabled
-        response = requests.get(download_url, stream=True)
-        response.raise_for_status()
+        download_url = CacheService.get_download_link(
+            public_key, _normalize_path(path), disk_service.get_download_link
+        )
+    except Exception as e:
+        logger.error(f"Error resolving download link for {path}: {e}")
+        download_url = None
+
+    if not download_url:
+        return JsonResponse(
+            {"error": "Failed to resolve download link. Please try again."},
+            status=502,
+        )
+
+    return _stream_download(request, download_url, blob_key)
+
+
+def _stream_download(
+    request, download_url: str, blob_key: Optional[str] = None
+) -> HttpResponse:
+    """
+    Proxy a file from its direct download URL.
 
-        # Extract filename from headers
-        content_disposition = response.headers.get("Content-Disposition", "")
-        filename = None
-        if "filename=" in content_disposition:
-            filename = content_disposition.split("filename=")[-1].strip('"')
-        if not filename:
-            filename = "download"
-
-        # Create streaming response
-        streaming_response = StreamingHttpResponse(
-            response.iter_content(chunk_size=8192),
-            content_type=response.headers.get(
-                "Content-Type", "application/octet-stream"
-            ),
+    ``Range`` and ``If-Range`` request headers are forwarded upstream, so
+    interrupted downloads can resume, media players can seek and download
+    managers can fetch several ranges in parallel. Complete downloads are
+    written to the blob cache under ``blob_key`` as they are relayed.
+
+    Args:
+        request: HTTP request object
+        download_url: Direct download URL
+        blob_key: Blob cache key of the file, if known
+
+    Returns:
+        StreamingHttpResponse for file download, with status 206 for
+        partial content
+    """
+    try:
+        # Request file with streaming enabled
+        response = get_http_session().get(
+            download_url, headers=_get_upstream_headers(request), stream=True
         )
 
-        # Set headers for download
-        streaming_response["Content-Disposition"] = f'attachment; filename="{filename}"'
-        if "Content-Length" in response.headers:
-            streaming_response["Content-Length"] = response.headers["Content-Length"]
+        if response.status_code == 416:
+            response.close()
+            return _range_not_satisfiable(response.headers)
 
-        return streaming_response
+        response.raise_for_status()
+
+        content = response.iter_content(chunk_size=8192)
+        writer = _create_blob_writer(blob_key, response.status_code, response.headers)
+        if writer is not None:
+            content = tee_to_blob(content, writer)
+
+        return _create_download_response(
+            content, response.status_code, response.headers
+        )
 
     except requests.RequestException as e:
         logger.error(f"Error streaming file: {e}")
@@ -235,67 +459,478 @@ def _handle_single_file(request) -> HttpResponse:
         )
 
 
+def _get_upstream_headers(request) -> Dict[str, str]:
+    """Build the upstream request headers for a proxied download."""
+    # Ask for the bytes as stored so ranges and lengths match the file
+    upstream_headers = {"Accept-Encoding": "identity"}
+    for header in RANGE_REQUEST_HEADERS:
+        value = request.headers.get(header)
+        if value:
+            upstream_headers[header] = value
+    return upstream_headers
+
+
+def _blob_key(
+    public_key: Optional[str],
+    path: Optional[str],
+    revision: Optional[Dict[str, Any]],
+) -> Optional[str]:
+    """
+    Build the blob cache key of a file version.
+
+    Only use it for files whose download link the server resolves itself
+    from the same public key and path, with a revision read from the API,
+    so a client cannot store the content of one file under the key of
+    another.
+
+    Args:
+        public_key: Yandex.Disk public URL or key
+        path: File path inside the public resource
+        revision: The file's ``md5``, ``sha256`` and ``modified`` fields as
+            returned by the API; any of them may be missing
+
+    Returns:
+        Blob key, or None if the arguments do not identify a file version
+    """
+    revision = revision or {}
+    return BlobCache.make_key(
+        md5=revision.get("md5"),
+        sha256=revision.get("sha256"),
+        public_key=(
+            CacheService.normalize_public_key(public_key) if public_key else None
+        ),
+        path=path,
+        revision=revision.get("modified"),
+    )
+
+
+def _resource_blob_key(
+    public_key: str, path: str, disk_service: YandexDiskService
+) -> Optional[str]:
+    """
+    Look up the current revision of a file and return its blob key.
+
+    Returns:
+        Blob key, or None if the blob cache is disabled or the revision
+        could not be fetched
+    """
+    if get_blob_cache() is None:
+        return None
+    try:
+        revision = CacheService.get_file_revision(
+            public_key, _normalize_path(path), disk_service.get_file_revision
+        )
+    except Exception as e:
+        logger.error(f"Error fetching revision of {path}: {e}")
+        return None
+    return _blob_key(public_key, path, revision)
+
+
+def _serve_blob(
+    request, blob_key: Optional[str], filename: str
+) -> Optional[HttpResponse]:
+    """
+    Serve a file from the blob cache.
+
+    Args:
+        request: HTTP request object
+        blob_key: Blob cache key of the file
+        filename: Name or path of the file
+
+    Returns:
+        FileResponse, or None if the file is not cached
+    """
+    blob_cache = get_blob_cache()
+    if blob_cache is None or not blob_key:
+        return None
+    blob = blob_cache.open(blob_key)
+    if blob is None:
+        return None
+    return _create_file_response(
+        request, blob, f'"{blob_key}"', _sanitize_filename(filename or "download")
+    )
+
+
+def _create_file_response(
+    request, file, etag: str, filename: str, content_type: Optional[str] = None
+) -> HttpResponse:
+    """
+    Create the response for a file stored on local disk.
+
+    A single ``Range`` is served from the file; ``If-Range`` is honoured
+    against ``etag``. Responses are FileResponse objects, so the server can
+    send the file with sendfile.
+
+    Args:
+        request: HTTP request object
+        file: File opened for binary reading, closed with the response
+        etag: Quoted entity tag of the file
+        filename: Attachment file name
+        content_type: Content type, guessed from the file name by default
+
+    Returns:
+        FileResponse with status 200 or 206, or a 416 response
+    """
+    size = os.fstat(file.fileno()).st_size
+    range_header = request.headers.get("Range")
+    if request.headers.get("If-Range", etag) != etag:
+        range_header = None
+    try:
+        byte_range = _parse_byte_range(range_header, size)
+    except ValueError:
+        file.close()
+        not_satisfiable = HttpResponse(status=416)
+        not_satisfiable["Content-Range"] = f"bytes */{size}"
+        return not_satisfiable
+
+    if byte_range is None:
+        response = FileResponse(
+            file, as_attachment=True, filename=filename, content_type=content_type
+        )
+    else:
+        start, end = byte_range
+        if end == size - 1:
+            # A seeked file keeps sendfile support
+            file.seek(start)
+            content = file
+        else:
+            content = BlobRange(file, start, end - start + 1)
+        response = FileResponse(
+            content,
+            status=206,
+            as_attachment=True,
+            filename=filename,
+            content_type=content_type,
+        )
+        response["Content-Length"] = end - start + 1
+        response["Content-Range"] = f"bytes {start}-{end}/{size}"
+
+    response["Accept-Ranges"] = "bytes"
+    response["ETag"] = etag
+    return response
+
+
+def _parse_byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """
+    Parse a single-range ``Range`` header.
+
+    Args:
+        header: Range header value
+        size: Size of the file
+
+    Returns:
+        Inclusive start and end offsets, or None to serve the whole file
+        when the header is absent, malformed or asks for several ranges
+
+    Raises:
+        ValueError: If the range starts past the end of the file
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes=") :].strip().partition("-")
+    if not (first + last).isdigit():
+        return None
+
+    if first:
+        start = int(first)
+        end = min(int(last), size - 1) if last else size - 1
+        if last and int(last) < start:
+            return None
+    else:
+        start = max(size - int(last), 0) if int(last) else size
+        end = size - 1
+
+    if start >= size:
+        raise ValueError("Range not satisfiable")
+    return start, end
+
+
+def _create_blob_writer(
+    blob_key: Optional[str], upstream_status: int, upstream_headers
+) -> Optional[BlobWriter]:
+    """Start caching a proxied download if it is a complete file."""
+    blob_cache = get_blob_cache()
+    if blob_cache is None or not blob_key or upstream_status != 200:
+        return None
+    length = upstream_headers.get("Content-Length", "")
+    return blob_cache.create(blob_key, int(length) if length.isdigit() else None)
+
+
+def _range_not_satisfiable(upstream_headers) -> HttpResponse:
+    """Relay an upstream 416 response."""
+    not_satisfiable = HttpResponse(status=416)
+    if "Content-Range" in upstream_headers:
+        not_satisfiable["Content-Range"] = upstream_headers["Content-Range"]
+    return not_satisfiable
+
+
+def _create_download_response(
+    content, upstream_status: int, upstream_headers
+) -> StreamingHttpResponse:
+    """
+    Create the client response for a proxied download.
+
+    Args:
+        content: Sync or async iterator over the file content
+        upstream_status: Status code of the upstream response
+        upstream_headers: Headers of the upstream response
+
+    Returns:
+        StreamingHttpResponse with download headers set
+    """
+    # Extract filename from headers
+    content_disposition = upstream_headers.get("Content-Disposition", "")
+    filename = None
+    if "filename=" in content_disposition:
+        filename = content_disposition.split("filename=")[-1].strip('"')
+    if not filename:
+        filename = "download"
+
+    # Create streaming response
+    streaming_response = StreamingHttpResponse(
+        content,
+        content_type=upstream_headers.get("Content-Type", "application/octet-stream"),
+        status=206 if upstream_status == 206 else 200,
+    )
+
+    # Set headers for download
+    streaming_response["Content-Disposition"] = f'attachment; filename="{filename}"'
+    streaming_response["Accept-Ranges"] = upstream_headers.get("Accept-Ranges", "bytes")
+    for header in PROXIED_RESPONSE_HEADERS:
+        if header in upstream_headers:
+            streaming_response[header] = upstream_headers[header]
+
+    return streaming_response
+
+
 def _handle_multiple_files(request) -> HttpResponse:
     """
     Handle multiple file download request.
 
-    Creates a ZIP archive containing all requested files.
+    Streams a ZIP, tar or tar.gz archive (``format`` in the request body)
+    containing all requested files. Upcoming files are downloaded
+    concurrently into bounded buffers, so memory use does not depend on
+    the archive size.
 
     Args:
         request: HTTP request object
 
     Returns:
-        HttpResponse with ZIP file
+        StreamingHttpResponse with the archive
+    """
+    try:
+        files, archive_format = _parse_archive_request(request)
+
+        # Download upcoming files concurrently while the archive is written
+        pipeline = PrefetchPipeline(_download_chunks, blob_cache=get_blob_cache())
+        return _create_archive_response(
+            stream_archive(pipeline.run(_iter_selected_files(files)), archive_format),
+            archive_format,
+        )
+
+    except ValidationError as e:
+        return HttpResponseBadRequest(e.message)
+    except Exception as e:
+        logger.error(f"Error creating archive: {e}")
+        return JsonResponse(
+            {"error": "Failed to create archive. Please try again."}, status=500
+        )
+
+
+def _parse_archive_request(request) -> Tuple[List[Dict[str, Any]], str]:
+    """
+    Read the selected files and archive format from a bulk download request.
+
+    Returns:
+        Tuple of selected files and archive format
+
+    Raises:
+        ValidationError: If the request body is invalid
     """
+    # Parse request data
     try:
-        # Parse request data
         data = json.loads(request.body)
-        files = data.get("files", [])
+    except json.JSONDecodeError as e:
+        logger.error(f"Invalid JSON in request: {e}")
+        raise ValidationError("Invalid request format")
 
-        if not files:
-            return HttpResponseBadRequest("No files selected")
+    files = data.get("files", [])
+    if not files:
+        raise ValidationError("No files selected")
 
-        # Create ZIP file in memory
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        zip_filename = f"yandex_files_{timestamp}.zip"
+    archive_format = data.get("format", "zip")
+    if archive_format not in ARCHIVE_FORMATS:
+        raise ValidationError("Unsupported archive format")
 
-        zip_buffer = BytesIO()
-        with zipfile.ZipFile(zip_buffer, "w", zipfile.ZIP_DEFLATED) as zip_file:
-            for file_info in files:
-                try:
-                    # Download and add each file to ZIP
-                    response = requests.get(file_info["url"], stream=True)
-                    response.raise_for_status()
+    return files, archive_format
 
-                    # Ensure valid filename
-                    safe_filename = _sanitize_filename(file_info["name"])
 
-                    # Write file content to ZIP
-                    zip_file.writestr(safe_filename, response.content)
+def _create_archive_response(content, archive_format: str) -> StreamingHttpResponse:
+    """Create the streaming response for an archive of the given format."""
+    extension, content_type = ARCHIVE_FORMATS[archive_format]
 
-                except Exception as e:
-                    logger.error(f"Error processing file {file_info.get('name')}: {e}")
-                    # Continue with other files if one fails
+    timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+    archive_filename = f"yandex_files_{timestamp}{extension}"
 
-        # Prepare response
-        zip_buffer.seek(0)
-        response = HttpResponse(zip_buffer.getvalue(), content_type="application/zip")
-        response["Content-Disposition"] = f'attachment; filename="{zip_filename}"'
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response["Content-Disposition"] = f'attachment; filename="{archive_filename}"'
+    return response
 
-        # Optional: Set content length if buffer size is manageable
-        if zip_buffer.tell() < settings.MAX_ZIPFILE_SIZE:
-            response["Content-Length"] = zip_buffer.tell()
 
-        return response
+def _download_chunks(download_url: str) -> Iterator[bytes]:
+    """Stream the content of a direct download URL."""
+    with get_http_session().get(download_url, stream=True) as response:
+        response.raise_for_status()
+        yield from response.iter_content(chunk_size=64 * 1024)
 
-    except json.JSONDecodeError as e:
-        logger.error(f"Invalid JSON in request: {e}")
-        return HttpResponseBadRequest("Invalid request format")
-    except Exception as e:
-        logger.error(f"Error creating ZIP archive: {e}")
-        return JsonResponse(
-            {"error": "Failed to create ZIP archive. Please try again."}, status=500
+
+def _iter_selected_files(files: List[Dict[str, Any]]) -> Iterator[ArchiveEntry]:
+    """
+    Yield archive names, download URLs and blob keys for the selected files.
+
+    Selected folders are expanded page by page as the archive is written,
+    so large folders are never listed in full up front. Links of selected
+    files are resolved in batches of LINK_BATCH_SIZE as they are reached.
+
+    Args:
+        files: Selected files from the request body
+
+    Yields:
+        Tuples of sanitized archive name, download URL and blob cache key
+    """
+    batch: List[Dict[str, Any]] = []
+    for file_info in files:
+        if file_info.get("type") == "dir":
+            yield from _iter_file_batch(batch)
+            batch = []
+            yield from _iter_folder_files(file_info)
+        else:
+            batch.append(file_info)
+            if len(batch) >= LINK_BATCH_SIZE:
+                yield from _iter_file_batch(batch)
+                batch = []
+    yield from _iter_file_batch(batch)
+
+
+def _iter_file_batch(files: List[Dict[str, Any]]) -> Iterator[ArchiveEntry]:
+    """Resolve the links of selected files and yield their archive entries."""
+    # Files are cached only when the server resolves their link itself
+    blob_keys = _resolve_blob_keys(files)
+    _resolve_file_urls(files)
+    for file_info, blob_key in zip(files, blob_keys):
+        archive_name = _sanitize_archive_path(file_info.get("name", ""))
+        yield archive_name, file_info.get("url"), blob_key
+
+
+def _iter_folder_files(folder_info: Dict[str, Any]) -> Iterator[ArchiveEntry]:
+    """
+    Yield archive entries for all files below a selected folder.
+
+    Subfolders are crawled breadth-first and files are yielded as their
+    folders are listed.
+
+    Args:
+        folder_info: Selected folder with ``public_key``, ``path`` and ``name``
+
+    Yields:
+        Tuples of archive name, relative to the folder's parent, download URL
+        and blob cache key
+    """
+    public_key = folder_info.get("public_key")
+    if not public_key:
+        return
+
+    folder_name = _sanitize_filename(folder_info.get("name", ""))
+    folder_path = folder_info.get("path", "").strip("/")
+    disk_service = YandexDiskService()
+    crawler = FolderCrawler(disk_service)
+    try:
+        for node in crawler.crawl(public_key, folder_path):
+            if node.file.type != "file":
+                continue
+            relative_path = node.file.path[len(folder_path) :].lstrip("/")
+            download_url = CacheService.get_download_link(
+                public_key,
+                _normalize_path(node.file.path),
+                disk_service.get_download_link,
+            )
+            blob_key = _blob_key(
+                public_key, node.file.path, {"modified": node.file.modified}
+            )
+            yield (
+                _sanitize_archive_path(f"{folder_name}/{relative_path}"),
+                download_url,
+                blob_key,
+            )
+    except RuntimeError as e:
+        logger.error(f"Error listing folder {folder_name}: {e}")
+
+
+def _resolve_file_urls(files: List[Dict[str, Any]]) -> None:
+    """
+    Fill in download URLs for selected files given by public key and path.
+
+    Files from the same folder are resolved in one batch; files that
+    already carry a ``url`` are left untouched.
+
+    Args:
+        files: Selected files from the request body
+    """
+    pending: Dict[str, List[Dict[str, Any]]] = {}
+    for file_info in files:
+        if not file_info.get("url") and file_info.get("public_key"):
+            pending.setdefault(file_info["public_key"], []).append(file_info)
+
+    if not pending:
+        return
+
+    disk_service = YandexDiskService()
+    for public_key, folder_files in pending.items():
+        paths = [_normalize_path(f.get("path", "")) for f in folder_files]
+        links = CacheService.get_download_links(
+            public_key, paths, disk_service.resolve_download_links
         )
+        for file_info, link in zip(folder_files, links):
+            file_info["url"] = link
+
+
+def _resolve_blob_keys(files: List[Dict[str, Any]]) -> List[Optional[str]]:
+    """
+    Look up the revisions of selected files and return their blob keys.
+
+    Files that carry a client-supplied ``url`` get no key, as their content
+    is not known to match the public key and path they name.
+
+    Args:
+        files: Selected files from the request body
+
+    Returns:
+        Blob keys in the same order as ``files``; all None if the blob
+        cache is disabled
+    """
+    blob_keys: List[Optional[str]] = [None] * len(files)
+    if get_blob_cache() is None:
+        return blob_keys
+
+    pending: Dict[str, List[int]] = {}
+    for i, file_info in enumerate(files):
+        if not file_info.get("url") and file_info.get("public_key"):
+            pending.setdefault(file_info["public_key"], []).append(i)
+
+    disk_service = YandexDiskService()
+    for public_key, indexes in pending.items():
+        paths = [_normalize_path(files[i].get("path", "")) for i in indexes]
+        revisions = CacheService.get_file_revisions(
+            public_key, paths, disk_service.resolve_file_revisions
+        )
+        for i, path, revision in zip(indexes, paths, revisions):
+            blob_keys[i] = _blob_key(public_key, path, revision)
+    return blob_keys
+
+
+def _normalize_path(path: str) -> str:
+    """Return a resource path in the absolute form expected by the API."""
+    return "/" + path.lstrip("/")
 
 
 def _sanitize_filename(filename: str) -> str:
@@ -323,6 +958,364 @@ def _sanitize_filename(filename: str) -> str:
     return filename
 
 
+def _sanitize_archive_path(path: str) -> str:
+    """
+    Sanitize a relative archive path, keeping its folder structure.
+
+    Args:
+        path: Original relative path
+
+    Returns:
+        str: Path with sanitized components and no traversal segments
+    """
+    parts = [
+        _sanitize_filename(part)
+        for part in path.replace("\\", "/").split("/")
+        if part not in ("", ".", "..")
+    ]
+    return "/".join(parts) or "unnamed_file"
+
+
+@login_required
+@csrf_protect
+async def stream_file_async(request) -> HttpResponse:
+    """
+    Async variant of stream_file for ASGI deployments.
+
+    Upstream downloads run on the event loop, so a single worker can serve
+    many slow downloads at once.
+
+    Methods:
+        GET: Handle single file download
+        POST: Handle multiple file download (creates an archive)
+
+    Returns:
+        HttpResponse with appropriate content and headers
+    """
+    if request.method == "POST":
+        return await _ahandle_multiple_files(request)
+    else:
+        return await _ahandle_single_file(request)
+
+
+async def _ahandle_single_file(request) -> HttpResponse:
+    """
+    Handle single file download request without blocking.
+
+    Args:
+        request: HTTP request object
+
+    Returns:
+        StreamingHttpResponse for file download
+    """
+    download_url = request.GET.get("download_url")
+    if not download_url:
+        return HttpResponseBadRequest("Download URL is required")
+
+    return await _astream_download(request, download_url)
+
+
+@login_required
+async def download_resource_async(request) -> HttpResponse:
+    """
+    Async variant of download_resource for ASGI deployments.
+
+    Args:
+        request: HTTP request object with ``public_key`` and ``path``
+
+    Returns:
+        StreamingHttpResponse for file download
+    """
+    public_key = request.GET.get("public_key")
+    path = request.GET.get("path")
+    if not public_key or not path:
+        return HttpResponseBadRequest("Public key and path are required")
+
+    disk_service = AsyncYandexDiskService()
+    blob_key = await _aresource_blob_key(public_key, path, disk_service)
+    cached = _serve_blob(request, blob_key, path)
+    if cached is not None:
+        return cached
+
+    try:
+        download_url = await CacheService.aget_download_link(
+            public_key, _normalize_path(path), disk_service.get_download_link
+        )
+    except Exception as e:
+        logger.error(f"Error resolving download link for {path}: {e}")
+        download_url = None
+
+    if not download_url:
+        return JsonResponse(
+            {"error": "Failed to resolve download link. Please try again."},
+            status=502,
+        )
+
+    return await _astream_download(request, download_url, blob_key)
+
+
+async def _aresource_blob_key(
+    public_key: str, path: str, disk_service: AsyncYandexDiskService
+) -> Optional[str]:
+    """Async variant of _resource_blob_key."""
+    if get_blob_cache() is None:
+        return None
+    try:
+        revision = await CacheService.aget_file_revision(
+            public_key, _normalize_path(path), disk_service.get_file_revision
+        )
+    except Exception as e:
+        logger.error(f"Error fetching revision of {path}: {e}")
+        return None
+    return _blob_key(public_key, path, revision)
+
+
+async def _astream_download(
+    request, download_url: str, blob_key: Optional[str] = None
+) -> HttpResponse:
+    """
+    Proxy a file from its direct download URL without blocking.
+
+    Same behaviour as _stream_download, including ``Range`` support and
+    blob caching.
+
+    Args:
+        request: HTTP request object
+        download_url: Direct download URL
+        blob_key: Blob cache key of the file, if known
+
+    Returns:
+        StreamingHttpResponse for file download, with status 206 for
+        partial content
+    """
+    client = get_async_http_client()
+    upstream = client.build_request(
+        "GET", download_url, headers=_get_upstream_headers(request)
+    )
+
+    try:
+        response = await send_with_retries(client, upstream, stream=True)
+    except httpx.HTTPError as e:
+        logger.error(f"Error streaming file: {e}")
+        return JsonResponse(
+            {"error": "Failed to download file. Please try again."}, status=500
+        )
+
+    if response.status_code == 416:
+        await response.aclose()
+        return _range_not_satisfiable(response.headers)
+
+    if response.is_error:
+        await response.aclose()
+        logger.error(f"Error streaming file: upstream returned {response.status_code}")
+        return JsonResponse(
+            {"error": "Failed to download file. Please try again."}, status=500
+        )
+
+    content = _aiter_response(response)
+    writer = _create_blob_writer(blob_key, response.status_code, response.headers)
+    if writer is not None:
+        content = atee_to_blob(content, writer)
+
+    return _create_download_response(content, response.status_code, response.headers)
+
+
+async def _aiter_response(response: httpx.Response) -> AsyncIterator[bytes]:
+    """Relay an upstream response body, closing it when the client is done."""
+    try:
+        async for chunk in response.aiter_bytes(chunk_size=64 * 1024):
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+async def _ahandle_multiple_files(request) -> HttpResponse:
+    """
+    Handle multiple file download request without blocking.
+
+    Selected folders are listed and links resolved in a worker thread as
+    the archive reaches them; files are downloaded on the event loop while
+    the archive is written.
+
+    Args:
+        request: HTTP request object
+
+    Returns:
+        StreamingHttpResponse with the archive
+    """
+    try:
+        files, archive_format = _parse_archive_request(request)
+
+        entries = _aiter_selected_files(files)
+        pipeline = AsyncPrefetchPipeline(_adownload_chunks, blob_cache=get_blob_cache())
+        return _create_archive_response(
+            astream_archive(pipeline.run(entries), archive_format), archive_format
+        )
+
+    except ValidationError as e:
+        return HttpResponseBadRequest(e.message)
+    except Exception as e:
+        logger.error(f"Error creating archive: {e}")
+        return JsonResponse(
+            {"error": "Failed to create archive. Please try again."}, status=500
+        )
+
+
+async def _aiter_selected_files(
+    files: List[Dict[str, Any]]
+) -> AsyncIterator[ArchiveEntry]:
+    """
+    Yield the entries of _iter_selected_files without blocking the loop.
+
+    Each entry is pulled in a worker thread when the archive needs it, so
+    the first bytes go out before large folders are listed in full. The
+    request's sync thread is used, keeping the walk and its database
+    connection on one thread.
+    """
+    entries = _iter_selected_files(files)
+    next_entry = sync_to_async(next)
+    try:
+        while True:
+            entry = await next_entry(entries, None)
+            if entry is None:
+                return
+            yield entry
+    finally:
+        await sync_to_async(entries.close)()
+
+
+async def _adownload_chunks(download_url: str) -> AsyncIterator[bytes]:
+    """Stream the content of a direct download URL asynchronously."""
+    client = get_async_http_client()
+    request = client.build_request("GET", download_url)
+    response = await send_with_retries(client, request, stream=True)
+    try:
+        response.raise_for_status()
+        async for chunk in response.aiter_bytes(chunk_size=64 * 1024):
+            yield chunk
+    finally:
+        await response.aclose()
+
+
+archive_jobs = ArchiveJobQueue(_iter_selected_files, _download_chunks)
+
+
+@login_required
+@csrf_protect
+@require_POST
+def create_archive_job(request) -> JsonResponse:
+    """
+    Queue a bulk download archive to be built in the background.
+
+    Takes the same request body as a POST to stream_file, except that files
+    are given by public key and path only: the job resolves every download
+    link itself and never fetches a URL from the request. Identical
+    selections of the same user share one job.
+
+    Returns:
+        JsonResponse with the job status and status URL, status 202
+    """
+    try:
+        files, archive_format = _parse_archive_request(request)
+    except ValidationError as e:
+        return HttpResponseBadRequest(e.message)
+    if any(not isinstance(f, dict) or f.get("url") for f in files):
+        return HttpResponseBadRequest("Files must be given by public key and path")
+
+    job = archive_jobs.submit(files, archive_format, request.user)
+    return JsonResponse(_archive_job_status(job), status=202)
+
+
+@login_required
+def archive_job_status(request, job_id) -> JsonResponse:
+    """
+    Report the progress of an archive job.
+
+    Returns:
+        JsonResponse with status, file and byte counts, and the download
+        URL once the archive is ready
+    """
+    job = archive_jobs.get(job_id, request.user)
+    if job is None:
+        return JsonResponse({"error": "Archive job not found"}, status=404)
+    return JsonResponse(_archive_job_status(job))
+
+
+@login_required
+def download_archive_job(request, job_id) -> HttpResponse:
+    """
+    Serve the archive built by a finished job.
+
+    Returns:
+        FileResponse with the archive, supporting ``Range`` requests
+    """
+    job = archive_jobs.get(job_id, request.user)
+    if job is None:
+        return JsonResponse({"error": "Archive job not found"}, status=404)
+    if job.status != ArchiveJob.Status.DONE:
+        return JsonResponse({"error": "Archive is not ready"}, status=409)
+
+    try:
+        archive = open(job.result_path, "rb")
+    except FileNotFoundError:
+        return JsonResponse({"error": "Archive job not found"}, status=404)
+
+    extension, content_type = ARCHIVE_FORMATS[job.archive_format]
+    timestamp = job.created_at.strftime("%Y%m%d_%H%M%S")
+    return _create_file_response(
+        request,
+        archive,
+        f'"{job.pk}"',
+        f"yandex_files_{timestamp}{extension}",
+        content_type,
+    )
+
+
+def _archive_job_status(job: ArchiveJob) -> Dict[str, Any]:
+    """Build the JSON status of an archive job."""
+    status = {
+        "job_id": str(job.pk),
+        "status": job.status,
+        "format": job.archive_format,
+        "files_total": job.files_total,
+        "files_done": job.files_done,
+        "bytes_done": job.bytes_done,
+        "status_url": reverse("disk:archive_job_status", args=[job.pk]),
+    }
+    if job.status == ArchiveJob.Status.DONE:
+        status["download_url"] = reverse("disk:archive_job_download", args=[job.pk])
+        status["expires_at"] = job.expires_at.isoformat()
+    if job.status == ArchiveJob.Status.FAILED:
+        status["error"] = job.error
+    return status
+
+
+@staff_member_required
+def cache_stats(request) -> JsonResponse:
+    """
+    Report listing cache counters of the worker process serving the request.
+
+    Returns:
+        JsonResponse with hit, miss and refresh counts
+    """
+    return JsonResponse(CacheService.get_stats())
+
+
+@staff_member_required
+def api_stats(request) -> JsonResponse:
+    """
+    Report the Yandex.Disk API rate limiter and hedging state.
+
+    Returns:
+        JsonResponse with the current rate and concurrency limits, calls in
+        flight, throttling and wait counters, and hedging counters of the
+        worker process
+    """
+    stats = api_limiter.get_stats()
+    stats["hedging"] = api_hedging.get_stats()
+    return JsonResponse(stats)
+
+
 def handle_download_error(request, error_message: str) -> HttpResponse:
     """
     Handle download errors gracefully.
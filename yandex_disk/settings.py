@@ -11,6 +11,7 @@ https://docs.djangoproject.com/en/5.1/ref/settings/
 """
 
 import os
+import tempfile
 from pathlib import Path
 from dotenv import load_dotenv
 from django.contrib.messages import constants as message_constants
@@ -89,7 +90,8 @@ TEMPLATES = [
     },
 ]
 
-WSGI_APPLICATION = "config.wsgi.application"
+WSGI_APPLICATION = "yandex_disk.wsgi.application"
+ASGI_APPLICATION = "yandex_disk.asgi.application"
 
 
 # Database
@@ -99,6 +101,12 @@ DATABASES = {
     "default": {
         "ENGINE": "django.db.backends.sqlite3",
         "NAME": BASE_DIR / "db.sqlite3",
+        # Archive job workers write from their own threads; wait for locks
+        # instead of failing at once
+        "OPTIONS": {"timeout": 20},
+        # A file, unlike the default in-memory database, lets worker threads
+        # of tests wait for locks too
+        "TEST": {"NAME": BASE_DIR / "test_db.sqlite3"},
     }
 }
 
@@ -161,8 +169,119 @@ CACHES = {
     }
 }
 
+# Share cached listings and links between worker processes (requires redis-py)
+if os.getenv("REDIS_URL"):
+    CACHES["default"] = {
+        "BACKEND": "django.core.cache.backends.redis.RedisCache",
+        "LOCATION": os.getenv("REDIS_URL"),
+    }
+
 MAX_ZIPFILE_SIZE = 500 * 1024 * 1024
 
+# Yandex.Disk API
+# Public resources endpoint; point at `manage.py fake_yandex_disk` to work offline
+YANDEX_DISK_API_URL = os.getenv(
+    "YANDEX_DISK_API_URL", "https://cloud-api.yandex.net/v1/disk/public"
+)
+# Shared HTTP client, one per worker process
+YANDEX_DISK_HTTP_POOL_CONNECTIONS = int(
+    os.getenv("YANDEX_DISK_HTTP_POOL_CONNECTIONS", 10)
+)
+YANDEX_DISK_HTTP_POOL_MAXSIZE = int(os.getenv("YANDEX_DISK_HTTP_POOL_MAXSIZE", 32))
+YANDEX_DISK_HTTP_CONNECT_TIMEOUT = float(
+    os.getenv("YANDEX_DISK_HTTP_CONNECT_TIMEOUT", 5)
+)
+YANDEX_DISK_HTTP_READ_TIMEOUT = float(os.getenv("YANDEX_DISK_HTTP_READ_TIMEOUT", 30))
+YANDEX_DISK_HTTP_RETRIES = int(os.getenv("YANDEX_DISK_HTTP_RETRIES", 3))
+YANDEX_DISK_HTTP_BACKOFF = float(os.getenv("YANDEX_DISK_HTTP_BACKOFF", 0.5))
+# Async views under ASGI: one client per event loop holding many connections
+YANDEX_DISK_ASYNC_VIEWS = os.getenv("YANDEX_DISK_ASYNC_VIEWS", "False") == "True"
+YANDEX_DISK_ASYNC_MAX_CONNECTIONS = int(
+    os.getenv("YANDEX_DISK_ASYNC_MAX_CONNECTIONS", 1000)
+)
+# Shared API rate limit in calls per second across all worker processes,
+# lowered on throttling and raised again by the step each second
+YANDEX_DISK_API_RATE = float(os.getenv("YANDEX_DISK_API_RATE", 20))
+YANDEX_DISK_API_MIN_RATE = float(os.getenv("YANDEX_DISK_API_MIN_RATE", 1))
+YANDEX_DISK_API_RATE_STEP = float(os.getenv("YANDEX_DISK_API_RATE_STEP", 1))
+# API calls in flight per worker process
+YANDEX_DISK_API_MAX_CONCURRENCY = int(os.getenv("YANDEX_DISK_API_MAX_CONCURRENCY", 16))
+# Hedged API calls: resend a call slower than the latency percentile, with
+# extra calls capped at the ratio of all calls
+YANDEX_DISK_HEDGE_REQUESTS = os.getenv("YANDEX_DISK_HEDGE_REQUESTS", "False") == "True"
+YANDEX_DISK_HEDGE_PERCENTILE = float(os.getenv("YANDEX_DISK_HEDGE_PERCENTILE", 95))
+YANDEX_DISK_HEDGE_RATIO = float(os.getenv("YANDEX_DISK_HEDGE_RATIO", 0.05))
+YANDEX_DISK_HEDGE_MIN_DELAY = float(os.getenv("YANDEX_DISK_HEDGE_MIN_DELAY", 0.05))
+
+YANDEX_DISK_PAGE_SIZE = int(os.getenv("YANDEX_DISK_PAGE_SIZE", 200))
+YANDEX_DISK_LINK_WORKERS = int(os.getenv("YANDEX_DISK_LINK_WORKERS", 16))
+YANDEX_DISK_CRAWL_WORKERS = int(os.getenv("YANDEX_DISK_CRAWL_WORKERS", 8))
+YANDEX_DISK_CRAWL_MAX_DEPTH = int(os.getenv("YANDEX_DISK_CRAWL_MAX_DEPTH", 10))
+YANDEX_DISK_CRAWL_MAX_NODES = int(os.getenv("YANDEX_DISK_CRAWL_MAX_NODES", 10000))
+# Bulk archives: files downloaded ahead of the writer and their memory budget
+YANDEX_DISK_ARCHIVE_PREFETCH = int(os.getenv("YANDEX_DISK_ARCHIVE_PREFETCH", 4))
+YANDEX_DISK_ARCHIVE_SPOOL_MEMORY = int(
+    os.getenv("YANDEX_DISK_ARCHIVE_SPOOL_MEMORY", 64 * 1024 * 1024)
+)
+# Entries of unknown type are sampled and stored when their entropy is high
+YANDEX_DISK_ARCHIVE_ENTROPY_SAMPLE = int(
+    os.getenv("YANDEX_DISK_ARCHIVE_ENTROPY_SAMPLE", 16 * 1024)
+)
+YANDEX_DISK_ARCHIVE_ENTROPY_THRESHOLD = 7.5
+# Compress DEFLATE entries in blocks on this many threads; 0 compresses inline
+YANDEX_DISK_ARCHIVE_COMPRESS_WORKERS = int(
+    os.getenv("YANDEX_DISK_ARCHIVE_COMPRESS_WORKERS", 0)
+)
+YANDEX_DISK_ARCHIVE_COMPRESS_BLOCK = 1024 * 1024
+# Rows per page in the file browser
+YANDEX_DISK_BROWSER_PAGE_SIZE = int(os.getenv("YANDEX_DISK_BROWSER_PAGE_SIZE", 100))
+# Folder listings are fresh for LISTING_TTL seconds, then served stale for
+# up to LISTING_STALE_TTL more while they are refreshed in the background
+YANDEX_DISK_LISTING_TTL = int(os.getenv("YANDEX_DISK_LISTING_TTL", 5 * 60))
+YANDEX_DISK_LISTING_STALE_TTL = int(os.getenv("YANDEX_DISK_LISTING_STALE_TTL", 60 * 60))
+YANDEX_DISK_LISTING_REFRESH_WORKERS = 4
+# Keep listings in the database so they survive restarts
+YANDEX_DISK_METADATA_STORE = os.getenv("YANDEX_DISK_METADATA_STORE", "True") == "True"
+# Per-process LRU in front of the shared cache
+YANDEX_DISK_LISTING_LOCAL_SIZE = int(os.getenv("YANDEX_DISK_LISTING_LOCAL_SIZE", 128))
+YANDEX_DISK_LISTING_LOCAL_TTL = int(os.getenv("YANDEX_DISK_LISTING_LOCAL_TTL", 30))
+# Compress encoded listings larger than this many bytes, 0 disables. Worth
+# enabling with a networked cache backend, where payload size dominates
+YANDEX_DISK_LISTING_COMPRESS_THRESHOLD = int(
+    os.getenv("YANDEX_DISK_LISTING_COMPRESS_THRESHOLD", 0)
+)
+# On-disk cache of downloaded files, shared by the workers of a host; an
+# empty directory or a zero budget disables it. Off unless a directory,
+# best outside the source tree, is configured
+YANDEX_DISK_BLOB_CACHE_DIR = os.getenv("YANDEX_DISK_BLOB_CACHE_DIR", "")
+YANDEX_DISK_BLOB_CACHE_MAX_BYTES = int(
+    os.getenv("YANDEX_DISK_BLOB_CACHE_MAX_BYTES", 10 * 1024**3)
+)
+YANDEX_DISK_BLOB_CACHE_MAX_FILE_SIZE = int(
+    os.getenv("YANDEX_DISK_BLOB_CACHE_MAX_FILE_SIZE", 1024**3)
+)
+# Background archive jobs: concurrent jobs per process, result directory,
+# how long finished archives are kept, when a silent job counts as lost and
+# how often expired and lost jobs are looked for
+YANDEX_DISK_ARCHIVE_JOB_WORKERS = int(os.getenv("YANDEX_DISK_ARCHIVE_JOB_WORKERS", 2))
+YANDEX_DISK_ARCHIVE_JOB_DIR = os.getenv(
+    "YANDEX_DISK_ARCHIVE_JOB_DIR",
+    os.path.join(tempfile.gettempdir(), "yandex_disk_archive_jobs"),
+)
+YANDEX_DISK_ARCHIVE_JOB_TTL = int(os.getenv("YANDEX_DISK_ARCHIVE_JOB_TTL", 60 * 60))
+YANDEX_DISK_ARCHIVE_JOB_STALE_AFTER = int(
+    os.getenv("YANDEX_DISK_ARCHIVE_JOB_STALE_AFTER", 10 * 60)
+)
+YANDEX_DISK_ARCHIVE_JOB_CHECK_INTERVAL = float(
+    os.getenv("YANDEX_DISK_ARCHIVE_JOB_CHECK_INTERVAL", 60)
+)
+# Seconds a request waits for an identical fetch running in another process
+YANDEX_DISK_SINGLE_FLIGHT_TIMEOUT = int(
+    os.getenv("YANDEX_DISK_SINGLE_FLIGHT_TIMEOUT", 30)
+)
+# Resolved download links expire upstream, keep them well below that
+YANDEX_DISK_HREF_TTL = int(os.getenv("YANDEX_DISK_HREF_TTL", 10 * 60))
+
 LOGGING = {
     "version": 1,
     "disable_existing_loggers": False,
@@ -199,7 +318,19 @@ MIME_TYPES = {
     "pdf": "application/pdf",
     "doc": "application/msword",
     "docx": "application/vnd.openxmlformats-officedocument.wordprocessingml.document",
-    "png": "application/png",
+    "png": "image/png",
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "heic": "image/heic",
+    "webp": "image/webp",
+    "mp4": "video/mp4",
+    "mov": "video/quicktime",
+    "mkv": "video/x-matroska",
+    "mp3": "audio/mpeg",
+    "flac": "audio/flac",
+    "zip": "application/zip",
+    "rar": "application/x-rar",
+    "7z": "application/x-7z-compressed",
     # Add more as needed
 }
 